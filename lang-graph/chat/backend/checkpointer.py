@@ -0,0 +1,400 @@
+"""
+持久化的对话检查点存储
+
+替代 MemorySaver：检查点写入SQLite文件，服务重启后对话历史仍在，多个worker进程共享同一份数据。
+存储规模有上限，长时间运行时内存和磁盘占用保持平稳：
+
+- 压缩：接口只读取每个对话的最新状态，写入新检查点后删除同一对话的旧检查点及其中间写入
+- 过期：超过 ttl_seconds 未访问（读或写）的对话被删除
+- 容量：对话数超过 max_conversations 时，按最近访问时间淘汰最久未使用的对话（LRU）
+
+配置（环境变量，见 create_checkpointer）：
+    CHAT_CHECKPOINT_DB          SQLite文件路径
+    CHAT_CONVERSATION_TTL_HOURS 对话过期时间（小时），0表示不过期
+    CHAT_MAX_CONVERSATIONS      最多保存的对话数，0表示不限制
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+)
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    thread_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS conversations_last_access ON conversations (last_access);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata_type TEXT,
+    metadata BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    task_path TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+
+class SQLiteCheckpointSaver(BaseCheckpointSaver):
+    """基于SQLite的检查点存储，带压缩、过期和LRU容量限制"""
+
+    def __init__(self,
+                 path: str,
+                 ttl_seconds: Optional[float] = None,
+                 max_conversations: Optional[int] = None,
+                 keep_checkpoints: int = 1,
+                 sweep_interval: float = 60.0):
+        """
+        打开（或创建）检查点数据库
+
+        Args:
+            path: SQLite文件路径，":memory:" 表示不持久化（用于测试）
+            ttl_seconds: 对话超过该时间未访问即删除，None表示不过期
+            max_conversations: 最多保存的对话数，超出时淘汰最久未访问的，None表示不限制
+            keep_checkpoints: 每个对话保留的最新检查点数
+            sweep_interval: 清理过期对话的最小间隔（秒）
+        """
+        super().__init__()
+        if keep_checkpoints < 1:
+            raise ValueError("keep_checkpoints 至少为1")
+        self.path = path
+        self.ttl_seconds = ttl_seconds or None
+        self.max_conversations = max_conversations or None
+        self.keep_checkpoints = keep_checkpoints
+        self.sweep_interval = sweep_interval
+
+        directory = os.path.dirname(os.path.abspath(path))
+        if path != ":memory:" and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        # 多个线程（asyncio.to_thread）共用一个连接，由锁串行化；多个进程通过SQLite文件锁协调
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30.0)
+        self.lock = threading.Lock()
+        with self.lock:
+            # auto_vacuum 只在建表前设置才生效，使删除后的空闲页可以归还给文件系统
+            self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            self.conn.execute("PRAGMA synchronous = NORMAL")
+            self.conn.executescript(SCHEMA)
+            self.conn.commit()
+        self._last_sweep = 0.0
+        self.evict_conversations()
+
+    # ------------------------------------------------------------------
+    # 对话访问记录与淘汰
+    # ------------------------------------------------------------------
+
+    def _expired_before(self, now: float) -> Optional[float]:
+        return now - self.ttl_seconds if self.ttl_seconds is not None else None
+
+    def _touch(self, thread_id: str, now: float) -> bool:
+        """记录对话的访问时间，返回是否为新对话（调用方持有锁）"""
+        cursor = self.conn.execute(
+            "UPDATE conversations SET last_access = ? WHERE thread_id = ?", (now, thread_id))
+        if cursor.rowcount:
+            return False
+        self.conn.execute(
+            "INSERT INTO conversations (thread_id, created_at, last_access) VALUES (?, ?, ?)",
+            (thread_id, now, now))
+        return True
+
+    def _delete_threads(self, thread_ids: Sequence[str]) -> None:
+        """删除对话的全部数据（调用方持有锁）"""
+        for table in ("writes", "checkpoints", "conversations"):
+            self.conn.executemany(f"DELETE FROM {table} WHERE thread_id = ?",
+                                  [(thread_id,) for thread_id in thread_ids])
+
+    def _evict(self, now: float, keep: Optional[str] = None) -> int:
+        """删除过期对话和超出容量的最久未访问对话，keep 为不淘汰的对话（调用方持有锁）"""
+        victims: List[str] = []
+        expired_before = self._expired_before(now)
+        if expired_before is not None:
+            victims += [row[0] for row in self.conn.execute(
+                "SELECT thread_id FROM conversations WHERE last_access < ? AND thread_id IS NOT ?",
+                (expired_before, keep))]
+        if self.max_conversations is not None:
+            # 刚写入的对话不参与排序：时钟精度不足时它的访问时间可能与其他对话相同
+            victims += [row[0] for row in self.conn.execute(
+                "SELECT thread_id FROM conversations WHERE thread_id IS NOT ? "
+                "ORDER BY last_access DESC LIMIT -1 OFFSET ?",
+                (keep, self.max_conversations - (keep is not None)))]
+        victims = sorted(set(victims))
+        if victims:
+            self._delete_threads(victims)
+        self._last_sweep = now
+        return len(victims)
+
+    def evict_conversations(self) -> int:
+        """
+        立即清理过期对话和超出容量的对话，并回收空闲的数据库页
+
+        Returns:
+            删除的对话数
+        """
+        with self.lock:
+            removed = self._evict(time.time())
+            self.conn.commit()
+            if removed:
+                self.conn.execute("PRAGMA incremental_vacuum").fetchall()
+        if removed:
+            logger.info("[检查点] 清理 %d 个过期或超出容量的对话", removed)
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """对话数、检查点数和数据库文件大小"""
+        with self.lock:
+            conversations = self.conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+            checkpoints = self.conn.execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+            page_count = self.conn.execute("PRAGMA page_count").fetchone()[0]
+            page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+        return {"conversations": conversations, "checkpoints": checkpoints,
+                "db_bytes": page_count * page_size,
+                "ttl_seconds": self.ttl_seconds, "max_conversations": self.max_conversations}
+
+    # ------------------------------------------------------------------
+    # BaseCheckpointSaver 接口
+    # ------------------------------------------------------------------
+
+    def _load_writes(self, thread_id: str, checkpoint_ns: str,
+                     checkpoint_id: str) -> List[Tuple[str, str, Any]]:
+        rows = self.conn.execute(
+            "SELECT task_id, channel, type, value FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? "
+            "ORDER BY task_path, task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id)).fetchall()
+        return [(task_id, channel, self.serde.loads_typed((type_, value)))
+                for task_id, channel, type_, value in rows]
+
+    def _to_tuple(self, row: tuple) -> CheckpointTuple:
+        (thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id,
+         type_, checkpoint, metadata_type, metadata) = row
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id,
+                                     "checkpoint_ns": checkpoint_ns,
+                                     "checkpoint_id": checkpoint_id}},
+            checkpoint=self.serde.loads_typed((type_, checkpoint)),
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config=({"configurable": {"thread_id": thread_id,
+                                             "checkpoint_ns": checkpoint_ns,
+                                             "checkpoint_id": parent_checkpoint_id}}
+                           if parent_checkpoint_id else None),
+            pending_writes=self._load_writes(thread_id, checkpoint_ns, checkpoint_id),
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        checkpoint_id = configurable.get("checkpoint_id")
+        columns = ("thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, "
+                   "type, checkpoint, metadata_type, metadata")
+        now = time.time()
+        with self.lock:
+            access = self.conn.execute(
+                "SELECT last_access FROM conversations WHERE thread_id = ?",
+                (thread_id,)).fetchone()
+            if access is None:
+                return None
+            expired_before = self._expired_before(now)
+            if expired_before is not None and access[0] < expired_before:
+                # 尚未被定期清理的过期对话按不存在处理
+                self._delete_threads([thread_id])
+                self.conn.commit()
+                return None
+            if checkpoint_id:
+                row = self.conn.execute(
+                    f"SELECT {columns} FROM checkpoints "
+                    "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id)).fetchone()
+            else:
+                row = self.conn.execute(
+                    f"SELECT {columns} FROM checkpoints "
+                    "WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns)).fetchone()
+            if row is None:
+                return None
+            self._touch(thread_id, now)
+            self.conn.commit()
+            return self._to_tuple(row)
+
+    def list(self,
+             config: Optional[RunnableConfig],
+             *,
+             filter: Optional[Dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None,
+             limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        clauses, params = [], []
+        if config is not None:
+            configurable = config["configurable"]
+            clauses.append("thread_id = ?")
+            params.append(configurable["thread_id"])
+            if configurable.get("checkpoint_ns") is not None:
+                clauses.append("checkpoint_ns = ?")
+                params.append(configurable["checkpoint_ns"])
+            if configurable.get("checkpoint_id"):
+                clauses.append("checkpoint_id = ?")
+                params.append(configurable["checkpoint_id"])
+        if before is not None and before["configurable"].get("checkpoint_id"):
+            clauses.append("checkpoint_id < ?")
+            params.append(before["configurable"]["checkpoint_id"])
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, "
+                f"type, checkpoint, metadata_type, metadata FROM checkpoints {where} "
+                "ORDER BY checkpoint_id DESC", params).fetchall()
+            tuples = [self._to_tuple(row) for row in rows]
+        count = 0
+        for item in tuples:
+            if filter and any(item.metadata.get(key) != value for key, value in filter.items()):
+                continue
+            yield item
+            count += 1
+            if limit is not None and count >= limit:
+                break
+
+    def put(self,
+            config: RunnableConfig,
+            checkpoint: Checkpoint,
+            metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        type_, serialized_checkpoint = self.serde.dumps_typed(checkpoint)
+        metadata_type, serialized_metadata = self.serde.dumps_typed(dict(metadata))
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id, "
+                "parent_checkpoint_id, type, checkpoint, metadata_type, metadata) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, checkpoint_ns, checkpoint["id"], configurable.get("checkpoint_id"),
+                 type_, serialized_checkpoint, metadata_type, serialized_metadata))
+            # 压缩：只保留最新的 keep_checkpoints 个检查点及其写入
+            self.conn.execute(
+                "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                "AND checkpoint_id NOT IN (SELECT checkpoint_id FROM checkpoints "
+                "WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC LIMIT ?)",
+                (thread_id, checkpoint_ns, thread_id, checkpoint_ns, self.keep_checkpoints))
+            self.conn.execute(
+                "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? "
+                "AND checkpoint_id NOT IN (SELECT checkpoint_id FROM checkpoints "
+                "WHERE thread_id = ? AND checkpoint_ns = ?)",
+                (thread_id, checkpoint_ns, thread_id, checkpoint_ns))
+            is_new = self._touch(thread_id, now)
+            # 新对话可能超出容量上限，立即淘汰；过期清理按 sweep_interval 定期进行
+            if is_new or now - self._last_sweep >= self.sweep_interval:
+                self._evict(now, keep=thread_id)
+            self.conn.commit()
+        return {"configurable": {"thread_id": thread_id,
+                                 "checkpoint_ns": checkpoint_ns,
+                                 "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self,
+                   config: RunnableConfig,
+                   writes: Sequence[Tuple[str, Any]],
+                   task_id: str,
+                   task_path: str = "") -> None:
+        configurable = config["configurable"]
+        # 特殊通道（错误、中断等）的写入覆盖旧值，普通写入只保留第一次
+        verb = ("INSERT OR REPLACE" if all(channel in WRITES_IDX_MAP for channel, _ in writes)
+                else "INSERT OR IGNORE")
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, serialized = self.serde.dumps_typed(value)
+            rows.append((configurable["thread_id"], configurable.get("checkpoint_ns", ""),
+                         configurable["checkpoint_id"], task_id,
+                         WRITES_IDX_MAP.get(channel, idx), channel, type_, serialized, task_path))
+        with self.lock:
+            self.conn.executemany(
+                f"{verb} INTO writes (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, "
+                "channel, type, value, task_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.conn.commit()
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self.lock:
+            self._delete_threads([thread_id])
+            self.conn.commit()
+
+    # SQLite调用在工作线程中执行，不阻塞事件循环
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self,
+                    config: Optional[RunnableConfig],
+                    *,
+                    filter: Optional[Dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None,
+                    limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self,
+                   config: RunnableConfig,
+                   checkpoint: Checkpoint,
+                   metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self,
+                          config: RunnableConfig,
+                          writes: Sequence[Tuple[str, Any]],
+                          task_id: str,
+                          task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+def create_checkpointer() -> SQLiteCheckpointSaver:
+    """按环境变量创建检查点存储"""
+    path = os.getenv("CHAT_CHECKPOINT_DB", "./chat_checkpoints.sqlite")
+    ttl_hours = float(os.getenv("CHAT_CONVERSATION_TTL_HOURS", "168"))
+    max_conversations = int(os.getenv("CHAT_MAX_CONVERSATIONS", "10000"))
+    logger.info(f"[配置] 对话检查点: db={path}, ttl={ttl_hours}h, max={max_conversations}")
+    return SQLiteCheckpointSaver(
+        path,
+        ttl_seconds=ttl_hours * 3600 if ttl_hours > 0 else None,
+        max_conversations=max_conversations if max_conversations > 0 else None,
+    )
@@ -5,9 +5,9 @@ import logging
 import os
 from typing import Any, AsyncGenerator, Dict
 
+from checkpointer import create_checkpointer
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import END, StateGraph
 from llm import create_llm, get_llm_config
 from pydantic import BaseModel
@@ -76,7 +76,21 @@ workflow = StateGraph(ChatState)
 workflow.add_node("generate_response", generate_response)
 workflow.set_entry_point("generate_response")
 workflow.add_edge("generate_response", END)
-app_graph = workflow.compile(checkpointer=MemorySaver())
+# 对话状态持久化到SQLite，带过期和容量限制（见 checkpointer.py）
+checkpointer = create_checkpointer()
+app_graph = workflow.compile(checkpointer=checkpointer)
+
+async def save_streamed_turn(config: Dict[str, Any], messages: list, content: str) -> None:
+    """保存流式生成的回复：直接写入状态并记为 generate_response 节点的输出，不再调用LLM"""
+    messages.append({
+        "role": "assistant",
+        "content": content
+    })
+    await app_graph.aupdate_state(
+        config,
+        {"messages": messages, "current_message": content, "is_complete": True},
+        as_node="generate_response",
+    )
 
 class ChatRequest(BaseModel):
     message: str
@@ -156,12 +170,7 @@ async def chat_stream(message: str, conversation_id: str = "default"):
                     }
             logger.info("[流程] LLM token流式推理完成")
             # 保存AI回复到对话历史
-            messages.append({
-                "role": "assistant",
-                "content": full_content
-            })
-            new_state = ChatState(messages=messages)
-            await app_graph.ainvoke(new_state, config)
+            await save_streamed_turn(config, messages, full_content)
             yield {
                 "event": "complete",
                 "data": json.dumps({
@@ -210,12 +219,7 @@ async def chat_stream_post(request: Request):
                     full_content += delta
                     yield delta  # 直接返回文本 chunk，前端 fetch+流可直接拼接
             # 保存AI回复到对话历史
-            messages.append({
-                "role": "assistant",
-                "content": full_content
-            })
-            new_state = ChatState(messages=messages)
-            await app_graph.ainvoke(new_state, config)
+            await save_streamed_turn(config, messages, full_content)
         except Exception as e:
             logger.error(f"[异常] /chat/stream (POST) 处理失败: {e}")
             yield "[ERROR] " + str(e)
@@ -237,8 +241,7 @@ async def get_conversation(conversation_id: str):
 async def delete_conversation(conversation_id: str):
     logger.info(f"[API] /conversations/{conversation_id} 删除对话")
     try:
-        config = {"configurable": {"thread_id": conversation_id}}
-        await app_graph.adelete(config)
+        await checkpointer.adelete_thread(conversation_id)
         return {"message": "Conversation deleted successfully"}
     except Exception as e:
         logger.error(f"[异常] 删除对话失败: {e}")
@@ -254,6 +257,7 @@ async def get_config_status():
         deployment_name = config_status["deployment"]
         
         config_status["status"] = "configured" if all([azure_endpoint, azure_api_key, deployment_name]) else "incomplete"
+        config_status["checkpointer"] = checkpointer.stats()
         return config_status
     except Exception as e:
         logger.error(f"[异常] 获取配置状态失败: {e}")
@@ -0,0 +1,193 @@
+"""
+SQLiteCheckpointSaver 测试：读写最新检查点、压缩、过期、LRU容量、list 的过滤和分页、删除对话
+"""
+
+import asyncio
+
+import pytest
+
+try:
+    from langgraph.checkpoint.base import empty_checkpoint
+    from langgraph.checkpoint.base.id import uuid6
+except Exception as e:  # langgraph-checkpoint 与 langchain-core 版本不匹配时无法导入
+    pytest.skip(f"无法导入 langgraph.checkpoint: {type(e).__name__}: {e}", allow_module_level=True)
+
+import checkpointer
+from checkpointer import SQLiteCheckpointSaver, create_checkpointer
+
+
+class Clock:
+    """可手动推进的时间，替换 checkpointer 模块中的 time.time"""
+
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(checkpointer.time, "time", clock)
+    return clock
+
+
+def _config(thread_id, checkpoint_id=None):
+    configurable = {"thread_id": thread_id, "checkpoint_ns": ""}
+    if checkpoint_id:
+        configurable["checkpoint_id"] = checkpoint_id
+    return {"configurable": configurable}
+
+
+def _put(saver, thread_id, step, parent=None):
+    """写入一个检查点，channel_values 中记录步数，返回其配置"""
+    checkpoint = {**empty_checkpoint(), "id": str(uuid6(clock_seq=step)),
+                  "channel_values": {"step": step}}
+    return saver.put(parent or _config(thread_id), checkpoint,
+                     {"source": "loop", "step": step}, {})
+
+
+def _checkpoint_ids(saver, thread_id):
+    return [row[0] for row in saver.conn.execute(
+        "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? ORDER BY checkpoint_id",
+        (thread_id,))]
+
+
+def test_put_then_get_returns_latest(tmp_path):
+    saver = SQLiteCheckpointSaver(str(tmp_path / "db" / "checkpoints.sqlite"), keep_checkpoints=3)
+    first = _put(saver, "t1", 1)
+    second = _put(saver, "t1", 2, parent=first)
+    saver.put_writes(second, [("messages", "你好")], task_id="task-1")
+
+    latest = saver.get_tuple(_config("t1"))
+
+    assert latest.config == second
+    assert latest.checkpoint["channel_values"] == {"step": 2}
+    assert latest.metadata == {"source": "loop", "step": 2}
+    assert latest.parent_config == first
+    assert latest.pending_writes == [("task-1", "messages", "你好")]
+    # 指定 checkpoint_id 读取历史检查点
+    assert saver.get_tuple(first).checkpoint["channel_values"] == {"step": 1}
+    assert saver.get_tuple(_config("missing")) is None
+    saver.close()
+
+    # 重新打开后数据仍在
+    reopened = SQLiteCheckpointSaver(str(tmp_path / "db" / "checkpoints.sqlite"))
+    assert reopened.get_tuple(_config("t1")).config == second
+    reopened.close()
+
+
+def test_compaction_keeps_latest_checkpoints_and_their_writes():
+    saver = SQLiteCheckpointSaver(":memory:", keep_checkpoints=2)
+    configs = []
+    for step in range(4):
+        configs.append(_put(saver, "t1", step, parent=configs[-1] if configs else None))
+        saver.put_writes(configs[-1], [("messages", f"第{step}步")], task_id=f"task-{step}")
+
+    kept = [config["configurable"]["checkpoint_id"] for config in configs[-2:]]
+    assert _checkpoint_ids(saver, "t1") == kept
+    # 被删除的检查点的中间写入一并删除
+    written = {row[0] for row in saver.conn.execute("SELECT checkpoint_id FROM writes")}
+    assert written == set(kept)
+    assert saver.stats()["checkpoints"] == 2
+
+    with pytest.raises(ValueError):
+        SQLiteCheckpointSaver(":memory:", keep_checkpoints=0)
+
+
+def test_expired_conversation_dropped_on_read(clock):
+    saver = SQLiteCheckpointSaver(":memory:", ttl_seconds=100, sweep_interval=1e9)
+    _put(saver, "old", 1)
+    clock.now += 50
+    _put(saver, "new", 1)
+    clock.now += 60
+
+    assert saver.get_tuple(_config("old")) is None
+    assert _checkpoint_ids(saver, "old") == []
+    # 读取会刷新访问时间
+    assert saver.get_tuple(_config("new")) is not None
+    clock.now += 90
+    assert saver.get_tuple(_config("new")) is not None
+
+
+def test_expired_conversations_dropped_on_sweep(clock):
+    saver = SQLiteCheckpointSaver(":memory:", ttl_seconds=100)
+    _put(saver, "a", 1)
+    _put(saver, "b", 1)
+    clock.now += 50
+    _put(saver, "c", 1)
+    clock.now += 60
+
+    assert saver.evict_conversations() == 2
+    assert saver.stats()["conversations"] == 1
+    assert _checkpoint_ids(saver, "a") == []
+    assert saver.get_tuple(_config("c")) is not None
+
+
+def test_lru_eviction_keeps_just_written_conversation(clock):
+    saver = SQLiteCheckpointSaver(":memory:", max_conversations=2)
+    _put(saver, "a", 1)
+    clock.now += 1
+    _put(saver, "b", 1)
+    clock.now += 1
+    saver.get_tuple(_config("a"))
+    clock.now += 1
+    _put(saver, "c", 1)
+
+    # b 最久未访问
+    assert {row[0] for row in saver.conn.execute("SELECT thread_id FROM conversations")} == {"a", "c"}
+
+    # 时钟不前进时访问时间相同，刚写入的对话也不会被淘汰
+    for thread_id in ("d", "e", "f", "0", "1"):
+        _put(saver, thread_id, 1)
+        assert saver.get_tuple(_config(thread_id)) is not None
+    assert saver.stats()["conversations"] == 2
+
+
+def test_list_filter_before_and_limit():
+    saver = SQLiteCheckpointSaver(":memory:", keep_checkpoints=5)
+    configs = [_put(saver, "t1", step) for step in range(4)]
+    _put(saver, "t2", 9)
+
+    def steps(config, **kwargs):
+        return [item.metadata["step"] for item in saver.list(config, **kwargs)]
+
+    assert steps(_config("t1")) == [3, 2, 1, 0]
+    assert steps(None) == [9, 3, 2, 1, 0]
+    assert steps(_config("t1"), filter={"step": 2}) == [2]
+    assert steps(_config("t1"), before=configs[2]) == [1, 0]
+    assert steps(_config("t1"), limit=2) == [3, 2]
+    assert steps(_config("t1"), before=configs[3], limit=1) == [2]
+    assert steps(configs[1]) == [1]
+
+
+def test_adelete_thread_removes_conversation():
+    saver = SQLiteCheckpointSaver(":memory:")
+    config = _put(saver, "t1", 1)
+    saver.put_writes(config, [("messages", "你好")], task_id="task-1")
+    _put(saver, "t2", 1)
+
+    async def run():
+        await saver.adelete_thread("t1")
+        return await saver.aget_tuple(_config("t1")), await saver.aget_tuple(_config("t2"))
+
+    deleted, kept = asyncio.run(run())
+
+    assert deleted is None
+    assert kept is not None
+    assert saver.conn.execute("SELECT COUNT(*) FROM writes").fetchone()[0] == 0
+    assert saver.stats()["conversations"] == 1
+
+
+def test_create_checkpointer_reads_environment(monkeypatch, tmp_path):
+    monkeypatch.setenv("CHAT_CHECKPOINT_DB", str(tmp_path / "chat.sqlite"))
+    monkeypatch.setenv("CHAT_CONVERSATION_TTL_HOURS", "0")
+    monkeypatch.setenv("CHAT_MAX_CONVERSATIONS", "5")
+
+    saver = create_checkpointer()
+
+    assert saver.path == str(tmp_path / "chat.sqlite")
+    assert saver.ttl_seconds is None
+    assert saver.max_conversations == 5
+    saver.close()
@@ -5,22 +5,31 @@
 
 import os
 import asyncio
-from typing import List, Dict, Any, AsyncIterator
+from typing import List, Dict, Any, AsyncIterator, Iterator, Optional
+import httpx
 from dotenv import load_dotenv
 
-from langchain_core.documents import Document
+from langchain_core.documents import BaseDocumentCompressor, Document
 from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-from langchain_core.callbacks import StreamingStdOutCallbackHandler
 
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_community.vectorstores import Chroma
-from langchain_community.document_loaders import PyPDFLoader, UnstructuredMarkdownLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain.retrievers import EnsembleRetriever, BM25Retriever
 from langchain.retrievers.document_compressors import LLMChainExtractor
-from langchain.retrievers import ContextualCompressionRetriever
+
+from bm25_index import BM25Index
+from context_compressor import ExtractiveCompressor
+from context_packer import ContextPacker
+from embedding_cache import CachedEmbeddings, default_cache_path
+from embedding_pipeline import BatchedEmbeddings
+from hybrid_retriever import FUSION_METHODS, HybridRetriever
+from index_watcher import IndexWatcher
+from ingest_manifest import compute_chunk_ids
+from matryoshka import (embedding_fingerprint, load_fingerprint, reduce_dimensions,
+                        save_fingerprint)
+from metadata_filter import MetadataFilter, record_file_attributes
+from parallel_loader import SUPPORTED_EXTENSIONS, iter_documents, load_file
+from rag_pipeline import RetrievalEvent, SourcedRAGChain, StreamEvent, TokenEvent
+from streaming_splitter import StreamingTextSplitter
 
 # 加载环境变量
 load_dotenv()
@@ -31,7 +40,17 @@ class AdvancedRAGSystem:
     def __init__(self, 
                  model_name: str = "gpt-4", 
                  temperature: float = 0.1,
-                 streaming: bool = True):
+                 streaming: bool = True,
+                 loader_workers: Optional[int] = None,
+                 embedding_dimensions: Optional[int] = None,
+                 truncate_embeddings: bool = False,
+                 compression: Optional[str] = "extractive",
+                 context_token_budget: int = 1500,
+                 bm25_tokenizer: str = "cjk_bigram",
+                 fusion: str = "rrf",
+                 retrieval_timeout: Optional[float] = 5.0,
+                 http_client: Optional[httpx.Client] = None,
+                 http_async_client: Optional[httpx.AsyncClient] = None):
         """
         初始化高级RAG系统
         
@@ -39,39 +58,90 @@ class AdvancedRAGSystem:
             model_name: OpenAI模型名称
             temperature: 生成温度
             streaming: 是否启用流式响应
+            loader_workers: 文档加载进程数，默认为CPU核数
+            embedding_dimensions: 嵌入向量维度，None表示使用模型完整维度
+            truncate_embeddings: 是否在本地截断降维（否则通过API参数降维）
+            compression: 上下文压缩方式：extractive（本地词项打分抽取句子）、
+                semantic（本地按缓存嵌入打分抽取句子）、llm（每个文档调用一次LLM抽取）或None
+            context_token_budget: 提示中上下文的token数上限（本地抽取式压缩也使用此预算）
+            bm25_tokenizer: BM25分词器：cjk_bigram（中文二字组）、cjk_unigram 或 jieba
+            fusion: 混合检索融合方式：rrf（倒数排名融合）或 score（归一化得分加权）
+            retrieval_timeout: 向量检索和BM25检索各自的超时秒数
+            http_client: LLM和嵌入共用的HTTP连接池（同步请求），None时各自创建
+            http_async_client: LLM和嵌入共用的HTTP连接池（异步请求）
         """
+        if compression not in ("extractive", "semantic", "llm", None):
+            raise ValueError(f"不支持的压缩方式: {compression}")
+        if fusion not in FUSION_METHODS:
+            raise ValueError(f"不支持的融合方式: {fusion}，可选 {FUSION_METHODS}")
+
         self.model_name = model_name
         self.temperature = temperature
         self.streaming = streaming
-        
-        # 初始化回调处理器
-        callbacks = [StreamingStdOutCallbackHandler()] if streaming else []
-        
-        # 初始化OpenAI组件
+        self.loader_workers = loader_workers
+        self.compression = compression
+        self.context_token_budget = context_token_budget
+        self.bm25_tokenizer = bm25_tokenizer
+        self.fusion = fusion
+        self.retrieval_timeout = retrieval_timeout
+        self.chroma_directory = os.getenv("ADVANCED_CHROMA_PERSIST_DIRECTORY",
+                                          "./advanced_chroma_db")
+        self.bm25_directory = os.getenv("BM25_INDEX_DIRECTORY", "./advanced_bm25_index")
+        
+        # 初始化OpenAI组件（流式token通过 astream 事件产出，不再直接打印到stdout）
         self.llm = ChatOpenAI(
             model=model_name,
             temperature=temperature,
             streaming=streaming,
-            callbacks=callbacks
+            http_client=http_client,
+            http_async_client=http_async_client
         )
         
-        self.embeddings = OpenAIEmbeddings(
-            model="text-embedding-3-large"
+        # 嵌入结果缓存在本地，重建索引和重复查询不再调用API；
+        # 未命中的文本分批并发嵌入，进度写入同一文件的检查点表以便断点续传
+        cache_path = default_cache_path()
+        self.embeddings = CachedEmbeddings(
+            BatchedEmbeddings.from_env(
+                reduce_dimensions(
+                    OpenAIEmbeddings(model="text-embedding-3-large",
+                                     http_client=http_client,
+                                     http_async_client=http_async_client),
+                    embedding_dimensions,
+                    truncate=truncate_embeddings
+                ),
+                checkpoint_path=cache_path
+            ),
+            cache_path=cache_path
         )
         
         # 初始化高级文本分割器
-        self.text_splitter = RecursiveCharacterTextSplitter(
+        self.text_splitter = StreamingTextSplitter(
             chunk_size=1000,
             chunk_overlap=200,
-            add_start_index=True,
-            separators=["\n\n", "\n", " ", ""]
+            add_start_index=True
         )
         
         self.vectorstore = None
         self.retriever = None
-        self.compression_retriever = None
+        self.compressor = None
         self.rag_chain = None
     
+    def iter_documents_advanced(self, documents_path: str) -> Iterator[Document]:
+        """
+        流式加载文档 - 支持多种文件格式，目录中的文件由进程池并行解析
+        
+        Args:
+            documents_path: 文档路径
+            
+        Yields:
+            加载的文档，metadata 中记录来源文件、文件类型和摄取时间，可用于过滤检索
+        """
+        if os.path.isfile(documents_path):
+            yield from record_file_attributes(load_file(documents_path))
+        elif os.path.isdir(documents_path):
+            yield from record_file_attributes(
+                iter_documents(documents_path, max_workers=self.loader_workers))
+    
     def load_documents_advanced(self, documents_path: str) -> List[Document]:
         """
         高级文档加载 - 支持多种文件格式
@@ -82,42 +152,7 @@ class AdvancedRAGSystem:
         Returns:
             加载的文档列表
         """
-        documents = []
-        
-        if os.path.isfile(documents_path):
-            # 根据文件扩展名选择合适的加载器
-            if documents_path.endswith('.pdf'):
-                loader = PyPDFLoader(documents_path)
-            elif documents_path.endswith('.md'):
-                loader = UnstructuredMarkdownLoader(documents_path)
-            else:
-                # 默认使用文本加载器
-                from langchain_community.document_loaders import TextLoader
-                loader = TextLoader(documents_path, encoding='utf-8')
-            
-            documents = loader.load()
-        
-        elif os.path.isdir(documents_path):
-            # 遍历目录加载多种文件类型
-            for root, dirs, files in os.walk(documents_path):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    try:
-                        if file.endswith('.pdf'):
-                            loader = PyPDFLoader(file_path)
-                        elif file.endswith('.md'):
-                            loader = UnstructuredMarkdownLoader(file_path)
-                        elif file.endswith('.txt'):
-                            from langchain_community.document_loaders import TextLoader
-                            loader = TextLoader(file_path, encoding='utf-8')
-                        else:
-                            continue
-                        
-                        docs = loader.load()
-                        documents.extend(docs)
-                    except Exception as e:
-                        print(f"加载文件 {file_path} 时出错: {e}")
-        
+        documents = list(self.iter_documents_advanced(documents_path))
         print(f"成功加载 {len(documents)} 个文档")
         return documents
     
@@ -130,38 +165,192 @@ class AdvancedRAGSystem:
         """
         print("正在创建混合检索器...")
         
-        # 创建向量存储
+        # 向量库和BM25索引使用相同的片段ID
+        ids = compute_chunk_ids(documents)
+        
+        # 创建向量存储（先丢弃旧集合，避免重复向量和维度不一致）
+        Chroma(persist_directory=self.chroma_directory).delete_collection()
         self.vectorstore = Chroma.from_documents(
             documents=documents,
             embedding=self.embeddings,
-            persist_directory="./advanced_chroma_db"
+            ids=ids,
+            persist_directory=self.chroma_directory
         )
+        save_fingerprint(self.chroma_directory, self.embeddings)
         
-        # 创建向量检索器
-        vector_retriever = self.vectorstore.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": 6}
-        )
+        # 创建BM25索引（倒排索引保存到磁盘，下次启动可直接加载）
+        bm25_index = BM25Index(self.bm25_tokenizer)
+        bm25_index.add_documents(documents, ids=ids)
+        bm25_index.save(self.bm25_directory)
         
-        # 创建BM25检索器
-        bm25_retriever = BM25Retriever.from_documents(documents)
-        bm25_retriever.k = 6
+        self._create_hybrid(bm25_index)
+        print("混合检索器创建完成")
+    
+    def load_hybrid_retriever(self) -> bool:
+        """
+        从磁盘加载已构建的向量库和BM25索引，不重新分词和嵌入
         
-        # 创建集成检索器
-        self.retriever = EnsembleRetriever(
-            retrievers=[vector_retriever, bm25_retriever],
-            weights=[0.7, 0.3]  # 向量检索权重更高
+        Returns:
+            索引存在、嵌入配置一致并加载成功时返回True
+        """
+        if not (os.path.isdir(self.chroma_directory)
+                and BM25Index.exists(self.bm25_directory)):
+            return False
+        
+        # 嵌入模型、维度或降维方式变化后旧向量与查询向量不兼容，需要重建
+        indexed_with = load_fingerprint(self.chroma_directory)
+        fingerprint = embedding_fingerprint(self.embeddings)
+        if indexed_with != fingerprint:
+            print(f"向量库的嵌入配置 {indexed_with} 与当前配置 {fingerprint} 不一致，重建索引")
+            return False
+        
+        print("正在加载混合检索器...")
+        self.vectorstore = Chroma(
+            persist_directory=self.chroma_directory,
+            embedding_function=self.embeddings
         )
-        
-        # 创建压缩检索器（用于重排序和过滤）
-        compressor = LLMChainExtractor.from_llm(self.llm)
-        self.compression_retriever = ContextualCompressionRetriever(
-            base_compressor=compressor,
-            base_retriever=self.retriever
+        bm25_index = BM25Index.load(self.bm25_directory, tokenizer=self.bm25_tokenizer)
+        self._create_hybrid(bm25_index)
+        print(f"混合检索器加载完成（BM25索引 {len(bm25_index)} 个片段）")
+        return True
+    
+    def _create_hybrid(self, bm25_index: BM25Index) -> None:
+        """组合向量检索和BM25检索，并创建上下文压缩器"""
+        # 两路检索并发执行，按片段ID去重后融合
+        self.retriever = HybridRetriever(
+            vectorstore=self.vectorstore,
+            bm25_index=bm25_index,
+            k_dense=6,
+            k_sparse=6,
+            weights=(0.7, 0.3),  # 向量检索权重更高
+            fusion=self.fusion,
+            timeout=self.retrieval_timeout
         )
         
-        print("混合检索器创建完成")
+        # 压缩器由问答链（SourcedRAGChain）对检索结果按问题压缩
+        self.compressor = self._create_compressor()
+    
+    def _create_compressor(self) -> Optional[BaseDocumentCompressor]:
+        """根据配置创建上下文压缩器"""
+        if self.compression == "llm":
+            # 每个检索到的文档调用一次LLM，质量高但慢且有费用
+            return LLMChainExtractor.from_llm(self.llm)
+        if self.compression == "extractive":
+            return ExtractiveCompressor(max_tokens=self.context_token_budget)
+        if self.compression == "semantic":
+            # 句子向量写入嵌入缓存，重复出现的句子不再调用API
+            return ExtractiveCompressor(max_tokens=self.context_token_budget,
+                                        embeddings=self.embeddings)
+        return None
+
+    def update_sources(self, updated: Dict[str, List[Document]],
+                       removed: List[str]) -> Dict[str, int]:
+        """
+        按文件增量更新正在使用的混合检索索引（供文档目录监视调用）
+        
+        只分割和嵌入变化文件中的新片段。BM25索引在副本上增删后整体替换，
+        进行中的检索继续使用旧索引；Chroma 先写入新片段再删除旧片段。
+        
+        Args:
+            updated: 新增或修改的文件 -> 重新加载的文档
+            removed: 已删除的文件
+            
+        Returns:
+            更新统计 {"added": 新增片段数, "deleted": 删除片段数}
+        """
+        if self.retriever is None:
+            raise ValueError("混合检索器尚未创建，请先调用 setup_advanced")
+        bm25_index = self.retriever.bm25_index
+        
+        # 现有片段按来源分组，来源路径按规范化路径匹配
+        old_ids: Dict[str, List[str]] = {}
+        for doc in bm25_index.documents:
+            source = os.path.normpath(doc.metadata.get("source", ""))
+            old_ids.setdefault(source, []).append(doc.id)
+        
+        new_chunks: List[Document] = []
+        new_ids: List[str] = []
+        removed_ids: List[str] = []
+        for path in removed:
+            removed_ids.extend(old_ids.get(os.path.normpath(path), []))
+        for path, docs in updated.items():
+            previous = set(old_ids.get(os.path.normpath(path), []))
+            splits = self.text_splitter.split_documents(docs)
+            chunk_ids = compute_chunk_ids(splits)
+            for chunk_id, chunk in zip(chunk_ids, splits):
+                if chunk_id not in previous:
+                    new_chunks.append(chunk)
+                    new_ids.append(chunk_id)
+            removed_ids.extend(previous - set(chunk_ids))
+        
+        if new_chunks:
+            self.vectorstore.add_documents(new_chunks, ids=new_ids)
+        if removed_ids:
+            self.vectorstore.delete(ids=removed_ids)
+        
+        updated_index = bm25_index.copy()
+        updated_index.delete(removed_ids)
+        updated_index.add_documents(new_chunks, ids=new_ids)
+        updated_index.save(self.bm25_directory)
+        # 单次属性赋值替换BM25索引，压缩检索器和RAG链引用的是同一个混合检索器
+        self.retriever.bm25_index = updated_index
+        return {"added": len(new_chunks), "deleted": len(removed_ids)}
     
+    def sync_sources(self, documents_path: str) -> Dict[str, int]:
+        """
+        使已加载的索引与文档目录一致（索引构建后文档可能已被修改）
+        
+        重新加载并分割全部文档（不嵌入），按文件比较片段ID，
+        只把有变化的文件和已删除的文件交给 update_sources。
+        
+        Args:
+            documents_path: 文档路径
+            
+        Returns:
+            更新统计 {"added": 新增片段数, "deleted": 删除片段数}
+        """
+        indexed: Dict[str, set] = {}
+        for doc in self.retriever.bm25_index.documents:
+            source = os.path.normpath(doc.metadata.get("source", ""))
+            indexed.setdefault(source, set()).add(doc.id)
+        
+        docs_by_source: Dict[str, List[Document]] = {}
+        for doc in self.iter_documents_advanced(documents_path):
+            source = os.path.normpath(doc.metadata.get("source", ""))
+            docs_by_source.setdefault(source, []).append(doc)
+        
+        updated = {source: docs for source, docs in docs_by_source.items()
+                   if set(compute_chunk_ids(self.text_splitter.split_documents(docs)))
+                   != indexed.get(source)}
+        removed = sorted(set(indexed) - set(docs_by_source))
+        if not updated and not removed:
+            print("索引与文档目录一致")
+            return {"added": 0, "deleted": 0}
+        stats = self.update_sources(updated, removed)
+        print(f"索引已与文档目录同步: {len(updated)} 个文件更新, {len(removed)} 个文件删除, "
+              f"新增 {stats['added']} 个片段, 删除 {stats['deleted']} 个片段")
+        return stats
+    
+    def watch(self, documents_path: str, interval: Optional[float] = None) -> IndexWatcher:
+        """
+        在后台监视文档目录，文件新增、修改或删除时增量更新索引
+        
+        Args:
+            documents_path: 文档目录，应与 setup_advanced 时相同
+            interval: 轮询间隔（秒），默认为 WATCH_INTERVAL_SECONDS
+            
+        Returns:
+            已启动的监视器，调用 stop() 停止
+        """
+        if self.retriever is None:
+            self.setup_advanced(documents_path, rebuild=False)
+        watcher = IndexWatcher(documents_path,
+                               load=lambda path: list(record_file_attributes(load_file(path))),
+                               apply=self.update_sources,
+                               extensions=SUPPORTED_EXTENSIONS,
+                               interval=interval)
+        return watcher.start()
+
     def create_advanced_rag_chain(self) -> None:
         """创建高级RAG链"""
         # 高级提示模板
@@ -182,33 +371,32 @@ class AdvancedRAGSystem:
         
         prompt = ChatPromptTemplate.from_template(template)
         
-        def format_docs(docs):
-            formatted = []
-            for i, doc in enumerate(docs, 1):
-                content = doc.page_content.strip()
-                source = getattr(doc.metadata, 'source', '未知来源')
-                formatted.append(f"[文档{i}] (来源: {source})\n{content}")
-            return "\n\n".join(formatted)
-        
-        # 创建高级RAG链
-        self.rag_chain = (
-            {
-                "context": self.compression_retriever | format_docs,
-                "question": RunnablePassthrough()
-            }
-            | prompt
-            | self.llm
-            | StrOutputParser()
+        # 合并相邻片段、去掉重叠文本，按相关度排序并限制上下文token数
+        format_docs = ContextPacker(
+            max_tokens=self.context_token_budget,
+            template="[文档{i}] (来源: {source})\n{content}",
+            model_name=self.model_name
+        )
+        
+        # 创建高级RAG链 - 检索和压缩只执行一次，结果同时用于生成和返回来源
+        self.rag_chain = SourcedRAGChain(
+            retriever=self.retriever,
+            prompt=prompt,
+            llm=self.llm,
+            format_docs=format_docs,
+            compressor=self.compressor
         )
         
         print("高级RAG链创建完成")
     
-    async def aquery(self, question: str) -> str:
+    async def aquery(self, question: str,
+                     filter: Optional[MetadataFilter] = None) -> str:
         """
         异步查询RAG系统
         
         Args:
             question: 用户问题
+            filter: 元数据过滤表达式，同时下推到向量检索和BM25检索
             
         Returns:
             生成的回答
@@ -219,70 +407,123 @@ class AdvancedRAGSystem:
         print(f"\n🔍 问题: {question}")
         print("正在检索相关信息...")
         
-        # 获取相关文档
-        relevant_docs = await self.compression_retriever.aget_relevant_documents(question)
-        print(f"✅ 检索到 {len(relevant_docs)} 个高质量文档片段")
-        
         if self.streaming:
-            print("\n🤖 AI回答：")
-            print("-" * 50)
+            answer = ""
+            async for event in self.astream(question, filter):
+                if isinstance(event, RetrievalEvent):
+                    print(f"✅ 检索到 {len(event.documents)} 个高质量文档片段")
+                    print("\n🤖 AI回答：")
+                    print("-" * 50)
+                elif isinstance(event, TokenEvent):
+                    print(event.delta, end="", flush=True)
+                else:
+                    answer = event.answer
+            print()
+            return answer
+        
+        # 检索并压缩相关文档（只执行一次）
+        relevant_docs, _ = await self.rag_chain.aretrieve(question, filter)
+        print(f"✅ 检索到 {len(relevant_docs)} 个高质量文档片段")
             
-        # 生成回答
-        answer = await self.rag_chain.ainvoke(question)
+        # 基于已检索的文档生成回答
+        answer, _ = await self.rag_chain.agenerate(question, relevant_docs)
         return answer
     
-    def query_with_sources(self, question: str) -> Dict[str, Any]:
+    async def astream(self, question: str,
+                      filter: Optional[MetadataFilter] = None) -> AsyncIterator[StreamEvent]:
+        """
+        流式查询RAG系统
+        
+        Args:
+            question: 用户问题
+            filter: 元数据过滤表达式
+            
+        Yields:
+            RetrievalEvent：检索完成，包含来源和检索耗时
+            TokenEvent：生成的token增量
+            CompletionEvent：完整回答和各阶段耗时（含首token延迟）
+        """
+        if self.rag_chain is None:
+            raise ValueError("RAG链尚未创建")
+        
+        async for event in self.rag_chain.astream(question, filter):
+            yield event
+    
+    async def aquery_batch(self, questions: List[str],
+                           max_concurrency: int = 8,
+                           filter: Optional[MetadataFilter] = None) -> List[Dict[str, Any]]:
+        """
+        批量查询
+        
+        整批问题先用一个批量请求完成嵌入（写入嵌入缓存），之后各问题的混合检索
+        直接命中缓存；检索、压缩和生成按并发上限同时进行。
+        
+        与 RAGSystem.aquery_batch 不同，这里的检索仍按问题进行：混合检索的每一路
+        有独立的超时和回退，得分融合需要各问题的相关度，BM25本身也是逐问题打分。
+        批量检索节省的主要是嵌入请求，这部分已经合并为一个请求；逐问题的稠密检索
+        只是本地索引查询，不再调用API。
+        
+        Args:
+            questions: 问题列表
+            max_concurrency: 同时处理的问题数上限
+            filter: 元数据过滤表达式，对整批问题生效
+            
+        Returns:
+            与输入顺序一致的结果列表，单个问题出错时对应项为 {"question", "error"}
+        """
+        if self.rag_chain is None:
+            raise ValueError("RAG链尚未创建")
+        
+        if questions:
+            try:
+                await self.embeddings.aembed_documents(list(questions))
+            except Exception as e:
+                # 预先嵌入失败时各问题检索时会再次尝试，错误按问题返回
+                print(f"⚠️ 批量嵌入问题失败: {type(e).__name__}: {e}")
+        return await self.rag_chain.abatch(questions, max_concurrency=max_concurrency,
+                                           filter=filter)
+    
+    def query_with_sources(self, question: str,
+                           filter: Optional[MetadataFilter] = None) -> Dict[str, Any]:
         """
         查询并返回带来源的回答
         
         Args:
             question: 用户问题
+            filter: 元数据过滤表达式
             
         Returns:
-            包含回答和来源的字典
+            包含回答、来源和各阶段耗时的字典
         """
-        if self.compression_retriever is None:
-            raise ValueError("检索器尚未创建")
-        
-        # 获取相关文档
-        relevant_docs = self.compression_retriever.get_relevant_documents(question)
-        
-        # 格式化上下文
-        context = "\n\n".join([doc.page_content for doc in relevant_docs])
-        
-        # 生成回答
-        answer = self.rag_chain.invoke(question)
-        
-        # 提取来源信息
-        sources = []
-        for doc in relevant_docs:
-            source_info = {
-                "content": doc.page_content[:200] + "...",
-                "metadata": doc.metadata
-            }
-            sources.append(source_info)
-        
-        return {
-            "question": question,
-            "answer": answer,
-            "sources": sources,
-            "num_sources": len(sources)
-        }
+        if self.rag_chain is None:
+            raise ValueError("RAG链尚未创建")
+        
+        return self.rag_chain.invoke(question, filter)
     
-    def setup_advanced(self, documents_path: str) -> None:
+    def setup_advanced(self, documents_path: str, rebuild: bool = True) -> None:
         """
         完整设置高级RAG系统
         
         Args:
             documents_path: 文档路径
+            rebuild: 为False且磁盘上已有索引时直接加载，只同步有变化的文件
         """
         print("🚀 开始设置高级RAG系统...")
         
-        # 1. 加载文档
-        documents = self.load_documents_advanced(documents_path)
-        
-        # 2. 处理文档
-        processed_docs = self.text_splitter.split_documents(documents)
+        if not rebuild and self.load_hybrid_retriever():
+            # 只嵌入上次构建后新增或修改的片段
+            self.sync_sources(documents_path)
+            self.create_advanced_rag_chain()
+            print("✅ 高级RAG系统设置完成！")
+            return
+        
+        # 1-2. 流式加载并分割文档，原始文档解析完即交给分割器
+        num_documents = 0
+        processed_docs = []
+        for document in self.iter_documents_advanced(documents_path):
+            num_documents += 1
+            processed_docs.extend(self.text_splitter.iter_documents([document]))
+        print(f"成功加载 {num_documents} 个文档")
         print(f"文档分割为 {len(processed_docs)} 个片段")
         
         # 3. 创建混合检索器
@@ -291,6 +532,8 @@ class AdvancedRAGSystem:
         # 4. 创建RAG链
         self.create_advanced_rag_chain()
         
+        cache_stats = self.embeddings.stats()
+        print(f"嵌入缓存: 命中 {cache_stats['hits']}, 未命中 {cache_stats['misses']}")
         print("✅ 高级RAG系统设置完成！")
 
 
@@ -305,7 +548,8 @@ async def main():
     rag = AdvancedRAGSystem(
         model_name="gpt-4",
         temperature=0.1,
-        streaming=True
+        streaming=True,
+        embedding_dimensions=int(os.getenv("EMBEDDING_DIMENSIONS", "0")) or None
     )
     
     # 示例：使用示例文档目录
@@ -0,0 +1,145 @@
+"""
+语义回答缓存
+
+把问题嵌入为向量，与之前回答过的问题做余弦相似度比较，超过阈值时直接返回
+之前的回答，跳过检索和LLM生成。缓存条目绑定索引版本，索引更新后全部失效；
+条目按TTL过期，超过容量时按最近最少使用（LRU）淘汰，并统计命中率。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class SemanticAnswerCache:
+    """按问题语义相似度复用回答的内存缓存"""
+
+    def __init__(self,
+                 embeddings: Embeddings,
+                 threshold: float = 0.95,
+                 ttl_seconds: Optional[float] = 3600,
+                 max_entries: int = 1000):
+        """
+        初始化回答缓存
+
+        Args:
+            embeddings: 嵌入模型（建议使用 CachedEmbeddings，检索时不再重复嵌入问题）
+            threshold: 命中所需的最小余弦相似度
+            ttl_seconds: 条目有效期（秒），None表示不过期
+            max_entries: 最多保留的条目数，超出时淘汰最久未使用的条目
+        """
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.index_version: Optional[str] = None
+
+        # 问题 -> (归一化向量, 结果, 写入时间)，按最近使用排序
+        self._entries: "OrderedDict[str, Tuple[np.ndarray, Dict[str, Any], float]]" = OrderedDict()
+        self._matrix: Optional[np.ndarray] = None
+        self._keys: List[str] = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def invalidate(self, index_version: Optional[str] = None) -> None:
+        """
+        索引版本变化时清空缓存
+
+        Args:
+            index_version: 新的索引版本；与当前版本相同时保留缓存，None表示无条件清空
+        """
+        with self._lock:
+            if index_version is not None and index_version == self.index_version:
+                return
+            self.index_version = index_version
+            self._entries.clear()
+            self._matrix = None
+
+    @staticmethod
+    def _normalize(vector: Any) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self, now: float) -> None:
+        """删除过期条目（调用方持有锁）"""
+        if self.ttl_seconds is None:
+            return
+        expired = [key for key, (_, _, created_at) in self._entries.items()
+                   if now - created_at > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self.expirations += len(expired)
+            self._matrix = None
+
+    def _similarities(self, vector: np.ndarray) -> np.ndarray:
+        """当前所有条目与问题向量的余弦相似度（调用方持有锁）"""
+        if self._matrix is None:
+            self._keys = list(self._entries)
+            self._matrix = (np.stack([self._entries[key][0] for key in self._keys])
+                            if self._keys else np.zeros((0, len(vector)), dtype=np.float32))
+        return self._matrix @ vector
+
+    def lookup(self, question: str) -> Optional[Tuple[str, Dict[str, Any], float]]:
+        """
+        查找语义相近的已回答问题
+
+        Returns:
+            命中时返回 (缓存的问题, 缓存的结果, 相似度)，否则返回None
+        """
+        vector = self._normalize(self.embeddings.embed_query(question))
+        with self._lock:
+            self._expire(time.time())
+            similarities = self._similarities(vector)
+            if len(similarities) and similarities.max() >= self.threshold:
+                best = int(similarities.argmax())
+                key = self._keys[best]
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return key, self._entries[key][1], float(similarities[best])
+            self.misses += 1
+            return None
+
+    def store(self, question: str, result: Dict[str, Any],
+              index_version: Optional[str] = None) -> None:
+        """
+        缓存问题的回答结果
+
+        Args:
+            question: 问题
+            result: 查询结果
+            index_version: 生成回答时的索引版本；与当前版本不同（期间索引已更新）时不缓存
+        """
+        vector = self._normalize(self.embeddings.embed_query(question))
+        with self._lock:
+            if index_version is not None and index_version != self.index_version:
+                return
+            self._entries[question] = (vector, result, time.time())
+            self._entries.move_to_end(question)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._matrix = None
+
+    def stats(self) -> Dict[str, float]:
+        """返回缓存命中统计"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
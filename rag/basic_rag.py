@@ -8,20 +8,36 @@
 4. 使用OpenAI的GPT-4和Embeddings
 """
 
+import asyncio
+import functools
+import json
 import os
-from typing import Any, List, Optional
+import shutil
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
 
+import httpx
 from dotenv import load_dotenv
 from langchain_community.document_loaders import DirectoryLoader, TextLoader
 from langchain_community.vectorstores import Chroma
 from langchain_core.documents import Document
-from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
 from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+from answer_cache import SemanticAnswerCache
 from check_env import check_azure_openai_config
+from collection_manager import CollectionManager
+from context_packer import ContextPacker
+from embedding_cache import CachedEmbeddings, default_cache_path
+from embedding_pipeline import BatchedEmbeddings, run_sync
+from index_watcher import IndexWatcher
+from ingest_manifest import (MANIFEST_FILENAME, IngestManifest,
+                             compute_chunk_ids, hash_text)
+from matryoshka import embedding_fingerprint, reduce_dimensions
+from metadata_filter import MetadataFilter, record_file_attributes
+from rag_pipeline import SourcedRAGChain, StreamEvent, batch_similarity_search
+from streaming_splitter import StreamingTextSplitter
+from vector_index import NumpyVectorStore
 
 # 加载环境变量
 load_dotenv()
@@ -32,16 +48,50 @@ class RAGSystem:
 
     def __init__(self, model_name: str,
                  api_version: str,
-                 temperature: float = 0.1):
+                 temperature: float = 0.1,
+                 persist_directory: Optional[str] = None,
+                 vector_backend: str = "chroma",
+                 embedding_dimensions: Optional[int] = None,
+                 truncate_embeddings: bool = False,
+                 answer_cache_threshold: Optional[float] = 0.95,
+                 answer_cache_ttl: Optional[float] = 3600,
+                 answer_cache_size: int = 1000,
+                 context_token_budget: int = 2000,
+                 collections_directory: Optional[str] = None,
+                 collection_memory_budget: Optional[int] = None,
+                 http_client: Optional[httpx.Client] = None,
+                 http_async_client: Optional[httpx.AsyncClient] = None):
         """
         初始化RAG系统
 
         Args:
             model_name: OpenAI模型名称
             temperature: 生成温度参数
+            persist_directory: 向量数据库持久化目录
+            vector_backend: 向量存储后端，chroma 或 numpy（本地内存映射索引）
+            embedding_dimensions: 嵌入向量维度，None表示使用模型完整维度
+            truncate_embeddings: 是否在本地截断降维（否则通过API参数降维）
+            answer_cache_threshold: 语义回答缓存的命中相似度阈值，None表示不缓存回答
+            answer_cache_ttl: 缓存回答的有效期（秒），None表示不过期
+            answer_cache_size: 最多缓存的回答数
+            context_token_budget: 提示中上下文的token数上限
+            collections_directory: 多集合（如每个租户一个知识库）的根目录
+            collection_memory_budget: 常驻集合的估算内存上限（字节），超出时按LRU关闭集合
+            http_client: LLM和嵌入共用的HTTP连接池（同步请求），None时各自创建
+            http_async_client: LLM和嵌入共用的HTTP连接池（异步请求）
         """
+        if vector_backend not in ("chroma", "numpy"):
+            raise ValueError(f"不支持的向量存储后端: {vector_backend}")
+
         self.model_name = model_name
         self.temperature = temperature
+        self.context_token_budget = context_token_budget
+        self.vector_backend = vector_backend
+        if vector_backend == "numpy":
+            default_directory = os.getenv("VECTOR_INDEX_DIRECTORY", "./vector_index")
+        else:
+            default_directory = os.getenv("CHROMA_PERSIST_DIRECTORY", "./chroma_db")
+        self.persist_directory = persist_directory or default_directory
 
         # 初始化OpenAI组件
         self.llm = AzureChatOpenAI(
@@ -49,39 +99,76 @@ class RAGSystem:
                 "AZURE_OPENAI_CHAT_DEPLOYMENT_NAME", "gpt-4o-mini"),
             temperature=temperature,
             api_version=os.getenv(
-                "AZURE_OPENAI_API_VERSION", "2024-02-15-preview")
+                "AZURE_OPENAI_API_VERSION", "2024-02-15-preview"),
+            http_client=http_client,
+            http_async_client=http_async_client
         )
 
-        self.embeddings = AzureOpenAIEmbeddings(
-            azure_deployment=os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME",
-                                       "text-embedding-3-large")
+        # 嵌入结果缓存在本地，重建索引和重复查询不再调用API；
+        # 未命中的文本分批并发嵌入，进度写入同一文件的检查点表以便断点续传
+        cache_path = default_cache_path()
+        self.embeddings = CachedEmbeddings(
+            BatchedEmbeddings.from_env(
+                reduce_dimensions(
+                    AzureOpenAIEmbeddings(
+                        azure_deployment=os.getenv(
+                            "AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME",
+                            "text-embedding-3-large"),
+                        http_client=http_client,
+                        http_async_client=http_async_client
+                    ),
+                    embedding_dimensions,
+                    truncate=truncate_embeddings
+                ),
+                checkpoint_path=cache_path
+            ),
+            cache_path=cache_path
         )
 
-        # 初始化文本分割器
-        self.text_splitter = RecursiveCharacterTextSplitter(
+        # 初始化文本分割器（单遍流式分割，逐个产出片段并记录原文偏移）
+        self.text_splitter = StreamingTextSplitter(
             chunk_size=500,
             chunk_overlap=100,
             add_start_index=True
         )
 
+        # 语义相近的重复问题直接返回缓存的回答，跳过检索和生成
+        self.answer_cache: Optional[SemanticAnswerCache] = None
+        if answer_cache_threshold is not None:
+            self.answer_cache = SemanticAnswerCache(
+                self.embeddings,
+                threshold=answer_cache_threshold,
+                ttl_seconds=answer_cache_ttl,
+                max_entries=answer_cache_size
+            )
+
+        # 多集合索引：按需打开，常驻集合超出内存预算时按LRU关闭
+        self.collections = CollectionManager(
+            self.embeddings,
+            root_directory=collections_directory,
+            backend=vector_backend,
+            memory_budget_bytes=collection_memory_budget,
+            search_kwargs={"k": 6}
+        )
+
         self.vectorstore = None
         self.retriever: Optional[Any] = None
         self.rag_chain: Optional[Any] = None
+        self.index_version: Optional[str] = None
 
-    def load_documents(self, documents_path: str) -> List[Document]:
+    def iter_documents(self, documents_path: str) -> Iterator[Document]:
         """
-        加载文档
+        逐个加载文档，不一次性把所有文件读入内存
 
         Args:
             documents_path: 文档路径（文件或目录）
 
-        Returns:
-            加载的文档列表
+        Yields:
+            加载的文档，metadata 中记录来源文件、文件类型和摄取时间，可用于过滤检索
         """
         if os.path.isfile(documents_path):
             # 加载单个文件
             loader = TextLoader(documents_path, encoding='utf-8')
-            documents = loader.load()
         elif os.path.isdir(documents_path):
             # 加载目录中的所有txt文件
             loader = DirectoryLoader(
@@ -90,26 +177,41 @@ class RAGSystem:
                 loader_cls=TextLoader,
                 loader_kwargs={'encoding': 'utf-8'}
             )
-            documents = loader.load()
         else:
             raise ValueError(f"路径不存在: {documents_path}")
+        yield from record_file_attributes(loader.lazy_load())
+
+    def load_documents(self, documents_path: str) -> List[Document]:
+        """
+        加载文档
+
+        Args:
+            documents_path: 文档路径（文件或目录）
 
+        Returns:
+            加载的文档列表
+        """
+        documents = list(self.iter_documents(documents_path))
         print(f"成功加载 {len(documents)} 个文档")
         return documents
 
-    def process_documents(self, documents: List[Document]) -> List[Document]:
+    def process_documents(self, documents: Iterable[Document]) -> List[Document]:
         """
         处理和分割文档
 
         Args:
-            documents: 原始文档列表
+            documents: 原始文档列表或生成器；生成器中的文档分割后即可释放
 
         Returns:
             分割后的文档片段列表
         """
         # 分割文档
-        splits = self.text_splitter.split_documents(documents)
-        print(f"文档分割为 {len(splits)} 个片段")
+        num_documents = 0
+        splits = []
+        for document in documents:
+            num_documents += 1
+            splits.extend(self.text_splitter.iter_documents([document]))
+        print(f"{num_documents} 个文档分割为 {len(splits)} 个片段")
         return splits
 
     def create_vectorstore(self, documents: List[Document]) -> None:
@@ -120,24 +222,246 @@ class RAGSystem:
             documents: 文档列表
         """
         print("正在创建向量数据库...")
-        self.vectorstore = Chroma.from_documents(
-            documents=documents,
-            embedding=self.embeddings,
-            persist_directory="./chroma_db"  # 持久化存储
-        )
+        if self.vector_backend == "numpy":
+            # 全量构建时丢弃旧索引
+            shutil.rmtree(self.persist_directory, ignore_errors=True)
+            self.vectorstore = NumpyVectorStore.from_documents(
+                documents=documents,
+                embedding=self.embeddings,
+                index_path=self.persist_directory
+            )
+        else:
+            # 全量构建时丢弃旧集合，避免重复向量和维度不一致
+            Chroma(persist_directory=self.persist_directory).delete_collection()
+            # 旧清单记录的片段ID已不在新集合中，删除后下次增量同步会清空并重新记录
+            manifest_path = os.path.join(self.persist_directory, MANIFEST_FILENAME)
+            if os.path.isfile(manifest_path):
+                os.remove(manifest_path)
+            self.vectorstore = Chroma.from_documents(
+                documents=documents,
+                embedding=self.embeddings,
+                persist_directory=self.persist_directory  # 持久化存储
+            )
+
+        self._set_index_version(compute_chunk_ids(documents))
+        self._create_retriever()
+        print("向量数据库创建完成")
+
+    def sync_vectorstore(self, documents: List[Document]) -> None:
+        """
+        增量同步向量数据库
+
+        打开已持久化的向量数据库，根据摄取清单中的文件和片段哈希，
+        只嵌入新增或修改的片段，并删除已移除片段对应的向量。
+
+        Args:
+            documents: 原始文档列表（未分割）
+        """
+        print("正在增量同步向量数据库...")
+        manifest_path = os.path.join(self.persist_directory, MANIFEST_FILENAME)
+        manifest = IngestManifest(manifest_path)
+        fingerprint = embedding_fingerprint(self.embeddings)
+
+        if manifest.exists and manifest.embedding != fingerprint:
+            # 嵌入模型或维度变化后旧向量不可用，整体重建
+            print(f"嵌入配置已变化 ({manifest.embedding} -> {fingerprint})，重建向量数据库")
+            if self.vector_backend == "numpy":
+                shutil.rmtree(self.persist_directory, ignore_errors=True)
+            else:
+                Chroma(persist_directory=self.persist_directory).delete_collection()
+            manifest.files = {}
+        manifest.embedding = fingerprint
+
+        if self.vector_backend == "numpy":
+            self.vectorstore = NumpyVectorStore(self.embeddings, self.persist_directory)
+        else:
+            self.vectorstore = Chroma(
+                persist_directory=self.persist_directory,
+                embedding_function=self.embeddings
+            )
+
+        if not manifest.exists:
+            # 没有清单的旧数据库无法对应到片段，清空后重新摄取
+            stale_ids = self._stored_vector_ids()
+            if stale_ids:
+                print(f"未找到摄取清单，清除 {len(stale_ids)} 个旧向量")
+                self.vectorstore.delete(ids=stale_ids)
+
+        # 按源文件分组
+        docs_by_source: Dict[str, List[Document]] = {}
+        for doc in documents:
+            source = doc.metadata.get("source", "")
+            docs_by_source.setdefault(source, []).append(doc)
+
+        added, deleted, unchanged = 0, 0, 0
+        for source, source_docs in docs_by_source.items():
+            source_added, source_deleted = self._sync_source(
+                self.vectorstore, manifest, source, source_docs)
+            if source_added is None:
+                unchanged += 1
+                continue
+            added += source_added
+            deleted += source_deleted
+
+        # 删除已不存在文件的向量
+        for source in manifest.sources() - set(docs_by_source):
+            deleted += self._remove_source(self.vectorstore, manifest, source)
+
+        manifest.save()
+        self._set_index_version(manifest.all_chunk_ids())
+        print(f"增量同步完成: 新增 {added} 个片段, 删除 {deleted} 个片段, "
+              f"{unchanged} 个文件未变化")
+
+        self._create_retriever()
+
+    def _sync_source(self, vectorstore: Any, manifest: IngestManifest, source: str,
+                     source_docs: List[Document]) -> Tuple[Optional[int], int]:
+        """
+        同步单个源文件：只嵌入新增的片段，删除已移除片段的向量
+
+        先写入新片段再删除旧片段，同步过程中检索不会缺少该文件的内容。
+
+        Returns:
+            (新增片段数, 删除片段数)，文件未变化时新增片段数为None
+        """
+        file_hash = hash_text(
+            "\x00".join(doc.page_content for doc in source_docs))
+        if manifest.file_hash(source) == file_hash:
+            return None, 0
+
+        splits = self.text_splitter.split_documents(source_docs)
+        chunk_ids = compute_chunk_ids(splits)
+        old_ids = set(manifest.chunk_ids(source))
+
+        new_chunks = [(cid, chunk) for cid, chunk in zip(chunk_ids, splits)
+                      if cid not in old_ids]
+        if new_chunks:
+            vectorstore.add_documents(
+                [chunk for _, chunk in new_chunks],
+                ids=[cid for cid, _ in new_chunks]
+            )
+
+        removed_ids = list(old_ids - set(chunk_ids))
+        if removed_ids:
+            vectorstore.delete(ids=removed_ids)
+
+        manifest.update_file(source, file_hash, chunk_ids)
+        return len(new_chunks), len(removed_ids)
+
+    @staticmethod
+    def _remove_source(vectorstore: Any, manifest: IngestManifest, source: str) -> int:
+        """删除源文件的全部向量，返回删除的片段数"""
+        removed_ids = manifest.chunk_ids(source)
+        if removed_ids:
+            vectorstore.delete(ids=removed_ids)
+        manifest.remove_file(source)
+        return len(removed_ids)
+
+    def update_sources(self, updated: Dict[str, List[Document]],
+                       removed: Iterable[str]) -> Dict[str, int]:
+        """
+        按文件增量更新正在使用的索引（供文档目录监视调用）
+
+        只分割和嵌入变化文件中的新片段。本地NumPy索引在新打开的索引句柄上写入，
+        写完后整体替换检索器使用的向量存储，进行中的检索继续使用旧句柄，
+        不会读到写了一半的索引；Chroma 先写入新片段再删除旧片段。
 
-        # 创建检索器
+        Args:
+            updated: 新增或修改的文件 -> 重新加载的文档
+            removed: 已删除的文件
+
+        Returns:
+            更新统计 {"added": 新增片段数, "deleted": 删除片段数}
+        """
+        if self.vectorstore is None:
+            raise ValueError("向量数据库尚未创建，请先调用 setup")
+        manifest = IngestManifest(os.path.join(self.persist_directory, MANIFEST_FILENAME))
+        # 清单中的来源路径按规范化路径匹配（目录加载器和监视器的路径写法可能不同）
+        known = {os.path.normpath(source): source for source in manifest.sources()}
+
+        if self.vector_backend == "numpy":
+            vectorstore = NumpyVectorStore(self.embeddings, self.persist_directory)
+        else:
+            vectorstore = self.vectorstore
+
+        added, deleted = 0, 0
+        for path, docs in updated.items():
+            source = known.get(os.path.normpath(path), path)
+            for doc in docs:
+                doc.metadata["source"] = source
+            source_added, source_deleted = self._sync_source(vectorstore, manifest,
+                                                             source, docs)
+            added += source_added or 0
+            deleted += source_deleted
+        for path in removed:
+            source = known.get(os.path.normpath(path))
+            if source is not None:
+                deleted += self._remove_source(vectorstore, manifest, source)
+
+        manifest.save()
+        # 替换向量存储、检索器和RAG链中的检索器，均为单次属性赋值
+        self.vectorstore = vectorstore
+        self._set_index_version(manifest.all_chunk_ids())
+        self._create_retriever()
+        if self.rag_chain is not None:
+            self.rag_chain.retriever = self.retriever
+        return {"added": added, "deleted": deleted}
+
+    def watch(self, documents_path: str, interval: Optional[float] = None) -> IndexWatcher:
+        """
+        在后台监视文档目录，文件新增、修改或删除时增量更新索引
+
+        Args:
+            documents_path: 文档目录，应与 setup 时相同
+            interval: 轮询间隔（秒），默认为 WATCH_INTERVAL_SECONDS
+
+        Returns:
+            已启动的监视器，调用 stop() 停止
+        """
+        if self.vectorstore is None:
+            self.setup(documents_path, incremental=True)
+        elif not os.path.isfile(os.path.join(self.persist_directory, MANIFEST_FILENAME)):
+            # 全量构建的索引没有摄取清单，先同步一次以记录各文件的片段
+            self.sync_vectorstore(self.load_documents(documents_path))
+            if self.rag_chain is not None:
+                self.rag_chain.retriever = self.retriever
+        watcher = IndexWatcher(documents_path,
+                               load=lambda path: list(self.iter_documents(path)),
+                               apply=self.update_sources,
+                               extensions=(".txt",),
+                               interval=interval)
+        return watcher.start()
+
+    def _set_index_version(self, chunk_ids: Iterable[str]) -> None:
+        """根据片段ID和嵌入配置计算索引版本，版本变化时清空回答缓存"""
+        fingerprint = json.dumps(embedding_fingerprint(self.embeddings), sort_keys=True)
+        self.index_version = hash_text(fingerprint + "\n" + "\n".join(sorted(chunk_ids)))
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate(self.index_version)
+
+    def _stored_vector_ids(self) -> List[str]:
+        """返回向量数据库中已有的全部向量ID"""
+        if isinstance(self.vectorstore, NumpyVectorStore):
+            return self.vectorstore.index.ids() if self.vectorstore.index else []
+        return self.vectorstore.get(include=[])["ids"]
+
+    def _create_retriever(self) -> None:
+        """基于当前向量数据库创建检索器"""
         self.retriever = self.vectorstore.as_retriever(
             search_type="similarity",
             search_kwargs={"k": 6}  # 返回最相似的6个文档片段
         )
-        print("向量数据库创建完成")
 
     def create_rag_chain(self) -> None:
         """创建RAG链"""
         if self.retriever is None:
             raise ValueError("检索器尚未初始化，请先调用create_vectorstore方法")
 
+        self.rag_chain = self._build_chain(self.retriever)
+        print("RAG链创建完成")
+
+    def _build_chain(self, retriever: Any) -> SourcedRAGChain:
+        """基于给定检索器创建RAG链"""
         # 定义提示模板
         template = """你是一个有用的AI助手。请基于以下上下文信息回答用户的问题。
         如果上下文中没有相关信息，请说明你不知道答案。
@@ -151,76 +475,231 @@ class RAGSystem:
 
         prompt = ChatPromptTemplate.from_template(template)
 
-        def format_docs(docs):
-            return "\n\n".join(doc.page_content for doc in docs)
-
-        # 创建RAG链 - 使用LangChain的管道操作符构建检索增强生成流程
-        # 1. 输入处理：将用户问题传递给检索器和问题字段
-        # 2. 检索增强：从向量数据库检索相关文档并格式化为上下文
-        # 3. 提示工程：将上下文和问题组合成结构化提示
-        # 4. 模型推理：使用大语言模型生成回答
-        # 5. 输出解析：将模型输出转换为字符串格式
-        self.rag_chain = (
-            {
-                "context": self.retriever | format_docs,  # 检索相关文档并格式化为上下文
-                "question": RunnablePassthrough()         # 直接传递用户问题，不做任何修改
-            }
-            | prompt                                      # 应用提示模板
-            | self.llm                                    # 使用大语言模型生成回答
-            | StrOutputParser()                          # 解析输出为字符串
+        # 合并相邻片段、去掉重叠文本，并限制上下文token数
+        format_docs = ContextPacker(max_tokens=self.context_token_budget,
+                                    model_name=self.model_name)
+
+        # 创建RAG链 - 检索只执行一次，检索结果同时用于生成回答和返回来源
+        # 1. 检索增强：从向量数据库检索相关文档并格式化为上下文
+        # 2. 提示工程：将上下文和问题组合成结构化提示
+        # 3. 模型推理：使用大语言模型生成回答
+        # 4. 输出解析：将模型输出转换为字符串格式，并附带来源和各阶段耗时
+        return SourcedRAGChain(
+            retriever=retriever,
+            prompt=prompt,
+            llm=self.llm,
+            format_docs=format_docs
         )
-        print("RAG链创建完成")
 
-    def query(self, question: str) -> str:
+    def _chain_for(self, collection: Optional[str]) -> SourcedRAGChain:
+        """返回默认RAG链，或路由到指定集合的RAG链"""
+        if collection is not None:
+            return self._build_chain(self.collections.retriever(collection))
+        if self.rag_chain is None:
+            raise ValueError("RAG链尚未创建，请先调用setup方法")
+        return self.rag_chain
+
+    def query(self, question: str, filter: Optional[MetadataFilter] = None,
+              collection: Optional[str] = None) -> str:
         """
         查询RAG系统
 
         Args:
             question: 用户问题
+            filter: 元数据过滤表达式，如 build_filter(file_type="txt")
+            collection: 集合名，在该集合中检索；None表示使用默认向量数据库
 
         Returns:
             生成的回答
         """
-        if self.rag_chain is None:
-            raise ValueError("RAG链尚未创建，请先调用setup方法")
-
-        if self.retriever is None:
-            raise ValueError("检索器尚未初始化")
-
         print(f"\n问题: {question}")
         print("正在生成回答...")
 
-        # 获取相关文档
-        relevant_docs = self.retriever.invoke(question)
-        print(f"找到 {len(relevant_docs)} 个相关文档片段")
+        result = self.query_with_sources(question, filter=filter, collection=collection)
+        if result.get("cached"):
+            print(f"命中回答缓存（相似问题: {result['cached_question']}，"
+                  f"相似度 {result['similarity']:.3f}）")
+        print(f"找到 {result['num_sources']} 个相关文档片段")
+        return result["answer"]
 
-        # 生成回答
-        answer = self.rag_chain.invoke(question)
-        return answer
+    def query_with_sources(self, question: str,
+                           filter: Optional[MetadataFilter] = None,
+                           collection: Optional[str] = None) -> Dict[str, Any]:
+        """
+        查询并返回带来源的回答
 
-    def setup(self, documents_path: str) -> None:
+        Args:
+            question: 用户问题
+            filter: 元数据过滤表达式，检索只在匹配的片段中进行
+            collection: 集合名，在该集合中检索；None表示使用默认向量数据库
+
+        Returns:
+            包含回答、来源和各阶段耗时的字典
+        """
+        rag_chain = self._chain_for(collection)
+
+        # 回答缓存按问题匹配，不区分过滤条件和集合，这类查询不使用缓存
+        if self.answer_cache is None or filter or collection is not None:
+            return rag_chain.invoke(question, filter)
+
+        start = time.perf_counter()
+        cached = self.answer_cache.lookup(question)
+        lookup_seconds = time.perf_counter() - start
+        if cached is not None:
+            cached_question, cached_result, similarity = cached
+            return {
+                **cached_result,
+                "question": question,
+                "cached": True,
+                "cached_question": cached_question,
+                "similarity": similarity,
+                "timings": {"cache_lookup": lookup_seconds, "total": lookup_seconds},
+            }
+
+        index_version = self.index_version
+        result = rag_chain.invoke(question)
+        # 缓存副本：下面补充的缓存查找耗时只属于本次请求
+        self.answer_cache.store(question, {**result, "timings": dict(result["timings"])},
+                                index_version=index_version)
+        result["timings"]["cache_lookup"] = lookup_seconds
+        result["timings"]["total"] += lookup_seconds
+        return {**result, "cached": False}
+
+    async def aquery_with_sources(self, question: str,
+                                  filter: Optional[MetadataFilter] = None,
+                                  collection: Optional[str] = None) -> Dict[str, Any]:
+        """查询并返回带来源的回答（异步接口），参数和返回值同 query_with_sources"""
+        rag_chain = self._chain_for(collection)
+
+        if self.answer_cache is None or filter or collection is not None:
+            return await rag_chain.ainvoke(question, filter)
+
+        # 缓存查找需要嵌入问题（同步调用），放到线程中避免阻塞事件循环
+        start = time.perf_counter()
+        cached = await asyncio.to_thread(self.answer_cache.lookup, question)
+        lookup_seconds = time.perf_counter() - start
+        if cached is not None:
+            cached_question, cached_result, similarity = cached
+            return {
+                **cached_result,
+                "question": question,
+                "cached": True,
+                "cached_question": cached_question,
+                "similarity": similarity,
+                "timings": {"cache_lookup": lookup_seconds, "total": lookup_seconds},
+            }
+
+        index_version = self.index_version
+        result = await rag_chain.ainvoke(question)
+        # 缓存副本：下面补充的缓存查找耗时只属于本次请求
+        self.answer_cache.store(question, {**result, "timings": dict(result["timings"])},
+                                index_version=index_version)
+        result["timings"]["cache_lookup"] = lookup_seconds
+        result["timings"]["total"] += lookup_seconds
+        return {**result, "cached": False}
+
+    async def astream(self, question: str,
+                      filter: Optional[MetadataFilter] = None,
+                      collection: Optional[str] = None) -> AsyncIterator[StreamEvent]:
+        """
+        流式查询（不使用回答缓存）
+
+        Yields:
+            RetrievalEvent（检索完成及来源）、若干 TokenEvent（token增量）、
+            CompletionEvent（完整回答和耗时）
+        """
+        async for event in self._chain_for(collection).astream(question, filter):
+            yield event
+
+    def _retrieve_batch(self, questions: List[str],
+                        filter: Optional[MetadataFilter] = None, *,
+                        vectorstore: Any = None,
+                        retriever: Any = None) -> List[List[Document]]:
+        """整批问题一次嵌入（一个批量请求），再在向量库中批量检索（默认使用默认向量数据库）"""
+        vectors = self.embeddings.embed_documents(questions)
+        k = (retriever or self.retriever).search_kwargs.get("k", 4)
+        return batch_similarity_search(vectorstore or self.vectorstore, vectors, k=k,
+                                       filter=filter)
+
+    async def aquery_batch(self, questions: List[str],
+                           max_concurrency: int = 8,
+                           filter: Optional[MetadataFilter] = None,
+                           collection: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        批量查询
+
+        Args:
+            questions: 问题列表
+            max_concurrency: 同时进行的生成请求数上限
+            filter: 元数据过滤表达式，对整批问题生效
+            collection: 集合名，整批问题都在该集合中检索
+
+        Returns:
+            与输入顺序一致的结果列表，单个问题出错时对应项为 {"question", "error"}
+        """
+        rag_chain = self._chain_for(collection)
+        retrieve_batch = self._retrieve_batch
+        if collection is not None:
+            # 整批使用同一个集合对象，期间集合被淘汰也不影响本批检索
+            target = self.collections.get(collection)
+            retrieve_batch = functools.partial(self._retrieve_batch,
+                                               vectorstore=target.vectorstore,
+                                               retriever=target.retriever)
+        return await rag_chain.abatch(questions, max_concurrency=max_concurrency,
+                                      retrieve_batch=retrieve_batch, filter=filter)
+
+    def query_batch(self, questions: List[str],
+                    max_concurrency: int = 8,
+                    filter: Optional[MetadataFilter] = None,
+                    collection: Optional[str] = None) -> List[Dict[str, Any]]:
+        """批量查询（同步接口），参数和返回值同 aquery_batch"""
+        return run_sync(self.aquery_batch(questions, max_concurrency=max_concurrency,
+                                          filter=filter, collection=collection))
+
+    def setup(self, documents_path: str, incremental: bool = False) -> None:
         """
         完整设置RAG系统
 
         Args:
             documents_path: 文档路径
+            incremental: 是否增量摄取（只嵌入新增或修改的片段）
         """
         print("开始设置RAG系统...")
 
-        # 1. 加载文档
-        documents = self.load_documents(documents_path)
-
-        # 2. 处理文档
-        processed_docs = self.process_documents(documents)
+        if incremental:
+            # 1-3. 加载文档，增量分割并同步向量数据库
+            self.sync_vectorstore(self.load_documents(documents_path))
+        else:
+            # 1-2. 流式加载并分割文档
+            processed_docs = self.process_documents(self.iter_documents(documents_path))
 
-        # 3. 创建向量数据库
-        self.create_vectorstore(processed_docs)
+            # 3. 创建向量数据库
+            self.create_vectorstore(processed_docs)
 
         # 4. 创建RAG链
         self.create_rag_chain()
 
+        cache_stats = self.embeddings.stats()
+        print(f"嵌入缓存: 命中 {cache_stats['hits']}, 未命中 {cache_stats['misses']}")
         print("RAG系统设置完成！")
 
+    def setup_collection(self, collection: str, documents_path: str) -> None:
+        """
+        加载、分割并全量构建一个集合
+
+        Args:
+            collection: 集合名（如租户ID）
+            documents_path: 该集合的文档路径
+        """
+        print(f"正在构建集合 {collection}...")
+        processed_docs = self.process_documents(self.iter_documents(documents_path))
+        built = self.collections.build(collection, processed_docs)
+        print(f"集合 {collection} 构建完成（估算内存 {built.nbytes / 2**20:.1f}MB）")
+
+    def answer_cache_stats(self) -> Dict[str, float]:
+        """返回语义回答缓存的命中统计"""
+        return self.answer_cache.stats() if self.answer_cache is not None else {}
+
 
 def main():
     """主函数 - 演示RAG系统的使用"""
@@ -234,14 +713,15 @@ def main():
 
     # 创建RAG系统
     rag = RAGSystem(model_name="gpt-4",
-                    api_version=api_version, temperature=0.1)
+                    api_version=api_version, temperature=0.1,
+                    embedding_dimensions=int(os.getenv("EMBEDDING_DIMENSIONS", "0")) or None)
 
     # 示例：使用示例文档
     sample_docs_path = "sample_docs"
 
     try:
         # 设置RAG系统
-        rag.setup(sample_docs_path)
+        rag.setup(sample_docs_path, incremental=True)
 
         # 交互式查询
         print("\n" + "="*50)
@@ -253,6 +733,10 @@ def main():
             question = input("\n请输入您的问题: ").strip()
 
             if question.lower() in ['quit', 'exit', '退出']:
+                cache_stats = rag.answer_cache_stats()
+                if cache_stats:
+                    print(f"回答缓存: 命中 {cache_stats['hits']}, 未命中 {cache_stats['misses']}, "
+                          f"命中率 {cache_stats['hit_rate']:.1%}")
                 print("再见！")
                 break
 
@@ -0,0 +1,388 @@
+"""
+持久化BM25倒排索引
+
+按词项保存倒排表（CSC格式：每个词项的文档行号和词频），检索时只取出问题词项的倒排表，
+用 numpy 的 bincount 一次累加出所有文档的BM25得分。索引可以增量添加/删除文档并保存到磁盘，
+下次启动直接加载倒排表，不需要重新分词。
+
+分词器可替换：默认的 cjk_bigram 把中文按相邻二字组切分、英文按单词切分，
+也可以使用 jieba 分词（需要安装 jieba），或传入任意 text -> List[str] 的函数。
+
+检索可以带元数据过滤表达式（见 metadata_filter.py），只在匹配的文档中选取top-k。
+
+目录结构：
+    bm25.json       头信息（分词器、k1、b、文档数）
+    postings.npz    词表、倒排表指针、文档行号、词频、文档长度
+    records.jsonl   每行一条记录 {"id", "text", "metadata"}
+"""
+
+import copy
+import json
+import math
+import os
+import re
+import uuid
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+from metadata_filter import MetadataFilter, MetadataIndex
+
+HEADER_FILENAME = "bm25.json"
+POSTINGS_FILENAME = "postings.npz"
+RECORDS_FILENAME = "records.jsonl"
+
+Tokenizer = Callable[[str], List[str]]
+
+_LATIN_WORD = re.compile(r"[a-z0-9]+")
+_CJK_RUN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+_TOKEN = re.compile(r"[a-z0-9]+|[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+
+
+def cjk_bigram_tokenizer(text: str) -> List[str]:
+    """英文/数字按单词切分，中文按相邻二字组切分（单字片段保留单字）"""
+    text = text.lower()
+    terms = _LATIN_WORD.findall(text)
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def cjk_unigram_tokenizer(text: str) -> List[str]:
+    """英文/数字按单词切分，中文按单字切分"""
+    return _TOKEN.findall(text.lower())
+
+
+def jieba_tokenizer(text: str) -> List[str]:
+    """使用 jieba 分词（搜索引擎模式），去掉空白和标点"""
+    try:
+        import jieba
+    except ImportError:
+        raise ImportError("使用 jieba 分词器需要先安装: pip install jieba")
+    return [token for token in jieba.lcut_for_search(text.lower())
+            if _TOKEN.match(token)]
+
+
+TOKENIZERS: Dict[str, Tokenizer] = {
+    "cjk_bigram": cjk_bigram_tokenizer,
+    "cjk_unigram": cjk_unigram_tokenizer,
+    "jieba": jieba_tokenizer,
+}
+
+
+def _resolve_tokenizer(tokenizer: Union[str, Tokenizer]) -> Tuple[str, Tokenizer]:
+    """返回 (分词器名称, 分词函数)"""
+    if callable(tokenizer):
+        return getattr(tokenizer, "__name__", type(tokenizer).__name__), tokenizer
+    if tokenizer not in TOKENIZERS:
+        raise ValueError(f"不支持的分词器: {tokenizer}，可选 {tuple(TOKENIZERS)}")
+    return tokenizer, TOKENIZERS[tokenizer]
+
+
+class BM25Index:
+    """可增量更新、可持久化的BM25倒排索引"""
+
+    def __init__(self, tokenizer: Union[str, Tokenizer] = "cjk_bigram",
+                 k1: float = 1.5, b: float = 0.75):
+        """
+        创建空索引
+
+        Args:
+            tokenizer: 分词器名称（见 TOKENIZERS）或分词函数
+            k1: 词频饱和参数
+            b: 文档长度归一化参数
+        """
+        self.tokenizer_name, self.tokenize = _resolve_tokenizer(tokenizer)
+        self.k1 = k1
+        self.b = b
+
+        self.documents: List[Document] = []
+        self._row_of: Dict[str, int] = {}
+        self._metadata_index: Optional[MetadataIndex] = None
+        self.vocabulary: Dict[str, int] = {}
+        # CSC格式倒排表：词项t的倒排表为 rows/tfs[indptr[t]:indptr[t+1]]
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.rows = np.zeros(0, dtype=np.int32)
+        self.tfs = np.zeros(0, dtype=np.float32)
+        self.doc_len = np.zeros(0, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    @classmethod
+    def exists(cls, path: str) -> bool:
+        """判断目录中是否存在索引"""
+        return os.path.isfile(os.path.join(path, HEADER_FILENAME))
+
+    # ------------------------------------------------------------------
+    # 持久化
+    # ------------------------------------------------------------------
+
+    def save(self, path: str) -> None:
+        """保存索引，各文件先写临时文件再原子替换，头信息最后写入"""
+        os.makedirs(path, exist_ok=True)
+        terms = sorted(self.vocabulary, key=self.vocabulary.__getitem__)
+
+        postings_tmp = os.path.join(path, f"{POSTINGS_FILENAME}.tmp")
+        with open(postings_tmp, "wb") as f:
+            np.savez(f, terms=np.array(terms, dtype=str), indptr=self.indptr,
+                     rows=self.rows, tfs=self.tfs, doc_len=self.doc_len)
+        os.replace(postings_tmp, os.path.join(path, POSTINGS_FILENAME))
+
+        records_tmp = os.path.join(path, f"{RECORDS_FILENAME}.tmp")
+        with open(records_tmp, "w", encoding="utf-8") as f:
+            for doc in self.documents:
+                f.write(json.dumps({"id": doc.id, "text": doc.page_content,
+                                    "metadata": doc.metadata},
+                                   ensure_ascii=False) + "\n")
+        os.replace(records_tmp, os.path.join(path, RECORDS_FILENAME))
+
+        header_tmp = os.path.join(path, f"{HEADER_FILENAME}.tmp")
+        with open(header_tmp, "w", encoding="utf-8") as f:
+            json.dump({"tokenizer": self.tokenizer_name, "k1": self.k1, "b": self.b,
+                       "count": len(self.documents)}, f, ensure_ascii=False)
+        os.replace(header_tmp, os.path.join(path, HEADER_FILENAME))
+
+    @classmethod
+    def load(cls, path: str,
+             tokenizer: Optional[Union[str, Tokenizer]] = None) -> "BM25Index":
+        """
+        从磁盘加载索引
+
+        Args:
+            path: 索引目录
+            tokenizer: 分词器；None时使用头信息中记录的内置分词器，
+                自定义分词函数需要再次传入且名称与建索引时一致
+        """
+        with open(os.path.join(path, HEADER_FILENAME), "r", encoding="utf-8") as f:
+            header = json.load(f)
+        index = cls(tokenizer or header["tokenizer"], k1=header["k1"], b=header["b"])
+        if index.tokenizer_name != header["tokenizer"]:
+            raise ValueError(f"索引 {path} 使用分词器 {header['tokenizer']} 构建，"
+                             f"与当前分词器 {index.tokenizer_name} 不一致")
+
+        with np.load(os.path.join(path, POSTINGS_FILENAME)) as data:
+            index.vocabulary = {term: i for i, term in enumerate(data["terms"].tolist())}
+            index.indptr = data["indptr"]
+            index.rows = data["rows"]
+            index.tfs = data["tfs"]
+            index.doc_len = data["doc_len"]
+
+        with open(os.path.join(path, RECORDS_FILENAME), "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                index.documents.append(Document(id=record["id"], page_content=record["text"],
+                                                metadata=record["metadata"]))
+        if len(index.documents) != header["count"] or len(index.doc_len) != header["count"]:
+            raise ValueError(f"索引 {path} 文件不完整，请重建")
+        index._row_of = {doc.id: row for row, doc in enumerate(index.documents)}
+        return index
+
+    def copy(self) -> "BM25Index":
+        """
+        复制索引，用于写时复制
+
+        写入操作只替换倒排数组而不原地修改，因此副本与原索引共享数组，
+        只复制文档列表和映射表。在副本上增删文档不影响正在检索的原索引。
+        """
+        index = copy.copy(self)
+        index.documents = list(self.documents)
+        index._row_of = dict(self._row_of)
+        index.vocabulary = dict(self.vocabulary)
+        index._metadata_index = None
+        return index
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+
+    def _term_ids(self) -> np.ndarray:
+        """每个倒排表条目对应的词项ID"""
+        return np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int64),
+                         np.diff(self.indptr))
+
+    def _set_postings(self, term_ids: np.ndarray, rows: np.ndarray,
+                      tfs: np.ndarray) -> None:
+        """由 (词项, 行号, 词频) 三元组重建CSC倒排表"""
+        order = np.lexsort((rows, term_ids))
+        self.rows = rows[order].astype(np.int32)
+        self.tfs = tfs[order].astype(np.float32)
+        counts = np.bincount(term_ids, minlength=len(self.vocabulary))
+        self.indptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    def add_documents(self, documents: Sequence[Document],
+                      ids: Optional[Sequence[str]] = None) -> List[str]:
+        """
+        添加文档，已存在的ID会先删除再写入
+
+        Args:
+            documents: 文档列表
+            ids: 文档ID，默认使用 Document.id，没有时生成UUID
+
+        Returns:
+            文档ID列表
+        """
+        ids = list(ids) if ids is not None else [doc.id or str(uuid.uuid4())
+                                                  for doc in documents]
+        if len(ids) != len(documents):
+            raise ValueError("ids 与 documents 长度不一致")
+        self.delete([i for i in ids if i in self._row_of])
+
+        new_terms, new_rows, new_tfs, new_len = [], [], [], []
+        for row, (doc_id, doc) in enumerate(zip(ids, documents), start=len(self.documents)):
+            counts = Counter(self.tokenize(doc.page_content))
+            for term, tf in counts.items():
+                new_terms.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                new_rows.append(row)
+                new_tfs.append(tf)
+            new_len.append(sum(counts.values()))
+            self.documents.append(Document(id=doc_id, page_content=doc.page_content,
+                                           metadata=doc.metadata))
+            self._row_of[doc_id] = row
+            if self._metadata_index is not None:
+                self._metadata_index.add(row, doc.metadata)
+
+        self._set_postings(
+            np.concatenate([self._term_ids(), np.asarray(new_terms, dtype=np.int64)]),
+            np.concatenate([self.rows, np.asarray(new_rows, dtype=np.int32)]),
+            np.concatenate([self.tfs, np.asarray(new_tfs, dtype=np.float32)]))
+        self.doc_len = np.concatenate([self.doc_len, np.asarray(new_len, dtype=np.float32)])
+        return ids
+
+    def delete(self, ids: Sequence[str]) -> int:
+        """
+        按ID删除文档，并压缩倒排表中的行号
+
+        Returns:
+            实际删除的文档数
+        """
+        rows = [self._row_of[i] for i in ids if i in self._row_of]
+        if not rows:
+            return 0
+        keep = np.ones(len(self.documents), dtype=bool)
+        keep[rows] = False
+        new_row = np.cumsum(keep) - 1
+
+        entry_keep = keep[self.rows]
+        self._set_postings(self._term_ids()[entry_keep],
+                           new_row[self.rows[entry_keep]], self.tfs[entry_keep])
+        self.doc_len = self.doc_len[keep]
+        self.documents = [doc for doc, k in zip(self.documents, keep) if k]
+        self._row_of = {doc.id: row for row, doc in enumerate(self.documents)}
+        # 行号已压缩，元数据索引在下次过滤时重建
+        self._metadata_index = None
+        return len(rows)
+
+    # ------------------------------------------------------------------
+    # 检索
+    # ------------------------------------------------------------------
+
+    def get_scores(self, query: str) -> np.ndarray:
+        """计算问题对所有文档的BM25得分"""
+        num_docs = len(self.documents)
+        scores = np.zeros(num_docs, dtype=np.float32)
+        if num_docs == 0:
+            return scores
+
+        query_terms = Counter(t for t in self.tokenize(query) if t in self.vocabulary)
+        if not query_terms:
+            return scores
+
+        avg_len = float(self.doc_len.mean()) or 1.0
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len / avg_len)
+        rows, weights = [], []
+        for term, query_tf in query_terms.items():
+            term_id = self.vocabulary[term]
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            df = end - start
+            if df == 0:
+                continue
+            idf = math.log((num_docs - df + 0.5) / (df + 0.5) + 1)
+            term_rows = self.rows[start:end]
+            tfs = self.tfs[start:end]
+            rows.append(term_rows)
+            weights.append(query_tf * idf * tfs * (self.k1 + 1) / (tfs + norm[term_rows]))
+        if rows:
+            scores += np.bincount(np.concatenate(rows), weights=np.concatenate(weights),
+                                  minlength=num_docs).astype(np.float32)
+        return scores
+
+    @property
+    def metadata_index(self) -> MetadataIndex:
+        """元数据倒排索引，首次过滤时构建"""
+        if self._metadata_index is None:
+            self._metadata_index = MetadataIndex.from_metadatas(
+                doc.metadata for doc in self.documents)
+            self._metadata_index.count = len(self.documents)
+        return self._metadata_index
+
+    def search(self, query: str, k: int = 4,
+               filter: Optional[MetadataFilter] = None) -> List[Tuple[Document, float]]:
+        """
+        返回得分最高的k个文档及其BM25得分（不含零分文档）
+
+        Args:
+            query: 问题
+            k: 返回的文档数
+            filter: 元数据过滤表达式；指定时只在匹配的文档中选取top-k
+        """
+        scores = self.get_scores(query)
+        candidates = (self.metadata_index.rows(filter) if filter
+                      else np.arange(len(scores)))
+        if k < len(candidates):
+            top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        else:
+            top = candidates
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.documents[row], float(scores[row])) for row in top if scores[row] > 0]
+
+
+class BM25IndexRetriever(BaseRetriever):
+    """基于持久化BM25索引的检索器"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    index: BM25Index
+    """BM25索引"""
+    k: int = 4
+    """返回的文档数"""
+
+    @classmethod
+    def from_documents(cls, documents: Sequence[Document],
+                       ids: Optional[Sequence[str]] = None,
+                       tokenizer: Union[str, Tokenizer] = "cjk_bigram",
+                       path: Optional[str] = None,
+                       **kwargs: Any) -> "BM25IndexRetriever":
+        """
+        由文档列表构建索引，指定 path 时同时保存到磁盘
+
+        Args:
+            documents: 文档列表
+            ids: 文档ID
+            tokenizer: 分词器
+            path: 索引目录
+        """
+        index = BM25Index(tokenizer)
+        index.add_documents(documents, ids=ids)
+        if path:
+            index.save(path)
+        return cls(index=index, **kwargs)
+
+    @classmethod
+    def load(cls, path: str, tokenizer: Optional[Union[str, Tokenizer]] = None,
+             **kwargs: Any) -> "BM25IndexRetriever":
+        """从磁盘加载索引"""
+        return cls(index=BM25Index.load(path, tokenizer), **kwargs)
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun,
+                                filter: Optional[MetadataFilter] = None) -> List[Document]:
+        return [doc for doc, _ in self.index.search(query, self.k, filter=filter)]
@@ -0,0 +1,301 @@
+"""
+多集合（多租户）索引管理
+
+每个集合（例如每个客户的知识库）保存在根目录下的独立子目录中，
+首次使用时才打开，常用的集合常驻内存；常驻集合的估算内存超过预算时，
+按最近最少使用（LRU）顺序关闭最久未使用的集合。检索按集合名路由到对应的索引，
+一个进程可以服务大量集合而不必在启动时加载所有索引。
+
+内存估算：本地NumPy索引为向量矩阵和常驻的量化编码大小，
+Chroma 为集合目录的磁盘大小（HNSW索引打开后整体载入内存）。
+"""
+
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore, VectorStoreRetriever
+
+from ingest_manifest import compute_chunk_ids
+from matryoshka import embedding_fingerprint, load_fingerprint, save_fingerprint
+from vector_index import NumpyVectorStore, VectorIndex
+
+BACKENDS = ("chroma", "numpy")
+
+_COLLECTION_NAME = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]{0,127}")
+
+
+def default_collections_directory() -> str:
+    """集合根目录，可通过环境变量 COLLECTIONS_DIRECTORY 配置"""
+    return os.getenv("COLLECTIONS_DIRECTORY", "./collections")
+
+
+def default_memory_budget() -> int:
+    """常驻集合的内存预算（字节），可通过环境变量 COLLECTION_MEMORY_BUDGET_MB 配置"""
+    return int(float(os.getenv("COLLECTION_MEMORY_BUDGET_MB", "1024")) * 1024 * 1024)
+
+
+def _directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                pass
+    return total
+
+
+@dataclass
+class Collection:
+    """一个已打开的集合"""
+    name: str
+    vectorstore: VectorStore
+    retriever: VectorStoreRetriever
+    nbytes: int
+    loaded_at: float = field(default_factory=time.time)
+
+
+class CollectionManager:
+    """按需打开集合、在内存预算内按LRU淘汰的多集合索引管理器"""
+
+    def __init__(self,
+                 embeddings: Embeddings,
+                 root_directory: Optional[str] = None,
+                 backend: str = "numpy",
+                 memory_budget_bytes: Optional[int] = None,
+                 search_kwargs: Optional[Dict[str, Any]] = None):
+        """
+        初始化集合管理器（不打开任何集合）
+
+        Args:
+            embeddings: 所有集合共用的嵌入模型
+            root_directory: 集合根目录，每个集合一个子目录
+            backend: 向量存储后端，chroma 或 numpy
+            memory_budget_bytes: 常驻集合的估算内存上限
+            search_kwargs: 各集合检索器的检索参数，如 {"k": 6}
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"不支持的向量存储后端: {backend}，可选 {BACKENDS}")
+        self.embeddings = embeddings
+        self.root_directory = root_directory or default_collections_directory()
+        self.backend = backend
+        self.memory_budget_bytes = (memory_budget_bytes if memory_budget_bytes is not None
+                                    else default_memory_budget())
+        self.search_kwargs = search_kwargs or {"k": 6}
+
+        # 集合名 -> 已打开的集合，按最近使用排序
+        self._resident: "OrderedDict[str, Collection]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 每个集合一个打开锁，同一集合只打开一次，不同集合可以同时打开
+        self._open_locks: Dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        """常驻的集合数"""
+        return len(self._resident)
+
+    # ------------------------------------------------------------------
+    # 集合目录
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def validate_name(name: str) -> str:
+        """集合名只允许字母、数字、下划线、点和连字符，避免路径穿越"""
+        if not _COLLECTION_NAME.fullmatch(name) or ".." in name:
+            raise ValueError(f"无效的集合名: {name!r}")
+        return name
+
+    def path(self, name: str) -> str:
+        """集合的存储目录"""
+        return os.path.join(self.root_directory, self.validate_name(name))
+
+    def exists(self, name: str) -> bool:
+        """集合是否已在磁盘上建立"""
+        path = self.path(name)
+        if self.backend == "numpy":
+            return VectorIndex.exists(path)
+        return os.path.isfile(os.path.join(path, "chroma.sqlite3"))
+
+    def names(self) -> List[str]:
+        """磁盘上所有集合的名称"""
+        if not os.path.isdir(self.root_directory):
+            return []
+        return sorted(name for name in os.listdir(self.root_directory)
+                      if _COLLECTION_NAME.fullmatch(name) and self.exists(name))
+
+    # ------------------------------------------------------------------
+    # 打开与淘汰
+    # ------------------------------------------------------------------
+
+    def _open(self, name: str) -> Collection:
+        """从磁盘打开集合并估算其常驻内存"""
+        path = self.path(name)
+        if self.backend == "numpy":
+            vectorstore = NumpyVectorStore(self.embeddings, path)
+            index = vectorstore.index
+            nbytes = index.nbytes + index.resident_nbytes if index is not None else 0
+        else:
+            indexed_with = load_fingerprint(path)
+            if indexed_with and indexed_with != embedding_fingerprint(self.embeddings):
+                raise ValueError(
+                    f"集合 {name} 的嵌入配置 {indexed_with} 与当前配置 "
+                    f"{embedding_fingerprint(self.embeddings)} 不一致，请重建集合")
+            vectorstore = Chroma(persist_directory=path, embedding_function=self.embeddings)
+            nbytes = _directory_size(path)
+        retriever = vectorstore.as_retriever(search_type="similarity",
+                                             search_kwargs=dict(self.search_kwargs))
+        return Collection(name=name, vectorstore=vectorstore, retriever=retriever,
+                          nbytes=nbytes)
+
+    @staticmethod
+    def _close(collection: Collection) -> None:
+        """释放集合占用的资源"""
+        if isinstance(collection.vectorstore, Chroma):
+            # Chroma 按目录缓存共享的System；从缓存中移除后，
+            # 进行中的检索结束、引用释放时其内存随之回收。
+            # 公开的 clear_system_cache() 会清空所有目录（包括其他常驻集合）的缓存，
+            # 因此只移除该集合的条目；这依赖chromadb内部属性，缺失时只提示、不释放
+            try:
+                from chromadb.api.shared_system_client import SharedSystemClient
+            except ImportError:
+                SharedSystemClient = None
+            cache = getattr(SharedSystemClient, "_identifier_to_system", None)
+            identifier = getattr(getattr(collection.vectorstore, "_client", None),
+                                 "_identifier", None)
+            if not isinstance(cache, dict) or identifier is None:
+                print(f"⚠️ 当前chromadb版本不支持按目录释放缓存，集合 {collection.name} "
+                      "的内存将在进程退出时释放")
+                return
+            cache.pop(identifier, None)
+
+    def resident_nbytes(self) -> int:
+        """常驻集合的估算内存总量"""
+        return sum(c.nbytes for c in self._resident.values())
+
+    def _evict_over_budget(self) -> List[Collection]:
+        """超出预算时从最久未使用的集合开始淘汰，至少保留最近使用的一个（调用方持有锁）"""
+        evicted = []
+        while len(self._resident) > 1 and self.resident_nbytes() > self.memory_budget_bytes:
+            _, collection = self._resident.popitem(last=False)
+            evicted.append(collection)
+            self.evictions += 1
+        return evicted
+
+    def get(self, name: str) -> Collection:
+        """
+        获取集合，未打开时从磁盘打开
+
+        Args:
+            name: 集合名
+
+        Returns:
+            已打开的集合
+        """
+        self.validate_name(name)
+        with self._lock:
+            collection = self._resident.get(name)
+            if collection is not None:
+                self._resident.move_to_end(name)
+                self.hits += 1
+                return collection
+            open_lock = self._open_locks.setdefault(name, threading.Lock())
+
+        with open_lock:
+            with self._lock:
+                # 等待锁期间其他线程可能已经打开了该集合
+                collection = self._resident.get(name)
+                if collection is not None:
+                    self._resident.move_to_end(name)
+                    self.hits += 1
+                    return collection
+            if not self.exists(name):
+                raise ValueError(f"集合不存在: {name}（目录 {self.path(name)}）")
+            collection = self._open(name)
+
+            with self._lock:
+                self._resident[name] = collection
+                self.loads += 1
+                evicted = self._evict_over_budget()
+        for old in evicted:
+            self._close(old)
+        if collection.nbytes > self.memory_budget_bytes:
+            print(f"⚠️ 集合 {name} 的估算内存 {collection.nbytes / 2**20:.1f}MB "
+                  f"超过预算 {self.memory_budget_bytes / 2**20:.1f}MB")
+        return collection
+
+    def vectorstore(self, name: str) -> VectorStore:
+        """集合的向量存储"""
+        return self.get(name).vectorstore
+
+    def retriever(self, name: str) -> VectorStoreRetriever:
+        """集合的检索器"""
+        return self.get(name).retriever
+
+    def evict(self, name: str) -> bool:
+        """
+        关闭常驻的集合
+
+        Returns:
+            集合是否原本常驻
+        """
+        with self._lock:
+            collection = self._resident.pop(name, None)
+        if collection is None:
+            return False
+        self._close(collection)
+        return True
+
+    # ------------------------------------------------------------------
+    # 构建
+    # ------------------------------------------------------------------
+
+    def build(self, name: str, documents: Sequence[Document]) -> Collection:
+        """
+        全量构建（或重建）集合并使其常驻
+
+        Args:
+            name: 集合名
+            documents: 已分割的文档片段
+        """
+        path = self.path(name)
+        self.evict(name)
+        ids = compute_chunk_ids(documents)
+        if self.backend == "numpy":
+            shutil.rmtree(path, ignore_errors=True)
+            NumpyVectorStore.from_documents(documents=list(documents),
+                                            embedding=self.embeddings,
+                                            ids=ids, index_path=path)
+        else:
+            Chroma(persist_directory=path).delete_collection()
+            Chroma.from_documents(documents=list(documents), embedding=self.embeddings,
+                                  ids=ids, persist_directory=path)
+            save_fingerprint(path, self.embeddings)
+        return self.get(name)
+
+    def delete(self, name: str) -> None:
+        """关闭并删除集合"""
+        self.evict(name)
+        shutil.rmtree(self.path(name), ignore_errors=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回常驻集合和命中统计"""
+        with self._lock:
+            return {
+                "resident": list(self._resident),
+                "resident_nbytes": self.resident_nbytes(),
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "hits": self.hits,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,38 @@
+"""
+测试共用的夹具：确定性的本地嵌入替身，不调用任何API
+"""
+
+from typing import List
+
+import pytest
+
+from retrieval_benchmark import HashedNGramEmbeddings
+
+
+class CountingEmbeddings(HashedNGramEmbeddings):
+    """记录被嵌入文本的本地嵌入，stats() 与 CachedEmbeddings 的接口一致"""
+
+    def __init__(self, dimensions: int = 64):
+        super().__init__(dimensions=dimensions)
+        self.embedded: List[str] = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+    def stats(self):
+        return {"hits": 0, "misses": len(self.embedded), "hit_rate": 0.0}
+
+
+@pytest.fixture
+def embeddings():
+    return CountingEmbeddings()
+
+
+@pytest.fixture
+def azure_env(monkeypatch, tmp_path):
+    """构造RAG系统所需的Azure配置（客户端只创建不调用），嵌入缓存写到临时目录"""
+    monkeypatch.setenv("AZURE_OPENAI_API_KEY", "test")
+    monkeypatch.setenv("AZURE_OPENAI_ENDPOINT", "https://test.openai.azure.com")
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("EMBEDDING_CACHE_PATH", str(tmp_path / "embedding_cache.sqlite"))
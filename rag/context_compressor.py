@@ -0,0 +1,140 @@
+"""
+本地抽取式上下文压缩
+
+把检索到的文档切分为句子，按与问题的相关度给句子打分，
+在token预算内保留得分最高的句子（按原文顺序拼回各自的文档）。
+默认使用词项重叠打分，不调用任何API；也可以传入（带缓存的）嵌入模型按余弦相似度打分。
+用于替代每个文档调用一次LLM的 LLMChainExtractor。
+"""
+
+import math
+import re
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import BaseDocumentCompressor, Document
+from langchain_core.embeddings import Embeddings
+from pydantic import ConfigDict
+
+from bm25_index import Tokenizer, cjk_bigram_tokenizer
+
+# 中英文句末标点及换行处切分，标点保留在句尾
+_SENTENCE_END = re.compile(r"(?<=[。！？；!?;])|(?<=\.)\s+|\n+")
+
+
+def split_sentences(text: str) -> List[str]:
+    """按中英文句末标点和换行切分句子，去掉空白句"""
+    return [s.strip() for s in _SENTENCE_END.split(text) if s and s.strip()]
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class ExtractiveCompressor(BaseDocumentCompressor):
+    """按句子与问题的相关度抽取上下文，总长度不超过token预算"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    max_tokens: int = 1500
+    """保留句子的总token数上限"""
+    embeddings: Optional[Embeddings] = None
+    """可选的嵌入模型；为None时使用词项重叠打分"""
+    token_counter: Optional[Callable[[str], int]] = None
+    """token计数函数，默认使用 tiktoken 的 cl100k_base 编码"""
+    tokenizer: Tokenizer = cjk_bigram_tokenizer
+    """词项重叠打分使用的分词器"""
+
+    def count_tokens(self, text: str) -> int:
+        """统计文本的token数"""
+        if self.token_counter is None:
+            import tiktoken
+            encoding = tiktoken.get_encoding("cl100k_base")
+            self.token_counter = lambda s: len(encoding.encode(s, disallowed_special=()))
+        return self.token_counter(text)
+
+    @staticmethod
+    def _split(documents: Sequence[Document]) -> List[Tuple[int, int, str]]:
+        """切分所有文档，返回 (文档序号, 句子序号, 句子)"""
+        return [(doc_idx, sent_idx, sentence)
+                for doc_idx, doc in enumerate(documents)
+                for sent_idx, sentence in enumerate(split_sentences(doc.page_content))]
+
+    def lexical_scores(self, sentences: List[str], query: str) -> List[float]:
+        """
+        词项重叠得分：句子覆盖的问题词项IDF权重之和占问题总权重的比例
+
+        IDF在本次检索到的句子集合内计算，使常见词的权重较低。
+        """
+        query_terms = set(self.tokenizer(query))
+        sentence_terms = [set(self.tokenizer(s)) for s in sentences]
+        if not query_terms or not sentences:
+            return [0.0] * len(sentences)
+
+        df: Dict[str, int] = {term: 0 for term in query_terms}
+        for terms in sentence_terms:
+            for term in query_terms & terms:
+                df[term] += 1
+        n = len(sentences)
+        idf = {term: math.log(1 + n / (1 + count)) for term, count in df.items()}
+        total = sum(idf.values())
+        return [sum(idf[t] for t in query_terms & terms) / total
+                for terms in sentence_terms]
+
+    def _select(self, documents: Sequence[Document],
+                items: List[Tuple[int, int, str]],
+                scores: List[float]) -> List[Document]:
+        """在预算内按得分选取句子，按原顺序拼回文档"""
+        ranked = sorted(range(len(items)),
+                        key=lambda i: (-scores[i], items[i][0], items[i][1]))
+        # 只有与问题完全无关时才退回按检索顺序截取
+        if any(score > 0 for score in scores):
+            ranked = [i for i in ranked if scores[i] > 0]
+
+        selected: Dict[int, List[Tuple[int, str]]] = {}
+        used = 0
+        for i in ranked:
+            doc_idx, sent_idx, sentence = items[i]
+            tokens = self.count_tokens(sentence)
+            if used + tokens > self.max_tokens:
+                continue
+            used += tokens
+            selected.setdefault(doc_idx, []).append((sent_idx, sentence))
+
+        compressed = []
+        for doc_idx in sorted(selected):
+            sentences = [s for _, s in sorted(selected[doc_idx])]
+            compressed.append(Document(page_content="\n".join(sentences),
+                                       metadata=documents[doc_idx].metadata))
+        return compressed
+
+    def compress_documents(self,
+                           documents: Sequence[Document],
+                           query: str,
+                           callbacks: Optional[Callbacks] = None) -> Sequence[Document]:
+        """抽取与问题最相关的句子"""
+        items = self._split(documents)
+        sentences = [sentence for _, _, sentence in items]
+        if self.embeddings is None:
+            scores = self.lexical_scores(sentences, query)
+        else:
+            query_vector = self.embeddings.embed_query(query)
+            scores = [_cosine(query_vector, v)
+                      for v in self.embeddings.embed_documents(sentences)]
+        return self._select(documents, items, scores)
+
+    async def acompress_documents(self,
+                                  documents: Sequence[Document],
+                                  query: str,
+                                  callbacks: Optional[Callbacks] = None) -> Sequence[Document]:
+        """异步抽取；词项打分只需毫秒级，直接在当前线程执行"""
+        if self.embeddings is None:
+            return self.compress_documents(documents, query, callbacks)
+        items = self._split(documents)
+        query_vector = await self.embeddings.aembed_query(query)
+        vectors = await self.embeddings.aembed_documents(
+            [sentence for _, _, sentence in items])
+        return self._select(documents, items,
+                            [_cosine(query_vector, v) for v in vectors])
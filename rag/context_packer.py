@@ -0,0 +1,151 @@
+"""
+上下文打包
+
+把检索到的文档片段格式化为提示中的上下文：
+同一来源中相邻或重叠的片段（根据分割时记录的 start_index）合并为一段并去掉重叠文本，
+合并后的段落按相关度排序（检索结果的顺序即相关度），并按真实tokenizer截断到token预算内。
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+DEFAULT_TEMPLATE = "{content}"
+
+
+def _load_encoding(model_name: Optional[str]) -> Any:
+    """按模型名加载tiktoken编码，未知模型使用 cl100k_base"""
+    import tiktoken
+    if model_name:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            pass
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def merge_adjacent_chunks(docs: List[Document]) -> List[Tuple[int, Document]]:
+    """
+    合并同一来源中相邻或重叠的片段
+
+    Args:
+        docs: 按相关度排序的文档片段
+
+    Returns:
+        [(合并段中最靠前的片段排名, 合并后的文档)]，按排名排序
+    """
+    groups: Dict[str, List[Tuple[int, Document]]] = {}
+    merged: List[Tuple[int, Document]] = []
+    seen = set()
+    for rank, doc in enumerate(docs):
+        key = (doc.metadata.get("source"), doc.page_content)
+        if key in seen:
+            continue
+        seen.add(key)
+        if isinstance(doc.metadata.get("start_index"), int) and "source" in doc.metadata:
+            groups.setdefault(doc.metadata["source"], []).append((rank, doc))
+        else:
+            merged.append((rank, doc))
+
+    for chunks in groups.values():
+        chunks.sort(key=lambda item: item[1].metadata["start_index"])
+        rank, first = chunks[0]
+        start = first.metadata["start_index"]
+        text = first.page_content
+        for next_rank, doc in chunks[1:]:
+            next_start = doc.metadata["start_index"]
+            offset = next_start - start
+            if text[offset:offset + len(doc.page_content)] == doc.page_content:
+                # 片段完全包含在已合并的文本中
+                rank = min(rank, next_rank)
+                continue
+            overlap = start + len(text) - next_start
+            # 只有重叠部分与前一段结尾完全一致时才合并（压缩过的片段内容已变化，不合并）
+            if 0 <= overlap <= len(doc.page_content) and (
+                    overlap == 0 or text.endswith(doc.page_content[:overlap])):
+                text += doc.page_content[overlap:]
+                rank = min(rank, next_rank)
+                continue
+            merged.append((rank, Document(page_content=text,
+                                          metadata={**first.metadata, "start_index": start})))
+            rank, first, start, text = next_rank, doc, next_start, doc.page_content
+        merged.append((rank, Document(page_content=text,
+                                      metadata={**first.metadata, "start_index": start})))
+
+    merged.sort(key=lambda item: item[0])
+    return merged
+
+
+class ContextPacker:
+    """合并相邻片段、按相关度排序并限制token数的上下文格式化器"""
+
+    def __init__(self,
+                 max_tokens: int = 3000,
+                 template: str = DEFAULT_TEMPLATE,
+                 separator: str = "\n\n",
+                 model_name: Optional[str] = None,
+                 encoding: Optional[Any] = None,
+                 min_truncated_tokens: int = 50):
+        """
+        初始化上下文打包器
+
+        Args:
+            max_tokens: 上下文的token数上限
+            template: 每段上下文的格式，可用 {i}（序号）、{source}（来源）、{content}（内容）
+            separator: 段落之间的分隔符
+            model_name: 用于选择tiktoken编码的模型名
+            encoding: 自定义编码（需提供 encode/decode），默认按 model_name 加载tiktoken编码
+            min_truncated_tokens: 最后一段被截断后至少保留的token数，不足时整段丢弃
+        """
+        self.max_tokens = max_tokens
+        self.template = template
+        self.separator = separator
+        self.model_name = model_name
+        self._encoding = encoding
+        self.min_truncated_tokens = min_truncated_tokens
+
+    @property
+    def encoding(self) -> Any:
+        if self._encoding is None:
+            self._encoding = _load_encoding(self.model_name)
+        return self._encoding
+
+    def count_tokens(self, text: str) -> int:
+        """统计文本的token数"""
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def _format(self, i: int, doc: Document, content: str) -> str:
+        return self.template.format(i=i, source=doc.metadata.get("source", "未知来源"),
+                                    content=content)
+
+    def pack(self, docs: List[Document]) -> List[str]:
+        """
+        返回打包后的上下文段落（已格式化），总token数不超过预算
+
+        Args:
+            docs: 按相关度排序的文档片段
+        """
+        blocks: List[str] = []
+        used = 0
+        separator_tokens = self.count_tokens(self.separator)
+        for i, (_, doc) in enumerate(merge_adjacent_chunks(docs), 1):
+            content = doc.page_content.strip()
+            block = self._format(i, doc, content)
+            cost = self.count_tokens(block) + (separator_tokens if blocks else 0)
+            if used + cost <= self.max_tokens:
+                blocks.append(block)
+                used += cost
+                continue
+
+            # 超出预算：截断当前段落的内容，之后的段落不再加入
+            overhead = cost - self.count_tokens(content)
+            remaining = self.max_tokens - used - overhead
+            if remaining >= self.min_truncated_tokens:
+                tokens = self.encoding.encode(content, disallowed_special=())
+                blocks.append(self._format(i, doc, self.encoding.decode(tokens[:remaining])))
+            break
+        return blocks
+
+    def __call__(self, docs: List[Document]) -> str:
+        """格式化为上下文字符串，可直接作为 SourcedRAGChain 的 format_docs"""
+        return self.separator.join(self.pack(docs))
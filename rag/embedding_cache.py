@@ -0,0 +1,304 @@
+"""
+持久化嵌入缓存
+
+以 (模型, 维度, 文本哈希) 为键，把已经计算过的向量保存在本地SQLite中，
+并在内存中保留一个有界的LRU热缓存。所有RAG流水线共享同一个缓存文件，
+重建索引或重复查询时不再为已有向量支付网络延迟和嵌入费用。
+"""
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_CACHE_PATH = "./embedding_cache.sqlite"
+
+
+def default_cache_path() -> str:
+    """返回嵌入缓存文件路径（可通过 EMBEDDING_CACHE_PATH 覆盖）"""
+    return os.getenv("EMBEDDING_CACHE_PATH", DEFAULT_CACHE_PATH)
+
+
+def embedding_model_name(embeddings: Embeddings) -> str:
+    """获取嵌入模型名称（Azure优先使用部署名）"""
+    return (getattr(embeddings, "deployment", None)
+            or getattr(embeddings, "model", None)
+            or type(embeddings).__name__)
+
+
+def embedding_dimensions(embeddings: Embeddings) -> Optional[int]:
+    """获取嵌入模型请求的向量维度，未指定时返回None"""
+    return getattr(embeddings, "dimensions", None)
+
+
+class EmbeddingStore:
+    """基于SQLite的向量存储，向量以float32二进制保存"""
+
+    def __init__(self, path: str, max_entries: Optional[int] = None,
+                 table: str = "embeddings"):
+        """
+        初始化向量存储
+
+        Args:
+            path: SQLite文件路径
+            max_entries: 最多保留的条目数，超出时按最近访问时间淘汰
+            table: 表名，同一文件中的不同用途（缓存、检查点）使用不同的表
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.table = table
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                model TEXT NOT NULL,
+                dimensions INTEGER NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model, dimensions, text_hash)
+            )
+            """
+        )
+        # 默认表沿用原有的索引名，已有的缓存文件不会多建一个索引
+        index_name = ("idx_last_access" if table == "embeddings"
+                      else f"idx_{table}_last_access")
+        self._conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} (last_access)")
+        self._conn.commit()
+
+    def get_many(self, model: str, dimensions: int,
+                 text_hashes: Sequence[str]) -> Dict[str, List[float]]:
+        """批量读取向量，返回命中的 {文本哈希: 向量}"""
+        found: Dict[str, List[float]] = {}
+        if not text_hashes:
+            return found
+
+        with self._lock:
+            # SQLite对参数数量有限制，分批查询
+            for start in range(0, len(text_hashes), 500):
+                batch = list(text_hashes[start:start + 500])
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM {self.table} "
+                    f"WHERE model = ? AND dimensions = ? "
+                    f"AND text_hash IN ({placeholders})",
+                    [model, dimensions, *batch]
+                ).fetchall()
+                for text_hash, blob in rows:
+                    found[text_hash] = array("f", blob).tolist()
+
+            if found and self.max_entries is not None:
+                self._conn.executemany(
+                    f"UPDATE {self.table} SET last_access = ? "
+                    "WHERE model = ? AND dimensions = ? AND text_hash = ?",
+                    [(time.time(), model, dimensions, h) for h in found]
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, model: str, dimensions: int,
+                 items: Sequence[Tuple[str, List[float]]]) -> None:
+        """批量写入 (文本哈希, 向量)"""
+        if not items:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} "
+                "(model, dimensions, text_hash, vector, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(model, dimensions, text_hash, array("f", vector).tobytes(), now)
+                 for text_hash, vector in items]
+            )
+            if self.max_entries is not None:
+                self._conn.execute(
+                    f"DELETE FROM {self.table} WHERE rowid IN ("
+                    f"SELECT rowid FROM {self.table} ORDER BY last_access DESC "
+                    "LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+            self._conn.commit()
+
+    def delete_many(self, model: str, dimensions: int,
+                    text_hashes: Sequence[str]) -> None:
+        """批量删除向量"""
+        if not text_hashes:
+            return
+
+        with self._lock:
+            self._conn.executemany(
+                f"DELETE FROM {self.table} "
+                f"WHERE model = ? AND dimensions = ? AND text_hash = ?",
+                [(model, dimensions, h) for h in text_hashes]
+            )
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def close(self) -> None:
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """带内存LRU和SQLite持久化缓存的嵌入包装器"""
+
+    def __init__(self,
+                 embeddings: Embeddings,
+                 cache_path: Optional[str] = None,
+                 memory_entries: int = 10000,
+                 max_disk_entries: Optional[int] = None):
+        """
+        初始化缓存嵌入
+
+        Args:
+            embeddings: 实际调用API的嵌入模型
+            cache_path: SQLite缓存文件路径
+            memory_entries: 内存LRU缓存的最大条目数
+            max_disk_entries: 磁盘缓存的最大条目数，None表示不限制
+        """
+        self.embeddings = embeddings
+        self.model = embedding_model_name(embeddings)
+        # 0 表示使用模型默认维度
+        self.dimensions = embedding_dimensions(embeddings) or 0
+        self.store = EmbeddingStore(
+            cache_path or default_cache_path(),
+            max_entries=max_disk_entries
+        )
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _lookup_memory(self, texts: List[str]
+                       ) -> Tuple[List[str], Dict[str, List[float]], List[str]]:
+        """查找内存LRU，返回 (文本哈希列表, 命中的向量, 未命中的去重哈希)"""
+        hashes = [self._hash(text) for text in texts]
+        found: Dict[str, List[float]] = {}
+
+        with self._lock:
+            for text_hash in hashes:
+                vector = self._memory.get(text_hash)
+                if vector is not None:
+                    self._memory.move_to_end(text_hash)
+                    found[text_hash] = vector
+
+        missing = [h for h in dict.fromkeys(hashes) if h not in found]
+        return hashes, found, missing
+
+    def _load(self, missing: List[str]) -> Dict[str, List[float]]:
+        """从SQLite读取内存未命中的向量并放入内存LRU"""
+        from_disk = self.store.get_many(self.model, self.dimensions, missing)
+        self._remember(from_disk.items())
+        return from_disk
+
+    def _lookup(self, texts: List[str]) -> Tuple[List[str], Dict[str, List[float]]]:
+        """查找缓存，返回 (文本哈希列表, 命中的向量)"""
+        hashes, found, missing = self._lookup_memory(texts)
+        if missing:
+            found.update(self._load(missing))
+        return hashes, found
+
+    async def _alookup(self, texts: List[str]) -> Tuple[List[str], Dict[str, List[float]]]:
+        """异步查找缓存，SQLite读取在线程中进行，不阻塞事件循环"""
+        hashes, found, missing = self._lookup_memory(texts)
+        if missing:
+            found.update(await asyncio.to_thread(self._load, missing))
+        return hashes, found
+
+    def _remember(self, items) -> None:
+        """写入内存LRU"""
+        with self._lock:
+            for text_hash, vector in items:
+                self._memory[text_hash] = vector
+                self._memory.move_to_end(text_hash)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _pending(self, texts: List[str], hashes: List[str],
+                 found: Dict[str, List[float]]) -> Tuple[List[str], List[str]]:
+        """返回需要调用API的 (去重后的文本, 对应哈希)，并更新命中计数"""
+        pending: Dict[str, str] = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in found:
+                pending.setdefault(text_hash, text)
+
+        with self._lock:
+            self.misses += len(pending)
+            self.hits += len(texts) - len(pending)
+        return list(pending.values()), list(pending.keys())
+
+    def _store(self, hashes: List[str], vectors: List[List[float]],
+               found: Dict[str, List[float]]) -> None:
+        items = list(zip(hashes, vectors))
+        self.store.put_many(self.model, self.dimensions, items)
+        self._remember(items)
+        found.update(items)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """嵌入文档列表，只为未缓存的文本调用API"""
+        hashes, found = self._lookup(texts)
+        pending_texts, pending_hashes = self._pending(texts, hashes, found)
+        if pending_texts:
+            vectors = self.embeddings.embed_documents(pending_texts)
+            self._store(pending_hashes, vectors, found)
+        return [found[text_hash] for text_hash in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        """嵌入查询文本"""
+        hashes, found = self._lookup([text])
+        pending_texts, pending_hashes = self._pending([text], hashes, found)
+        if pending_texts:
+            vector = self.embeddings.embed_query(text)
+            self._store(pending_hashes, [vector], found)
+        return found[hashes[0]]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """异步嵌入文档列表"""
+        hashes, found = await self._alookup(texts)
+        pending_texts, pending_hashes = self._pending(texts, hashes, found)
+        if pending_texts:
+            vectors = await self.embeddings.aembed_documents(pending_texts)
+            await asyncio.to_thread(self._store, pending_hashes, vectors, found)
+        return [found[text_hash] for text_hash in hashes]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """异步嵌入查询文本"""
+        hashes, found = await self._alookup([text])
+        pending_texts, pending_hashes = self._pending([text], hashes, found)
+        if pending_texts:
+            vector = await self.embeddings.aembed_query(text)
+            await asyncio.to_thread(self._store, pending_hashes, [vector], found)
+        return found[hashes[0]]
+
+    def stats(self) -> Dict[str, float]:
+        """返回缓存命中统计"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_entries": len(self._memory),
+        }
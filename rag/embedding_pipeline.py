@@ -0,0 +1,243 @@
+"""
+批量并发嵌入流水线
+
+在构建索引时把待嵌入文本切分为固定大小的批次，以有界并发调用嵌入API，
+用令牌桶同时限制每分钟请求数和每分钟token数，遇到429时指数退避重试，
+并把每个完成的批次写入检查点，构建中断后重新运行会从断点继续。
+检查点使用独立的表，可以与嵌入缓存共用一个SQLite文件；全部批次完成后清除本次的检查点。
+"""
+
+import asyncio
+import concurrent.futures
+import hashlib
+import os
+import random
+import time
+from typing import Any, Coroutine, Dict, List, Optional, Tuple, TypeVar
+
+import openai
+import tiktoken
+from langchain_core.embeddings import Embeddings
+
+from embedding_cache import EmbeddingStore, embedding_dimensions, embedding_model_name
+
+T = TypeVar("T")
+
+CHECKPOINT_TABLE = "embedding_checkpoint"
+
+
+class TokenBucket:
+    """令牌桶限流器，速率以每分钟计"""
+
+    def __init__(self, rate_per_minute: float):
+        """
+        初始化令牌桶
+
+        Args:
+            rate_per_minute: 每分钟补充的令牌数，同时也是桶容量
+        """
+        self.capacity = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        """获取指定数量的令牌，不足时等待补充"""
+        # 单次请求超过桶容量时按容量计，避免永远等不到
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+def run_sync(coro: Coroutine[Any, Any, T]) -> T:
+    """在同步代码中运行协程，已有事件循环时转到工作线程执行"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
+class BatchedEmbeddings(Embeddings):
+    """批量、限流、可断点续传的嵌入包装器"""
+
+    def __init__(self,
+                 embeddings: Embeddings,
+                 batch_size: int = 64,
+                 max_concurrency: int = 4,
+                 requests_per_minute: Optional[int] = None,
+                 tokens_per_minute: Optional[int] = None,
+                 checkpoint_path: Optional[str] = None,
+                 max_retries: int = 6):
+        """
+        初始化批量嵌入
+
+        Args:
+            embeddings: 实际调用API的嵌入模型
+            batch_size: 每个请求包含的文本数
+            max_concurrency: 同时进行的最大请求数
+            requests_per_minute: 每分钟请求数上限，None表示不限制
+            tokens_per_minute: 每分钟token数上限，None表示不限制
+            checkpoint_path: 检查点SQLite文件路径，None表示不保存进度
+            max_retries: 遇到限流错误时的最大重试次数
+        """
+        self.embeddings = embeddings
+        self.model = embedding_model_name(embeddings)
+        self.dimensions = embedding_dimensions(embeddings)
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.checkpoint = (EmbeddingStore(checkpoint_path, table=CHECKPOINT_TABLE)
+                           if checkpoint_path else None)
+        # 只有启用TPM限流时才需要统计token
+        self._encoding = (tiktoken.get_encoding("cl100k_base")
+                          if tokens_per_minute else None)
+        self.last_run: Dict[str, float] = {}
+
+    @classmethod
+    def from_env(cls, embeddings: Embeddings,
+                 checkpoint_path: Optional[str] = None) -> "BatchedEmbeddings":
+        """根据环境变量创建批量嵌入"""
+        rpm = int(os.getenv("EMBEDDING_REQUESTS_PER_MINUTE", "0"))
+        tpm = int(os.getenv("EMBEDDING_TOKENS_PER_MINUTE", "0"))
+        return cls(
+            embeddings,
+            batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "64")),
+            max_concurrency=int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4")),
+            requests_per_minute=rpm or None,
+            tokens_per_minute=tpm or None,
+            checkpoint_path=checkpoint_path
+        )
+
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    async def _embed_batch(self, texts: List[str],
+                           request_bucket: Optional[TokenBucket],
+                           token_bucket: Optional[TokenBucket],
+                           semaphore: asyncio.Semaphore,
+                           use_threads: bool = False) -> List[List[float]]:
+        """嵌入一个批次，遇到429时指数退避重试"""
+        num_tokens = (sum(len(self._encoding.encode(text, disallowed_special=()))
+                          for text in texts) if self._encoding else 0)
+        async with semaphore:
+            attempt = 0
+            while True:
+                if request_bucket:
+                    await request_bucket.acquire(1)
+                if token_bucket:
+                    await token_bucket.acquire(num_tokens)
+                try:
+                    if use_threads:
+                        return await asyncio.to_thread(self.embeddings.embed_documents, texts)
+                    return await self.embeddings.aembed_documents(texts)
+                except openai.RateLimitError as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    attempt += 1
+                    retry_after = e.response.headers.get("retry-after")
+                    delay = (float(retry_after) if retry_after
+                             else min(60.0, 2 ** attempt) + random.random())
+                    print(f"嵌入请求被限流，{delay:.1f}秒后重试 "
+                          f"({attempt}/{self.max_retries})")
+                    await asyncio.sleep(delay)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """分批并发嵌入文档列表"""
+        return await self._embed_all(texts)
+
+    async def _embed_all(self, texts: List[str],
+                         use_threads: bool = False) -> List[List[float]]:
+        """
+        分批并发嵌入文档列表
+
+        Args:
+            texts: 文档文本
+            use_threads: 为True时在线程中调用模型的同步接口，否则调用异步接口
+        """
+        start_time = time.perf_counter()
+        model_dims = self.dimensions or 0
+        hashes = [self._hash(text) for text in texts]
+
+        # 读取检查点中已完成的向量
+        done: Dict[str, List[float]] = {}
+        if self.checkpoint is not None:
+            done = await asyncio.to_thread(
+                self.checkpoint.get_many, self.model, model_dims, hashes)
+
+        pending: Dict[str, str] = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in done:
+                pending.setdefault(text_hash, text)
+        pending_items = list(pending.items())
+
+        request_bucket = (TokenBucket(self.requests_per_minute)
+                          if self.requests_per_minute else None)
+        token_bucket = (TokenBucket(self.tokens_per_minute)
+                        if self.tokens_per_minute else None)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run_batch(batch: List[Tuple[str, str]]) -> None:
+            vectors = await self._embed_batch(
+                [text for _, text in batch], request_bucket, token_bucket, semaphore,
+                use_threads)
+            items = [(text_hash, vector)
+                     for (text_hash, _), vector in zip(batch, vectors)]
+            if self.checkpoint is not None:
+                await asyncio.to_thread(
+                    self.checkpoint.put_many, self.model, model_dims, items)
+            done.update(items)
+
+        batches = [pending_items[i:i + self.batch_size]
+                   for i in range(0, len(pending_items), self.batch_size)]
+        await asyncio.gather(*(run_batch(batch) for batch in batches))
+        # 全部完成后检查点不再需要，向量由调用方（如嵌入缓存）负责保存
+        if self.checkpoint is not None:
+            await asyncio.to_thread(self.checkpoint.delete_many, self.model, model_dims,
+                                    list(dict.fromkeys(hashes)))
+
+        elapsed = time.perf_counter() - start_time
+        self.last_run = {
+            "chunks": len(texts),
+            "embedded": len(pending_items),
+            "resumed": len(texts) - len(pending_items),
+            "batches": len(batches),
+            "seconds": elapsed,
+            "chunks_per_second": len(pending_items) / elapsed if elapsed > 0 else 0.0,
+        }
+        if pending_items:
+            print(f"嵌入完成: {len(pending_items)} 个片段, {len(batches)} 个批次, "
+                  f"用时 {elapsed:.2f}秒, "
+                  f"吞吐量 {self.last_run['chunks_per_second']:.1f} chunks/s")
+        return [done[text_hash] for text_hash in hashes]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        同步接口，内部使用异步批量流水线
+
+        流水线在临时事件循环中运行，批次通过线程调用模型的同步接口：
+        模型的异步HTTP客户端（可能与服务共用）只在调用方自己的事件循环中使用，
+        其连接不会绑定到随后关闭的临时事件循环上。
+        """
+        return run_sync(self._embed_all(texts, use_threads=True))
+
+    def embed_query(self, text: str) -> List[float]:
+        """嵌入查询文本（单条请求不走批量流水线）"""
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """异步嵌入查询文本"""
+        return await self.embeddings.aembed_query(text)
@@ -0,0 +1,324 @@
+"""
+并发RAG评估
+
+从 datasets/ 中的JSONL文件读取测试用例（每行 {"id", "question", "expected_keywords"}），
+按并发上限同时运行。每个问题只检索一次，分别记录检索、压缩、上下文打包和生成的耗时，
+以及输入/输出token数（优先使用模型返回的用量，没有时用tiktoken计数）。
+汇总端到端延迟的 p50/p95/p99 和吞吐量，写出JSON报告，可以与上一次的报告对比以发现性能回退。
+
+用法：
+    python eval_runner.py --system quick --concurrency 4 --output eval_reports/latest.json
+    python eval_runner.py --baseline eval_reports/previous.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.callbacks import UsageMetadataCallbackHandler
+
+from context_packer import ContextPacker
+from embedding_pipeline import run_sync
+from rag_pipeline import SourcedRAGChain
+
+DEFAULT_DATASET = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "..", "datasets", "rag_eval.jsonl")
+
+STAGES = ("retrieval", "compression", "packing", "generation")
+
+SYSTEMS = ("quick", "basic", "advanced")
+
+Scorer = Callable[[str, str, List[str]], Dict[str, Any]]
+
+
+def load_cases(path: str) -> List[Dict[str, Any]]:
+    """
+    读取JSONL测试用例
+
+    Args:
+        path: JSONL文件路径，每行至少包含 question 字段
+
+    Returns:
+        测试用例列表，没有 id 的用例以行号作为 id
+    """
+    cases = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            case = json.loads(line)
+            if not case.get("question"):
+                raise ValueError(f"{path} 第 {line_no} 行缺少 question 字段")
+            case.setdefault("id", str(line_no))
+            cases.append(case)
+    return cases
+
+
+def summarize(values: Sequence[float]) -> Dict[str, float]:
+    """计算均值、p50/p95/p99 和最大值"""
+    if not values:
+        return {"count": 0}
+    array = np.asarray(values, dtype=np.float64)
+    p50, p95, p99 = np.percentile(array, [50, 95, 99])
+    return {"count": len(array), "mean": float(array.mean()), "p50": float(p50),
+            "p95": float(p95), "p99": float(p99), "max": float(array.max())}
+
+
+class EvaluationRunner:
+    """按并发上限运行测试用例并统计分阶段耗时、token数和延迟分位数"""
+
+    def __init__(self,
+                 rag_chain: SourcedRAGChain,
+                 concurrency: int = 4,
+                 model_name: Optional[str] = None,
+                 scorer: Optional[Scorer] = None):
+        """
+        初始化评估器
+
+        Args:
+            rag_chain: 被评估的RAG链
+            concurrency: 同时运行的问题数
+            model_name: 生成模型名，用于选择tiktoken编码
+            scorer: 回答质量评分函数 (问题, 回答, 期望关键词) -> 评分字典
+        """
+        self.rag_chain = rag_chain
+        self.concurrency = concurrency
+        self.model_name = model_name
+        self.scorer = scorer
+        self._counter = ContextPacker(model_name=model_name)
+
+    def _token_counts(self, usage: Dict[str, Any], inputs: Dict[str, str],
+                      answer: str) -> Dict[str, Any]:
+        """模型返回用量时使用实际用量，否则按渲染后的提示和回答计数"""
+        tokens: Dict[str, Any] = {"context": self._counter.count_tokens(inputs["context"])}
+        if usage:
+            tokens["input"] = sum(u.get("input_tokens", 0) for u in usage.values())
+            tokens["output"] = sum(u.get("output_tokens", 0) for u in usage.values())
+            tokens["source"] = "usage"
+        else:
+            prompt = self.rag_chain.generation_chain.first.format(**inputs)
+            tokens["input"] = self._counter.count_tokens(prompt)
+            tokens["output"] = self._counter.count_tokens(answer)
+            tokens["source"] = "tiktoken"
+        return tokens
+
+    async def run_case(self, case: Dict[str, Any],
+                       semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+        """运行单个用例，出错时返回带 error 的结果"""
+        question = case["question"]
+        submitted = time.perf_counter()
+        async with semaphore:
+            start = time.perf_counter()
+            result: Dict[str, Any] = {"id": case["id"], "question": question,
+                                      "queue_wait": start - submitted}
+            try:
+                docs, timings = await self.rag_chain.aretrieve(question)
+
+                stage_start = time.perf_counter()
+                inputs = {"context": self.rag_chain.format_docs(docs), "question": question}
+                timings["packing"] = time.perf_counter() - stage_start
+
+                usage = UsageMetadataCallbackHandler()
+                stage_start = time.perf_counter()
+                answer = await self.rag_chain.generation_chain.ainvoke(
+                    inputs, config={"callbacks": [usage]})
+                timings["generation"] = time.perf_counter() - stage_start
+
+                result.update({
+                    "answer": answer,
+                    "num_documents": len(docs),
+                    "latency": time.perf_counter() - start,
+                    "timings": timings,
+                    "tokens": self._token_counts(usage.usage_metadata, inputs, answer),
+                })
+                if self.scorer is not None and case.get("expected_keywords"):
+                    quality = self.scorer(question, answer, case["expected_keywords"])
+                    result["quality"] = {key: quality[key] for key in
+                                         ("keyword_coverage", "missing_keywords", "overall_score")
+                                         if key in quality}
+            except Exception as e:
+                result.update({"error": f"{type(e).__name__}: {e}",
+                               "latency": time.perf_counter() - start})
+            return result
+
+    async def arun(self, cases: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        并发运行所有用例
+
+        Returns:
+            报告：config、summary（延迟分位数、吞吐量、分阶段耗时、token数）和逐题 results
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        start = time.perf_counter()
+        results = list(await asyncio.gather(*(self.run_case(case, semaphore)
+                                              for case in cases)))
+        wall_seconds = time.perf_counter() - start
+        return {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "config": {"concurrency": self.concurrency, "model": self.model_name},
+            "summary": self.summarize_results(results, wall_seconds),
+            "results": results,
+        }
+
+    def run(self, cases: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+        """并发运行所有用例（同步接口）"""
+        return run_sync(self.arun(cases))
+
+    @staticmethod
+    def summarize_results(results: List[Dict[str, Any]],
+                          wall_seconds: float) -> Dict[str, Any]:
+        """汇总延迟分位数、吞吐量、分阶段耗时、token数和回答质量"""
+        succeeded = [r for r in results if "error" not in r]
+        summary: Dict[str, Any] = {
+            "cases": len(results),
+            "succeeded": len(succeeded),
+            "failed": len(results) - len(succeeded),
+            "wall_seconds": wall_seconds,
+            "throughput_qps": len(succeeded) / wall_seconds if wall_seconds else 0.0,
+            "latency": summarize([r["latency"] for r in succeeded]),
+            "queue_wait": summarize([r["queue_wait"] for r in succeeded]),
+            "stages": {stage: summarize([r["timings"][stage] for r in succeeded
+                                         if stage in r["timings"]])
+                       for stage in STAGES},
+        }
+        if succeeded:
+            summary["tokens"] = {
+                "input_total": sum(r["tokens"]["input"] for r in succeeded),
+                "output_total": sum(r["tokens"]["output"] for r in succeeded),
+                "input": summarize([r["tokens"]["input"] for r in succeeded]),
+                "output": summarize([r["tokens"]["output"] for r in succeeded]),
+                "context": summarize([r["tokens"]["context"] for r in succeeded]),
+            }
+        scored = [r["quality"] for r in succeeded if "quality" in r]
+        if scored:
+            summary["quality"] = {
+                "average_score": float(np.mean([q["overall_score"] for q in scored])),
+                "average_keyword_coverage": float(np.mean([q["keyword_coverage"]
+                                                           for q in scored])),
+            }
+        return summary
+
+
+def write_report(report: Dict[str, Any], path: str) -> None:
+    """写出JSON报告（先写临时文件再替换）"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def compare_reports(report: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, float]:
+    """
+    与基线报告对比延迟分位数和吞吐量
+
+    Returns:
+        各指标的相对变化（正数表示比基线高），如 {"latency.p95": 0.12}
+    """
+    changes = {}
+    for key in ("p50", "p95", "p99"):
+        current = report["summary"]["latency"].get(key)
+        previous = baseline["summary"]["latency"].get(key)
+        if current is not None and previous:
+            changes[f"latency.{key}"] = current / previous - 1
+    current = report["summary"]["throughput_qps"]
+    previous = baseline["summary"]["throughput_qps"]
+    if previous:
+        changes["throughput_qps"] = current / previous - 1
+    return changes
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    """打印报告摘要"""
+    summary = report["summary"]
+    print("\n" + "=" * 60)
+    print("📊 并发评估报告")
+    print("=" * 60)
+    print(f"用例数: {summary['cases']}（成功 {summary['succeeded']}，失败 {summary['failed']}）")
+    print(f"并发数: {report['config']['concurrency']}，总用时: {summary['wall_seconds']:.2f}秒，"
+          f"吞吐量: {summary['throughput_qps']:.2f} 问题/秒")
+    latency = summary["latency"]
+    if latency["count"]:
+        print(f"端到端延迟: p50 {latency['p50']:.2f}秒, p95 {latency['p95']:.2f}秒, "
+              f"p99 {latency['p99']:.2f}秒")
+    for stage, stats in summary["stages"].items():
+        if stats["count"]:
+            print(f"  {stage}: p50 {stats['p50'] * 1000:.0f}ms, p95 {stats['p95'] * 1000:.0f}ms")
+    if "tokens" in summary:
+        tokens = summary["tokens"]
+        print(f"token数: 输入 {tokens['input_total']}，输出 {tokens['output_total']}，"
+              f"平均上下文 {tokens['context']['mean']:.0f}")
+    if "quality" in summary:
+        print(f"平均评分: {summary['quality']['average_score']:.2f}/1.0，"
+              f"平均关键词覆盖率: {summary['quality']['average_keyword_coverage']:.2%}")
+    for result in report["results"]:
+        if "error" in result:
+            print(f"❌ {result['id']}: {result['error']}")
+
+
+def create_system_chain(system: str) -> SourcedRAGChain:
+    """创建被评估的RAG链：quick（FAISS示例）、basic（RAGSystem）或 advanced（AdvancedRAGSystem）"""
+    if system == "quick":
+        from quick_start import create_quick_rag
+        rag_chain, _ = create_quick_rag(sourced=True)
+        return rag_chain
+    if system == "basic":
+        from basic_rag import RAGSystem
+        rag = RAGSystem(model_name="gpt-4",
+                        api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview"),
+                        answer_cache_threshold=None)
+        rag.setup("sample_docs", incremental=True)
+        return rag.rag_chain
+    if system == "advanced":
+        from advanced_rag import AdvancedRAGSystem
+        rag = AdvancedRAGSystem(model_name="gpt-4", streaming=False)
+        rag.setup_advanced("sample_docs", rebuild=False)
+        return rag.rag_chain
+    raise ValueError(f"不支持的系统: {system}，可选 {SYSTEMS}")
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="并发RAG评估")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET, help="JSONL测试用例文件")
+    parser.add_argument("--system", choices=SYSTEMS, default="quick", help="被评估的RAG系统")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时运行的问题数")
+    parser.add_argument("--output", default=None,
+                        help="报告路径，默认 eval_reports/<系统>_<时间>.json")
+    parser.add_argument("--baseline", default=None, help="用于对比的基线报告")
+    args = parser.parse_args()
+
+    from evaluate_rag import RAGEvaluator
+
+    cases = load_cases(args.dataset)
+    print(f"读取 {len(cases)} 个测试用例: {args.dataset}")
+    runner = EvaluationRunner(create_system_chain(args.system),
+                              concurrency=args.concurrency,
+                              model_name="gpt-4",
+                              scorer=RAGEvaluator().evaluate_answer_quality)
+    report = runner.run(cases)
+    report["dataset"] = os.path.abspath(args.dataset)
+    report["config"]["system"] = args.system
+    print_report(report)
+
+    output = args.output or os.path.join(
+        "eval_reports", f"{args.system}_{datetime.now():%Y%m%d_%H%M%S}.json")
+    write_report(report, output)
+    print(f"\n报告已写入: {output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            changes = compare_reports(report, json.load(f))
+        print("\n与基线对比:")
+        for metric, change in changes.items():
+            print(f"  {metric}: {change:+.1%}")
+
+
+if __name__ == "__main__":
+    main()
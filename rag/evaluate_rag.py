@@ -18,6 +18,7 @@ class RAGEvaluator:
     
     def __init__(self):
         """初始化评估器"""
+        self._rag = None
         self.test_questions = [
             {
                 "question": "什么是人工智能？",
@@ -41,6 +42,16 @@ class RAGEvaluator:
             }
         ]
     
+    def get_rag(self):
+        """
+        返回 (rag_chain, retriever)，各评估模式共用同一个RAG系统
+
+        索引从快照加载（见 index_snapshot.py），示例文档和嵌入配置不变时不调用嵌入API。
+        """
+        if self._rag is None:
+            self._rag = create_quick_rag()
+        return self._rag
+    
     def evaluate_answer_quality(self, question: str, answer: str, expected_keywords: List[str]) -> Dict[str, Any]:
         """
         评估回答质量
@@ -99,7 +110,7 @@ class RAGEvaluator:
         try:
             # 创建RAG系统
             print("正在初始化RAG系统...")
-            rag_chain, retriever = create_quick_rag()
+            rag_chain, retriever = self.get_rag()
             
             results = []
             total_time = 0
@@ -214,7 +225,7 @@ class RAGEvaluator:
         print("=" * 30)
         
         try:
-            rag_chain, retriever = create_quick_rag()
+            rag_chain, retriever = self.get_rag()
             
             print("RAG系统已准备就绪！")
             print("输入问题进行测试，输入 'quit' 退出")
@@ -0,0 +1,175 @@
+"""
+并发混合检索
+
+向量检索（稠密）和BM25检索（稀疏）在asyncio中并发执行，每一路有独立的超时，
+检索延迟取两路中较慢的一路而不是两路之和；某一路超时或出错时只使用另一路的结果。
+两路结果按片段内容ID去重后，用倒数排名融合（RRF）或归一化得分加权融合。
+检索时传入的元数据过滤表达式（retriever.invoke(query, filter=...)）同时下推到两路检索。
+"""
+
+import asyncio
+import time
+import warnings
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import (AsyncCallbackManagerForRetrieverRun,
+                                      CallbackManagerForRetrieverRun)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+from pydantic import ConfigDict
+
+from bm25_index import BM25Index
+from embedding_pipeline import run_sync
+from ingest_manifest import chunk_content_id
+from metadata_filter import MetadataFilter
+
+FUSION_METHODS = ("rrf", "score")
+
+ScoredDocuments = List[Tuple[Document, float]]
+
+LegStats = Dict[str, Dict[str, Any]]
+
+# 融合只使用排名或归一化后的得分，相关度超出 [0, 1] 不影响结果
+# （Chroma 默认的L2距离换算出的相关度可能为负）；只忽略本模块调用时的这条警告
+warnings.filterwarnings("ignore", message="Relevance scores must be between",
+                        module=__name__)
+
+# 各路检索统计按上下文保存：检索器被并发请求共享，每个asyncio任务或线程只看到自己的统计
+_last_legs: ContextVar[LegStats] = ContextVar("hybrid_retriever_last_legs", default={})
+
+
+def reciprocal_rank_fusion(results: Sequence[ScoredDocuments],
+                           weights: Sequence[float],
+                           rrf_k: int = 60) -> Dict[str, Tuple[Document, float]]:
+    """倒数排名融合：每一路贡献 weight / (rrf_k + 排名)，只看排名不看原始得分"""
+    fused: Dict[str, Tuple[Document, float]] = {}
+    for docs, weight in zip(results, weights):
+        for rank, (doc, _) in enumerate(docs, start=1):
+            key = chunk_content_id(doc)
+            previous = fused.get(key, (doc, 0.0))
+            fused[key] = (previous[0], previous[1] + weight / (rrf_k + rank))
+    return fused
+
+
+def normalized_score_fusion(results: Sequence[ScoredDocuments],
+                            weights: Sequence[float]) -> Dict[str, Tuple[Document, float]]:
+    """得分融合：每一路的得分先做min-max归一化到 [0, 1]，再按权重相加"""
+    fused: Dict[str, Tuple[Document, float]] = {}
+    for docs, weight in zip(results, weights):
+        if not docs:
+            continue
+        scores = [score for _, score in docs]
+        low, high = min(scores), max(scores)
+        for doc, score in docs:
+            normalized = (score - low) / (high - low) if high > low else 1.0
+            key = chunk_content_id(doc)
+            previous = fused.get(key, (doc, 0.0))
+            fused[key] = (previous[0], previous[1] + weight * normalized)
+    return fused
+
+
+class HybridRetriever(BaseRetriever):
+    """并发执行向量检索和BM25检索并融合结果的检索器"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vectorstore: VectorStore
+    """向量存储（稠密检索）"""
+    bm25_index: BM25Index
+    """BM25倒排索引（稀疏检索）"""
+    k_dense: int = 6
+    """向量检索返回的候选数"""
+    k_sparse: int = 6
+    """BM25检索返回的候选数"""
+    k: Optional[int] = None
+    """融合后返回的文档数，None表示返回全部去重后的候选"""
+    weights: Tuple[float, float] = (0.7, 0.3)
+    """向量检索和BM25检索的融合权重"""
+    fusion: str = "rrf"
+    """融合方式：rrf（倒数排名融合）或 score（归一化得分加权）"""
+    rrf_k: int = 60
+    """RRF平滑常数"""
+    timeout: Optional[float] = 5.0
+    """每一路检索的超时秒数，None表示不限制"""
+
+    @property
+    def last_legs(self) -> LegStats:
+        """当前任务（或线程）中最近一次检索各路的耗时、结果数和状态"""
+        return _last_legs.get()
+
+    async def _dense(self, query: str,
+                     filter: Optional[MetadataFilter] = None) -> ScoredDocuments:
+        kwargs = {"filter": filter} if filter else {}
+        return await self.vectorstore.asimilarity_search_with_relevance_scores(
+            query, k=self.k_dense, **kwargs)
+
+    async def _sparse(self, query: str,
+                      filter: Optional[MetadataFilter] = None) -> ScoredDocuments:
+        # BM25打分是CPU计算，放到线程中避免阻塞事件循环上的向量检索
+        return await asyncio.to_thread(self.bm25_index.search, query, self.k_sparse, filter)
+
+    async def _run_leg(self, name: str, leg: Any, legs: LegStats) -> ScoredDocuments:
+        """执行一路检索，超时或出错时返回空结果，统计写入 legs"""
+        start = time.perf_counter()
+        try:
+            docs = await asyncio.wait_for(leg, timeout=self.timeout)
+            status = "ok"
+        except asyncio.TimeoutError:
+            docs, status = [], "timeout"
+            print(f"⚠️ {name} 检索超时（{self.timeout}秒），仅使用另一路检索结果")
+        except Exception as e:
+            docs, status = [], f"{type(e).__name__}: {e}"
+            print(f"⚠️ {name} 检索失败: {status}，仅使用另一路检索结果")
+        legs[name] = {"seconds": time.perf_counter() - start,
+                      "results": len(docs), "status": status}
+        return docs
+
+    def fuse(self, dense: ScoredDocuments, sparse: ScoredDocuments) -> List[Document]:
+        """去重并融合两路结果，按融合得分降序返回"""
+        if self.fusion == "rrf":
+            fused = reciprocal_rank_fusion([dense, sparse], self.weights, self.rrf_k)
+        elif self.fusion == "score":
+            fused = normalized_score_fusion([dense, sparse], self.weights)
+        else:
+            raise ValueError(f"不支持的融合方式: {self.fusion}，可选 {FUSION_METHODS}")
+
+        ranked = sorted(fused.values(), key=lambda item: item[1], reverse=True)
+        if self.k is not None:
+            ranked = ranked[:self.k]
+        return [Document(id=doc.id, page_content=doc.page_content,
+                         metadata={**doc.metadata, "relevance_score": score})
+                for doc, score in ranked]
+
+    async def retrieve_with_stats(self, query: str,
+                                  filter: Optional[MetadataFilter] = None
+                                  ) -> Tuple[List[Document], LegStats]:
+        """
+        两路并发检索后融合，过滤表达式同时下推到两路
+
+        Returns:
+            (融合后的文档, 各路的耗时、结果数和状态)
+        """
+        legs: LegStats = {}
+        dense, sparse = await asyncio.gather(
+            self._run_leg("dense", self._dense(query, filter), legs),
+            self._run_leg("sparse", self._sparse(query, filter), legs))
+        return self.fuse(dense, sparse), legs
+
+    async def _aget_relevant_documents(
+            self, query: str, *,
+            run_manager: AsyncCallbackManagerForRetrieverRun,
+            filter: Optional[MetadataFilter] = None) -> List[Document]:
+        docs, legs = await self.retrieve_with_stats(query, filter)
+        _last_legs.set(legs)
+        return docs
+
+    def _get_relevant_documents(
+            self, query: str, *,
+            run_manager: CallbackManagerForRetrieverRun,
+            filter: Optional[MetadataFilter] = None) -> List[Document]:
+        # run_sync 在新的事件循环中执行，统计在调用方的上下文中记录
+        docs, legs = run_sync(self.retrieve_with_stats(query, filter))
+        _last_legs.set(legs)
+        return docs
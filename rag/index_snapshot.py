@@ -0,0 +1,97 @@
+"""
+预构建索引快照
+
+把构建好的FAISS索引连同嵌入指纹和文档哈希保存到本地目录。
+再次创建时如果文档内容和嵌入配置（模型、维度、降维方式）都没有变化，
+直接从磁盘加载索引，不重新嵌入文档；任一变化时重建并覆盖快照。
+
+目录结构：
+    <快照目录>/<名称>/snapshot.json   快照信息（嵌入指纹、文档哈希、文档数）
+    <快照目录>/<名称>/index.faiss     FAISS索引
+    <快照目录>/<名称>/index.pkl       文档存储和ID映射
+
+index.pkl 由 pickle 序列化，只加载本程序自己写入的快照目录。
+"""
+
+import json
+import os
+import shutil
+import time
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from ingest_manifest import hash_text
+from matryoshka import embedding_fingerprint
+
+SNAPSHOT_FILENAME = "snapshot.json"
+
+
+def default_snapshot_directory() -> str:
+    """快照根目录，可通过环境变量 INDEX_SNAPSHOT_DIRECTORY 配置"""
+    return os.getenv("INDEX_SNAPSHOT_DIRECTORY", "./index_snapshots")
+
+
+def documents_hash(documents: Sequence[Document]) -> str:
+    """文档内容和元数据的哈希（与顺序相关）"""
+    return hash_text("\n".join(
+        json.dumps([doc.page_content, doc.metadata], ensure_ascii=False, sort_keys=True)
+        for doc in documents))
+
+
+def _read_snapshot_info(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(path, SNAPSHOT_FILENAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def load_or_build_faiss(documents: Sequence[Document],
+                        embeddings: Embeddings,
+                        name: str,
+                        snapshot_directory: Optional[str] = None) -> Tuple[FAISS, bool]:
+    """
+    从快照加载FAISS索引，文档或嵌入配置变化时重建
+
+    Args:
+        documents: 要索引的文档
+        embeddings: 嵌入模型
+        name: 快照名称（快照目录下的子目录）
+        snapshot_directory: 快照根目录，默认见 default_snapshot_directory
+
+    Returns:
+        (向量存储, 是否重新构建)
+    """
+    path = os.path.join(snapshot_directory or default_snapshot_directory(), name)
+    expected = {
+        "embedding": embedding_fingerprint(embeddings),
+        "documents_hash": documents_hash(documents),
+        "count": len(documents),
+    }
+
+    info = _read_snapshot_info(path)
+    if info is not None and all(info.get(key) == value for key, value in expected.items()):
+        try:
+            vectorstore = FAISS.load_local(path, embeddings,
+                                           allow_dangerous_deserialization=True)
+            return vectorstore, False
+        except Exception as e:
+            print(f"⚠️ 加载索引快照 {path} 失败，重新构建: {type(e).__name__}: {e}")
+    elif info is not None:
+        changed = [key for key, value in expected.items() if info.get(key) != value]
+        print(f"索引快照 {path} 已过期（{', '.join(changed)} 变化），重新构建")
+
+    vectorstore = FAISS.from_documents(list(documents), embeddings)
+
+    # 先写到临时目录，完整写入后再替换，中断时不会留下不一致的快照
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    vectorstore.save_local(tmp_path)
+    with open(os.path.join(tmp_path, SNAPSHOT_FILENAME), "w", encoding="utf-8") as f:
+        json.dump({**expected, "created_at": time.time()}, f, ensure_ascii=False)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return vectorstore, True
@@ -0,0 +1,196 @@
+"""
+文档目录监视
+
+后台线程定期扫描文档目录中文件的修改时间和大小（轮询，不依赖平台的文件事件接口），
+发现新增、修改或删除的文件时，只重新加载这些文件，交给RAG系统重新分割、
+嵌入变化的片段并删除过期片段的向量；其他文件不重新加载也不重新嵌入。
+
+刚写入的文件（修改时间距今不足 settle_seconds）留到下一轮处理，避免读到写了一半的文件。
+加载或更新失败的文件保留旧状态，下一轮重试。
+"""
+
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+# 文件路径 -> (修改时间纳秒, 文件大小)
+FileStates = Dict[str, Tuple[int, int]]
+
+# (按文件分组的新文档, 已删除的文件) -> 更新统计
+ApplyChanges = Callable[[Dict[str, List[Document]], List[str]], Dict[str, int]]
+
+
+def default_watch_interval() -> float:
+    """轮询间隔（秒），可通过环境变量 WATCH_INTERVAL_SECONDS 配置"""
+    return float(os.getenv("WATCH_INTERVAL_SECONDS", "2"))
+
+
+def scan_files(documents_path: str, extensions: Iterable[str]) -> FileStates:
+    """
+    扫描目录中指定扩展名的文件
+
+    Args:
+        documents_path: 文档目录（或单个文件）
+        extensions: 文件扩展名，如 (".txt", ".md")
+
+    Returns:
+        规范化路径 -> (修改时间纳秒, 文件大小)
+    """
+    extensions = tuple(extensions)
+    if os.path.isfile(documents_path):
+        paths = [documents_path]
+    else:
+        paths = [os.path.join(root, file)
+                 for root, _, files in os.walk(documents_path)
+                 for file in files if file.endswith(extensions)]
+    states = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # 扫描过程中被删除
+            continue
+        states[os.path.normpath(path)] = (stat.st_mtime_ns, stat.st_size)
+    return states
+
+
+@dataclass
+class FileChanges:
+    """两次扫描之间的文件变化"""
+    added: List[str] = field(default_factory=list)
+    modified: List[str] = field(default_factory=list)
+    deleted: List[str] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.modified or self.deleted)
+
+    @property
+    def changed(self) -> List[str]:
+        """需要重新加载的文件（新增和修改）"""
+        return self.added + self.modified
+
+
+def diff_files(old: FileStates, new: FileStates) -> FileChanges:
+    """比较两次扫描结果"""
+    return FileChanges(
+        added=sorted(set(new) - set(old)),
+        modified=sorted(path for path in set(new) & set(old) if new[path] != old[path]),
+        deleted=sorted(set(old) - set(new)),
+    )
+
+
+class IndexWatcher:
+    """轮询文档目录，把变化的文件增量同步到索引"""
+
+    def __init__(self,
+                 documents_path: str,
+                 load: Callable[[str], List[Document]],
+                 apply: ApplyChanges,
+                 extensions: Iterable[str] = (".txt",),
+                 interval: Optional[float] = None,
+                 settle_seconds: float = 1.0):
+        """
+        初始化监视器（以当前目录状态为基准，不触发更新）
+
+        Args:
+            documents_path: 文档目录
+            load: 加载单个文件的函数
+            apply: 应用变化的函数，参数为按文件分组的新文档和已删除的文件
+            extensions: 监视的文件扩展名
+            interval: 轮询间隔（秒），默认见 default_watch_interval
+            settle_seconds: 文件修改后至少经过的秒数，之后才处理
+        """
+        self.documents_path = documents_path
+        self.load = load
+        self.apply = apply
+        self.extensions = tuple(extensions)
+        self.interval = interval if interval is not None else default_watch_interval()
+        self.settle_seconds = settle_seconds
+
+        self._files = scan_files(documents_path, self.extensions)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.polls = 0
+        self.updates = 0
+        self.last_update: Optional[Dict[str, int]] = None
+        self.last_error: Optional[str] = None
+
+    def poll(self) -> Optional[Dict[str, int]]:
+        """
+        扫描一次目录并同步变化的文件
+
+        Returns:
+            本轮的更新统计，没有需要处理的变化时返回None
+        """
+        self.polls += 1
+        current = scan_files(self.documents_path, self.extensions)
+        changes = diff_files(self._files, current)
+        if not changes:
+            return None
+
+        # 仍在写入的文件留到下一轮，其状态不更新以便再次被发现
+        now_ns = time.time_ns()
+        settle_ns = int(self.settle_seconds * 1e9)
+        ready = [path for path in changes.changed
+                 if now_ns - current[path][0] >= settle_ns]
+
+        updated: Dict[str, List[Document]] = {}
+        for path in ready:
+            try:
+                updated[path] = self.load(path)
+            except Exception as e:
+                self.last_error = f"{path}: {type(e).__name__}: {e}"
+                print(f"⚠️ 加载文件 {path} 失败，下一轮重试: {type(e).__name__}: {e}")
+        if not updated and not changes.deleted:
+            return None
+
+        try:
+            stats = self.apply(updated, changes.deleted)
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            print(f"⚠️ 索引更新失败，下一轮重试: {self.last_error}")
+            return None
+
+        for path in updated:
+            self._files[path] = current[path]
+        for path in changes.deleted:
+            self._files.pop(path, None)
+        self.updates += 1
+        self.last_update = stats
+        print(f"🔄 文档变化已同步: {len(updated)} 个文件更新, "
+              f"{len(changes.deleted)} 个文件删除, "
+              f"新增 {stats.get('added', 0)} 个片段, 删除 {stats.get('deleted', 0)} 个片段")
+        return stats
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(f"⚠️ 扫描文档目录失败: {self.last_error}")
+
+    def start(self) -> "IndexWatcher":
+        """在后台线程中开始监视"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="index-watcher",
+                                            daemon=True)
+            self._thread.start()
+            print(f"👀 开始监视文档目录 {self.documents_path}（每 {self.interval} 秒扫描）")
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """停止监视并等待进行中的更新完成"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
@@ -0,0 +1,116 @@
+"""
+增量摄取清单
+
+记录每个源文件及其文档片段的内容哈希，用于判断哪些片段需要重新嵌入、
+哪些向量需要从向量数据库中删除。
+"""
+
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional, Set
+
+from langchain_core.documents import Document
+
+MANIFEST_FILENAME = "ingest_manifest.json"
+MANIFEST_VERSION = 1
+
+
+def hash_text(text: str) -> str:
+    """计算文本的SHA-256哈希"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_content_id(chunk: Document) -> str:
+    """片段的内容哈希（来源 + 内容），不含重复序号"""
+    return hash_text(f"{chunk.metadata.get('source', '')}\x00{chunk.page_content}")
+
+
+def compute_chunk_ids(chunks: List[Document]) -> List[str]:
+    """
+    为文档片段生成稳定的内容哈希ID
+
+    ID只取决于来源和片段内容，因此文件中其他位置的修改不会改变未变片段的ID。
+    同一文件中内容完全相同的片段会追加序号以保证唯一。
+
+    Args:
+        chunks: 文档片段列表
+
+    Returns:
+        与片段一一对应的ID列表
+    """
+    ids = []
+    seen: Dict[str, int] = {}
+    for chunk in chunks:
+        base_id = chunk_content_id(chunk)
+        occurrence = seen.get(base_id, 0)
+        seen[base_id] = occurrence + 1
+        ids.append(base_id if occurrence == 0 else f"{base_id}-{occurrence}")
+    return ids
+
+
+class IngestManifest:
+    """增量摄取清单，持久化为向量数据库目录下的JSON文件"""
+
+    def __init__(self, path: str):
+        """
+        初始化清单
+
+        Args:
+            path: 清单文件路径，文件不存在时从空清单开始
+        """
+        self.path = path
+        self.files: Dict[str, Dict[str, Any]] = {}
+        # 摄取时使用的嵌入模型指纹，用于检查向量空间是否一致
+        self.embedding: Optional[Dict[str, Any]] = None
+        self.exists = os.path.isfile(path)
+
+        if self.exists:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.files = data.get("files", {})
+            self.embedding = data.get("embedding")
+
+    def sources(self) -> Set[str]:
+        """返回清单中记录的所有源文件"""
+        return set(self.files)
+
+    def file_hash(self, source: str) -> Optional[str]:
+        """返回源文件上次摄取时的内容哈希"""
+        entry = self.files.get(source)
+        return entry["file_hash"] if entry else None
+
+    def chunk_ids(self, source: str) -> List[str]:
+        """返回源文件上次摄取时的片段ID"""
+        entry = self.files.get(source)
+        return list(entry["chunk_ids"]) if entry else []
+
+    def all_chunk_ids(self) -> Set[str]:
+        """返回清单中所有片段ID"""
+        return {cid for entry in self.files.values() for cid in entry["chunk_ids"]}
+
+    def update_file(self, source: str, file_hash: str, chunk_ids: List[str]) -> None:
+        """记录源文件的最新内容哈希和片段ID"""
+        self.files[source] = {"file_hash": file_hash, "chunk_ids": chunk_ids}
+
+    def remove_file(self, source: str) -> None:
+        """从清单中移除源文件"""
+        self.files.pop(source, None)
+
+    def save(self) -> None:
+        """原子写入清单文件"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": MANIFEST_VERSION,
+                    "embedding": self.embedding,
+                    "files": self.files,
+                },
+                f,
+                ensure_ascii=False,
+                indent=2
+            )
+        os.replace(tmp_path, self.path)
+        self.exists = True
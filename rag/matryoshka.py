@@ -0,0 +1,116 @@
+"""
+嵌入维度裁剪（Matryoshka）
+
+text-embedding-3 系列模型的向量前若干维本身就是有效的低维表示。
+可以通过API的 dimensions 参数直接返回低维向量，也可以在本地截取前N维后重新归一化，
+用少量召回率换取更小的索引和更快的相似度计算。
+"""
+
+import json
+import math
+import os
+from typing import Any, Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from embedding_cache import embedding_dimensions, embedding_model_name
+
+# 索引目录中记录嵌入指纹的文件
+FINGERPRINT_FILENAME = "embedding_fingerprint.json"
+
+
+def _truncate(vector: List[float], dimensions: int) -> List[float]:
+    """截取前N维并重新做L2归一化"""
+    head = vector[:dimensions]
+    norm = math.sqrt(sum(x * x for x in head)) or 1.0
+    return [x / norm for x in head]
+
+
+class TruncatedEmbeddings(Embeddings):
+    """在本地截取向量前N维并重新归一化的嵌入包装器"""
+
+    def __init__(self, embeddings: Embeddings, dimensions: int):
+        """
+        初始化截断嵌入
+
+        Args:
+            embeddings: 返回完整维度向量的嵌入模型
+            dimensions: 目标维度
+        """
+        self.embeddings = embeddings
+        self.model = embedding_model_name(embeddings)
+        self.dimensions = dimensions
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [_truncate(v, self.dimensions)
+                for v in self.embeddings.embed_documents(texts)]
+
+    def embed_query(self, text: str) -> List[float]:
+        return _truncate(self.embeddings.embed_query(text), self.dimensions)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [_truncate(v, self.dimensions)
+                for v in await self.embeddings.aembed_documents(texts)]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return _truncate(await self.embeddings.aembed_query(text), self.dimensions)
+
+
+def reduce_dimensions(embeddings: Embeddings, dimensions: Optional[int],
+                      truncate: bool = False) -> Embeddings:
+    """
+    按目标维度配置嵌入模型
+
+    Args:
+        embeddings: OpenAI / Azure OpenAI 嵌入模型
+        dimensions: 目标维度，None表示使用模型完整维度
+        truncate: True时在本地截断并归一化，False时通过API的 dimensions 参数降维
+
+    Returns:
+        配置后的嵌入模型
+    """
+    if not dimensions:
+        return embeddings
+    if truncate:
+        return TruncatedEmbeddings(embeddings, dimensions)
+    return embeddings.model_copy(update={"dimensions": dimensions})
+
+
+def embedding_fingerprint(embeddings: Embeddings) -> Dict[str, Any]:
+    """
+    描述嵌入向量空间的指纹（模型、维度、降维方式）
+
+    写入索引元数据，重新打开索引时用于检查查询向量和索引向量是否兼容。
+    """
+    return {
+        "model": embedding_model_name(embeddings),
+        "dimensions": embedding_dimensions(embeddings) or None,
+        "truncated": _is_truncated(embeddings),
+    }
+
+
+def save_fingerprint(directory: str, embeddings: Embeddings) -> None:
+    """把嵌入指纹写入索引目录（用于没有元数据头的索引，如 Chroma）"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, FINGERPRINT_FILENAME)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(embedding_fingerprint(embeddings), f)
+    os.replace(f"{path}.tmp", path)
+
+
+def load_fingerprint(directory: str) -> Optional[Dict[str, Any]]:
+    """读取索引目录中记录的嵌入指纹，未记录时返回None"""
+    path = os.path.join(directory, FINGERPRINT_FILENAME)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _is_truncated(embeddings: Embeddings) -> bool:
+    """沿包装链查找是否使用了本地截断"""
+    while embeddings is not None:
+        if isinstance(embeddings, TruncatedEmbeddings):
+            return True
+        embeddings = getattr(embeddings, "embeddings", None)
+    return False
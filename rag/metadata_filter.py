@@ -0,0 +1,261 @@
+"""
+元数据过滤
+
+加载文档时记录来源文件（source）、文件类型（file_type）和摄取时间（ingested_at，
+Unix时间戳秒），检索时可以用过滤表达式只在匹配的片段中检索。
+
+过滤表达式使用与 Chroma where 相同的语法，因此可以直接下推给 Chroma：
+    {"file_type": "pdf"}
+    {"source": {"$in": ["a.txt", "b.txt"]}}
+    {"$and": [{"file_type": {"$ne": "md"}}, {"ingested_at": {"$gte": 1700000000}}]}
+支持的比较运算符为 $eq、$ne、$gt、$gte、$lt、$lte、$in、$nin，逻辑运算符为 $and、$or。
+
+本地NumPy索引和BM25索引用 MetadataIndex（字段 -> 值 -> 行号的倒排表）
+把过滤表达式解析为候选行，检索只扫描这些行，而不是先取top-k再在Python中过滤。
+"""
+
+import bisect
+import os
+import time
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+from langchain_core.documents import Document
+
+MetadataFilter = Dict[str, Any]
+
+COMPARISON_OPERATORS = ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin")
+LOGICAL_OPERATORS = ("$and", "$or")
+
+_RANGE_OPERATORS = {
+    "$gt": lambda value, operand: value > operand,
+    "$gte": lambda value, operand: value >= operand,
+    "$lt": lambda value, operand: value < operand,
+    "$lte": lambda value, operand: value <= operand,
+}
+
+Timestamp = Union[int, float, str, date, datetime]
+
+
+def to_timestamp(value: Timestamp) -> int:
+    """把日期、时间、ISO格式字符串或时间戳转换为Unix时间戳（秒）"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    return int(value.timestamp())
+
+
+def record_file_attributes(documents: Iterable[Document],
+                           ingested_at: Optional[Timestamp] = None) -> Iterator[Document]:
+    """
+    为加载的文档记录可过滤的文件属性
+
+    Args:
+        documents: 加载器产出的文档（metadata 中带 source）
+        ingested_at: 摄取时间，默认为开始遍历的时间
+
+    Yields:
+        metadata 中补充了 file_type 和 ingested_at 的文档
+    """
+    timestamp = to_timestamp(ingested_at if ingested_at is not None else time.time())
+    for doc in documents:
+        source = doc.metadata.get("source", "")
+        doc.metadata.setdefault("file_type", os.path.splitext(source)[1].lstrip(".").lower())
+        doc.metadata.setdefault("ingested_at", timestamp)
+        yield doc
+
+
+def _equals_or_in(values: Union[Any, Sequence[Any], None]) -> Optional[Dict[str, Any]]:
+    if values is None:
+        return None
+    if isinstance(values, (list, tuple, set)):
+        return {"$in": list(values)}
+    return {"$eq": values}
+
+
+def build_filter(source: Union[str, Sequence[str], None] = None,
+                 file_type: Union[str, Sequence[str], None] = None,
+                 ingested_after: Optional[Timestamp] = None,
+                 ingested_before: Optional[Timestamp] = None) -> Optional[MetadataFilter]:
+    """
+    由常用条件构造过滤表达式
+
+    Args:
+        source: 来源文件路径，或路径列表
+        file_type: 文件类型（不含点，如 "pdf"），或类型列表
+        ingested_after: 只检索此时间及之后摄取的片段
+        ingested_before: 只检索此时间之前摄取的片段
+
+    Returns:
+        过滤表达式，没有任何条件时返回None
+    """
+    conditions = []
+    for field, condition in (("source", _equals_or_in(source)),
+                             ("file_type", _equals_or_in(file_type))):
+        if condition is not None:
+            conditions.append({field: condition})
+    if ingested_after is not None:
+        conditions.append({"ingested_at": {"$gte": to_timestamp(ingested_after)}})
+    if ingested_before is not None:
+        conditions.append({"ingested_at": {"$lt": to_timestamp(ingested_before)}})
+
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def _field_conditions(condition: Any) -> Dict[str, Any]:
+    """字段条件统一为 {运算符: 操作数}，标量表示 $eq"""
+    if not isinstance(condition, dict):
+        return {"$eq": condition}
+    unknown = set(condition) - set(COMPARISON_OPERATORS)
+    if unknown:
+        raise ValueError(f"不支持的过滤运算符: {sorted(unknown)}，可选 {COMPARISON_OPERATORS}")
+    return condition
+
+
+def _logical_operands(operator: str, operands: Any) -> List[MetadataFilter]:
+    if not isinstance(operands, list) or not operands:
+        raise ValueError(f"{operator} 的操作数必须是非空列表")
+    return operands
+
+
+def matches(metadata: Dict[str, Any], where: Optional[MetadataFilter]) -> bool:
+    """判断一条元数据是否满足过滤表达式"""
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches(metadata, sub) for sub in _logical_operands(key, condition)):
+                return False
+        elif key == "$or":
+            if not any(matches(metadata, sub) for sub in _logical_operands(key, condition)):
+                return False
+        elif key.startswith("$"):
+            raise ValueError(f"不支持的逻辑运算符: {key}，可选 {LOGICAL_OPERATORS}")
+        else:
+            if key not in metadata:
+                return False
+            value = metadata[key]
+            for operator, operand in _field_conditions(condition).items():
+                if operator == "$eq":
+                    ok = value == operand
+                elif operator == "$ne":
+                    ok = value != operand
+                elif operator == "$in":
+                    ok = value in operand
+                elif operator == "$nin":
+                    ok = value not in operand
+                else:
+                    ok = _comparable(value, operand) and _RANGE_OPERATORS[operator](value, operand)
+                if not ok:
+                    return False
+    return True
+
+
+def _comparable(value: Any, operand: Any) -> bool:
+    """范围比较只在数值之间进行（与 Chroma 一致）"""
+    return (isinstance(value, (int, float)) and not isinstance(value, bool)
+            and isinstance(operand, (int, float)) and not isinstance(operand, bool))
+
+
+class MetadataIndex:
+    """元数据属性的倒排索引：字段 -> 值 -> 行号"""
+
+    def __init__(self):
+        self.count = 0
+        self._postings: Dict[str, Dict[Any, List[int]]] = {}
+        # 字段的数值取值（排序后），用于范围查询，写入后失效
+        self._sorted_values: Dict[str, List[Union[int, float]]] = {}
+
+    def __len__(self) -> int:
+        return self.count
+
+    @classmethod
+    def from_metadatas(cls, metadatas: Iterable[Dict[str, Any]]) -> "MetadataIndex":
+        """按行号顺序由元数据构建索引"""
+        index = cls()
+        for row, metadata in enumerate(metadatas):
+            index.add(row, metadata)
+        return index
+
+    def add(self, row: int, metadata: Dict[str, Any]) -> None:
+        """记录一行的元数据（只索引字符串、数值和布尔值）"""
+        for key, value in metadata.items():
+            if isinstance(value, (str, int, float, bool)):
+                self._postings.setdefault(key, {}).setdefault(value, []).append(row)
+                self._sorted_values.pop(key, None)
+        self.count = max(self.count, row + 1)
+
+    def _rows(self, key: str, values: Iterable[Any]) -> np.ndarray:
+        postings = self._postings.get(key, {})
+        lists = [postings[value] for value in values if value in postings]
+        return np.concatenate(lists).astype(np.int64) if lists else np.zeros(0, dtype=np.int64)
+
+    def _present(self, key: str) -> np.ndarray:
+        mask = np.zeros(self.count, dtype=bool)
+        mask[self._rows(key, self._postings.get(key, {}))] = True
+        return mask
+
+    def _range_values(self, key: str, operator: str, operand: Any) -> List[Any]:
+        """满足范围条件的取值，二分查找排序后的数值取值"""
+        if key not in self._sorted_values:
+            self._sorted_values[key] = sorted(
+                value for value in self._postings.get(key, {})
+                if _comparable(value, 0))
+        values = self._sorted_values[key]
+        if not _comparable(operand, 0):
+            return []
+        if operator == "$gt":
+            return values[bisect.bisect_right(values, operand):]
+        if operator == "$gte":
+            return values[bisect.bisect_left(values, operand):]
+        if operator == "$lt":
+            return values[:bisect.bisect_left(values, operand)]
+        return values[:bisect.bisect_right(values, operand)]
+
+    def _field_mask(self, key: str, condition: Any) -> np.ndarray:
+        mask = self._present(key)
+        for operator, operand in _field_conditions(condition).items():
+            selected = np.zeros(self.count, dtype=bool)
+            if operator in ("$eq", "$ne"):
+                selected[self._rows(key, [operand])] = True
+            elif operator in ("$in", "$nin"):
+                selected[self._rows(key, operand)] = True
+            else:
+                selected[self._rows(key, self._range_values(key, operator, operand))] = True
+            mask &= ~selected if operator in ("$ne", "$nin") else selected
+        return mask
+
+    def mask(self, where: Optional[MetadataFilter]) -> np.ndarray:
+        """
+        计算满足过滤表达式的行
+
+        Returns:
+            长度为 count 的布尔数组
+        """
+        result = np.ones(self.count, dtype=bool)
+        if not where:
+            return result
+        for key, condition in where.items():
+            if key == "$and":
+                for sub in _logical_operands(key, condition):
+                    result &= self.mask(sub)
+            elif key == "$or":
+                either = np.zeros(self.count, dtype=bool)
+                for sub in _logical_operands(key, condition):
+                    either |= self.mask(sub)
+                result &= either
+            elif key.startswith("$"):
+                raise ValueError(f"不支持的逻辑运算符: {key}，可选 {LOGICAL_OPERATORS}")
+            else:
+                result &= self._field_mask(key, condition)
+        return result
+
+    def rows(self, where: Optional[MetadataFilter]) -> np.ndarray:
+        """满足过滤表达式的行号（升序）"""
+        return np.flatnonzero(self.mask(where))
@@ -0,0 +1,109 @@
+"""
+并行流式文档加载器
+
+使用进程池并行解析PDF/Markdown/TXT文件，并以生成器形式逐个产出文档，
+调用方可以边加载边分割。同时在途的文件数有上限，因此不会把所有原始文档
+一次性读入内存；单个文件解析失败只记录错误，不影响其他文件。
+"""
+
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+SUPPORTED_EXTENSIONS = (".pdf", ".md", ".txt")
+
+
+def load_file(file_path: str) -> List[Document]:
+    """
+    根据文件扩展名选择加载器并解析单个文件
+
+    Args:
+        file_path: 文件路径
+
+    Returns:
+        解析得到的文档列表
+    """
+    from langchain_community.document_loaders import (PyPDFLoader, TextLoader,
+                                                      UnstructuredMarkdownLoader)
+
+    if file_path.endswith(".pdf"):
+        loader = PyPDFLoader(file_path)
+    elif file_path.endswith(".md"):
+        loader = UnstructuredMarkdownLoader(file_path)
+    else:
+        # 默认使用文本加载器
+        loader = TextLoader(file_path, encoding="utf-8")
+    return loader.load()
+
+
+def _load_file_isolated(file_path: str) -> Tuple[str, List[Document], Optional[str]]:
+    """在工作进程中加载文件，异常转为错误信息返回，避免影响其他文件"""
+    try:
+        return file_path, load_file(file_path), None
+    except Exception as e:
+        return file_path, [], f"{type(e).__name__}: {e}"
+
+
+def iter_document_files(documents_path: str) -> Iterator[str]:
+    """遍历目录，逐个产出支持格式的文件路径"""
+    for root, _, files in os.walk(documents_path):
+        for file in sorted(files):
+            if file.endswith(SUPPORTED_EXTENSIONS):
+                yield os.path.join(root, file)
+
+
+def iter_documents(documents_path: str,
+                   max_workers: Optional[int] = None,
+                   max_pending: Optional[int] = None) -> Iterator[Document]:
+    """
+    并行加载目录中的文档，按完成顺序逐个产出
+
+    Args:
+        documents_path: 文档目录
+        max_workers: 工作进程数，默认为CPU核数；为1时在当前进程中串行加载
+        max_pending: 同时在途的最大文件数，默认为工作进程数的2倍
+
+    Yields:
+        解析得到的文档
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    max_pending = max_pending or max_workers * 2
+    files = iter_document_files(documents_path)
+
+    if max_workers == 1:
+        for file_path in files:
+            _, docs, error = _load_file_isolated(file_path)
+            if error:
+                print(f"加载文件 {file_path} 时出错: {error}")
+            yield from docs
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending: Dict[Future, str] = {}
+
+        def submit_next() -> bool:
+            file_path = next(files, None)
+            if file_path is None:
+                return False
+            pending[executor.submit(_load_file_isolated, file_path)] = file_path
+            return True
+
+        while len(pending) < max_pending and submit_next():
+            pass
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_path = pending.pop(future)
+                try:
+                    _, docs, error = future.result()
+                except Exception as e:
+                    # 工作进程异常退出等情况
+                    docs, error = [], f"{type(e).__name__}: {e}"
+                if error:
+                    print(f"加载文件 {file_path} 时出错: {error}")
+                # 先补充任务再产出，保持进程池忙碌
+                submit_next()
+                yield from docs
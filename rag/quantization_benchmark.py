@@ -0,0 +1,177 @@
+"""
+量化检索基准测试
+
+在同一批向量上对比本地NumPy索引的精确检索、int8量化和二值量化：
+- 速度：每批查询的检索耗时（中位数）
+- 质量：相对精确检索的 recall@k，对不同的 rescore_k 分别测量
+- 内存：常驻内存的量化编码字节数（全精度向量保存在内存映射文件中）
+
+默认使用合成向量（带公共方向的高斯聚类，接近文本嵌入的分布），
+也可以用 --vectors 指定真实嵌入的 .npy 文件（形状为 (n, dim)）。
+
+用法：
+    python quantization_benchmark.py --num-vectors 30000 --dim 1024 --batch-size 8
+    python quantization_benchmark.py --cluster-size 1000 --rescore-k 400,800,1600
+    python quantization_benchmark.py --vectors embeddings.npy --rescore-k 50,100,200,400
+"""
+
+import argparse
+import json
+import shutil
+import statistics
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from vector_index import QUANTIZATION_MODES, VectorIndex
+
+
+def synthetic_vectors(num_vectors: int, dim: int, num_queries: int,
+                      cluster_size: int = 200, seed: int = 0):
+    """
+    生成带聚类结构的合成向量和查询
+
+    所有向量共享一个公共方向（文本嵌入两两之间普遍有正的相似度），
+    再围绕各自的聚类中心加噪声；查询从同样的分布中另外采样，不与索引中的向量重合。
+
+    Returns:
+        (向量, 查询)
+    """
+    rng = np.random.default_rng(seed)
+    num_clusters = max(1, num_vectors // cluster_size)
+    common = rng.normal(size=dim)
+    centers = rng.normal(size=(num_clusters, dim)) + common
+
+    def sample(n: int) -> np.ndarray:
+        clusters = rng.integers(num_clusters, size=n)
+        return (centers[clusters] + rng.normal(scale=0.8, size=(n, dim))).astype(np.float32)
+
+    return sample(num_vectors), sample(num_queries)
+
+
+def _time_search(index: VectorIndex, queries: np.ndarray, k: int, batch_size: int,
+                 repeats: int, **search_kwargs: Any) -> float:
+    """每批查询检索耗时的中位数（毫秒）"""
+    batches = [queries[i:i + batch_size] for i in range(0, len(queries), batch_size)]
+    index.search(batches[0], k, **search_kwargs)
+    timings = []
+    for _ in range(repeats):
+        for batch in batches:
+            start = time.perf_counter()
+            index.search(batch, k, **search_kwargs)
+            timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def run_benchmark(vectors: np.ndarray, queries: np.ndarray, k: int = 10,
+                  batch_size: int = 8, rescore_ks: Sequence[int] = (40, 100, 200, 400),
+                  modes: Sequence[str] = QUANTIZATION_MODES,
+                  repeats: int = 3) -> Dict[str, Any]:
+    """
+    构建索引并测量各模式的速度和召回率
+
+    Args:
+        vectors: 索引向量
+        queries: 查询向量
+        k: 返回的结果数
+        batch_size: 每批查询数
+        rescore_ks: 量化检索要测量的候选数
+        modes: 量化模式
+        repeats: 计时重复次数
+
+    Returns:
+        基准测试报告
+    """
+    work_directory = tempfile.mkdtemp(prefix="quantization_benchmark_")
+    try:
+        index = VectorIndex.create(f"{work_directory}/index", vectors.shape[1])
+        ids = [str(i) for i in range(len(vectors))]
+        index.add(ids, vectors, [""] * len(ids), [{}] * len(ids))
+
+        results: List[Dict[str, Any]] = [{
+            "mode": "exact",
+            "rescore_k": None,
+            "ms_per_batch": _time_search(index, queries, k, batch_size, repeats, exact=True),
+            "recall": 1.0,
+            "resident_bytes": index.nbytes,
+        }]
+        for mode in modes:
+            index.quantize(mode)
+            for rescore_k in rescore_ks:
+                results.append({
+                    "mode": mode,
+                    "rescore_k": rescore_k,
+                    "ms_per_batch": _time_search(index, queries, k, batch_size, repeats,
+                                                 rescore_k=rescore_k),
+                    "recall": index.measure_recall(queries, k=k, rescore_k=rescore_k),
+                    "resident_bytes": index.resident_nbytes,
+                })
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+    return {
+        "num_vectors": len(vectors),
+        "dim": vectors.shape[1],
+        "num_queries": len(queries),
+        "k": k,
+        "batch_size": batch_size,
+        "results": results,
+    }
+
+
+def print_benchmark(report: Dict[str, Any]) -> None:
+    """以表格形式打印基准测试结果"""
+    print(f"\n向量: {report['num_vectors']} x {report['dim']}, "
+          f"查询: {report['num_queries']}, k={report['k']}, 批大小={report['batch_size']}")
+    print(f"{'模式':<8}{'rescore_k':>10}{'毫秒/批':>10}{'加速':>8}"
+          f"{'recall@k':>10}{'常驻MB':>10}")
+    exact_ms = report["results"][0]["ms_per_batch"]
+    for result in report["results"]:
+        print(f"{result['mode']:<8}{str(result['rescore_k'] or '-'):>10}"
+              f"{result['ms_per_batch']:>10.1f}{exact_ms / result['ms_per_batch']:>7.1f}x"
+              f"{result['recall']:>10.3f}{result['resident_bytes'] / 2**20:>10.1f}")
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="量化检索基准测试")
+    parser.add_argument("--vectors", help="真实嵌入的 .npy 文件，默认使用合成向量")
+    parser.add_argument("--num-vectors", type=int, default=30000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--cluster-size", type=int, default=200,
+                        help="合成向量每个聚类的平均大小，越大近邻越难区分")
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--rescore-k", default="40,100,200,400",
+                        help="逗号分隔的候选数")
+    parser.add_argument("--modes", default=",".join(QUANTIZATION_MODES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="把报告写入JSON文件")
+    args = parser.parse_args(argv)
+
+    if args.vectors:
+        data = np.load(args.vectors).astype(np.float32)
+        rng = np.random.default_rng(args.seed)
+        query_rows = rng.choice(len(data), size=min(args.num_queries, len(data) // 2),
+                                replace=False)
+        queries = data[query_rows]
+        vectors = np.delete(data, query_rows, axis=0)
+    else:
+        vectors, queries = synthetic_vectors(args.num_vectors, args.dim, args.num_queries,
+                                             cluster_size=args.cluster_size, seed=args.seed)
+
+    report = run_benchmark(vectors, queries, k=args.k, batch_size=args.batch_size,
+                           rescore_ks=[int(x) for x in args.rescore_k.split(",")],
+                           modes=args.modes.split(","))
+    print_benchmark(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n报告已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,24 @@
 """
 RAG 快速开始示例
 使用内存向量存储和示例数据，快速体验RAG功能
+构建好的FAISS索引保存为快照，示例文档和嵌入配置不变时直接加载，不再调用嵌入API
 """
 
 import os
+from typing import Optional
+
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnablePassthrough
 
+from embedding_cache import CachedEmbeddings
+from index_snapshot import load_or_build_faiss
+from matryoshka import reduce_dimensions
+from rag_pipeline import SourcedRAGChain
+
 # 加载环境变量
 load_dotenv()
 
@@ -39,8 +46,20 @@ SAMPLE_DOCUMENTS = [
     """
 ]
 
-def create_quick_rag():
-    """创建快速RAG系统"""
+def create_quick_rag(embedding_dimensions: Optional[int] = None,
+                     truncate_embeddings: bool = False,
+                     snapshot_directory: Optional[str] = None,
+                     sourced: bool = False):
+    """
+    创建快速RAG系统
+
+    Args:
+        embedding_dimensions: 嵌入向量维度，None表示使用模型完整维度
+        truncate_embeddings: 是否在本地截断降维（否则通过API参数降维）
+        snapshot_directory: 索引快照根目录，默认为 INDEX_SNAPSHOT_DIRECTORY
+        sourced: 为True时返回 SourcedRAGChain（返回回答、来源和各阶段耗时），
+            否则返回输出回答字符串的LCEL链
+    """
     
     # 检查API密钥
     if not os.getenv("OPENAI_API_KEY"):
@@ -50,14 +69,19 @@ def create_quick_rag():
     
     # 1. 初始化模型和嵌入
     llm = ChatOpenAI(model="gpt-4", temperature=0.1)
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-large")
+    embeddings = CachedEmbeddings(reduce_dimensions(
+        OpenAIEmbeddings(model="text-embedding-3-large"),
+        embedding_dimensions,
+        truncate=truncate_embeddings
+    ))
     
     # 2. 创建文档对象
     documents = [Document(page_content=doc.strip()) for doc in SAMPLE_DOCUMENTS]
     
-    # 3. 创建向量存储（使用FAISS内存存储）
-    print("正在创建向量存储...")
-    vectorstore = FAISS.from_documents(documents, embeddings)
+    # 3. 创建向量存储（FAISS内存存储，文档和嵌入配置未变化时从快照加载）
+    vectorstore, rebuilt = load_or_build_faiss(documents, embeddings, "quick_start",
+                                               snapshot_directory=snapshot_directory)
+    print("已重新构建向量存储并保存快照" if rebuilt else "已从快照加载向量存储")
     
     # 4. 创建检索器
     retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
@@ -78,12 +102,16 @@ def create_quick_rag():
     def format_docs(docs):
         return "\n\n".join(doc.page_content for doc in docs)
     
-    rag_chain = (
-        {"context": retriever | format_docs, "question": RunnablePassthrough()}
-        | prompt
-        | llm
-        | StrOutputParser()
-    )
+    if sourced:
+        rag_chain = SourcedRAGChain(retriever=retriever, prompt=prompt, llm=llm,
+                                    format_docs=format_docs)
+    else:
+        rag_chain = (
+            {"context": retriever | format_docs, "question": RunnablePassthrough()}
+            | prompt
+            | llm
+            | StrOutputParser()
+        )
     
     print("RAG系统初始化完成！")
     return rag_chain, retriever
@@ -0,0 +1,280 @@
+"""
+单次检索的RAG链
+
+检索只执行一次，检索结果同时用于生成回答和返回来源，
+并记录检索、压缩、生成各阶段耗时。
+也可以流式输出：先产出检索完成事件（含来源），再逐个产出token增量，最后产出完成事件。
+批量查询时检索可以对整批问题一次完成，生成按并发上限同时进行。
+各查询接口都可以传入元数据过滤表达式（见 metadata_filter.py），由检索器下推到索引中。
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import (Any, AsyncIterator, Callable, Dict, List, Optional, Sequence,
+                    Tuple, Union)
+
+from langchain_core.documents import Document
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+from metadata_filter import MetadataFilter
+
+Timings = Dict[str, float]
+
+
+@dataclass
+class RetrievalEvent:
+    """检索（和压缩）完成，生成开始之前产出"""
+    question: str
+    documents: List[Document]
+    sources: List[Dict[str, Any]]
+    timings: Timings
+    type: str = field(default="retrieval", init=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """可JSON序列化的表示（不含文档对象）"""
+        return {"type": self.type, "question": self.question,
+                "sources": self.sources, "timings": self.timings}
+
+
+@dataclass
+class TokenEvent:
+    """生成的一段token增量"""
+    delta: str
+    type: str = field(default="token", init=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"type": self.type, "delta": self.delta}
+
+
+@dataclass
+class CompletionEvent:
+    """生成完成，包含完整回答和各阶段耗时（含首token延迟 first_token）"""
+    answer: str
+    timings: Timings
+    type: str = field(default="done", init=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"type": self.type, "answer": self.answer, "timings": self.timings}
+
+
+StreamEvent = Union[RetrievalEvent, TokenEvent, CompletionEvent]
+
+BatchRetriever = Callable[[List[str], Optional[MetadataFilter]], List[List[Document]]]
+
+
+def _filter_kwargs(filter: Optional[MetadataFilter]) -> Dict[str, Any]:
+    """检索器的过滤参数；没有过滤条件时不传，保留检索器自身的 search_kwargs"""
+    return {"filter": filter} if filter else {}
+
+
+def batch_similarity_search(vectorstore: Any, vectors: Sequence[Sequence[float]],
+                            k: int = 4,
+                            filter: Optional[MetadataFilter] = None) -> List[List[Document]]:
+    """
+    用一批查询向量检索，尽量在向量库中一次完成
+
+    本地NumPy索引用一次矩阵乘法检索整批向量，Chroma用一次多向量查询，
+    其他向量库逐个向量检索。过滤表达式下推给向量库。
+    """
+    if not vectors:
+        return []
+    kwargs = _filter_kwargs(filter)
+    if hasattr(vectorstore, "similarity_search_with_score_by_vectors"):
+        return [[doc for doc, _ in results] for results in
+                vectorstore.similarity_search_with_score_by_vectors(vectors, k=k, **kwargs)]
+    collection = getattr(vectorstore, "_collection", None)
+    if collection is not None:
+        results = collection.query(query_embeddings=[list(v) for v in vectors],
+                                   n_results=k, where=filter or None,
+                                   include=["documents", "metadatas"])
+        return [[Document(page_content=text, metadata=metadata or {})
+                 for text, metadata in zip(texts, metadatas)]
+                for texts, metadatas in zip(results["documents"], results["metadatas"])]
+    return [vectorstore.similarity_search_by_vector(list(v), k=k, **kwargs) for v in vectors]
+
+
+def format_sources(docs: List[Document], preview_chars: int = 200) -> List[Dict[str, Any]]:
+    """提取来源信息（内容预览和元数据）"""
+    return [
+        {
+            "content": doc.page_content[:preview_chars] + "...",
+            "metadata": doc.metadata
+        }
+        for doc in docs
+    ]
+
+
+class SourcedRAGChain:
+    """检索一次、同时返回回答、来源和阶段耗时的RAG链"""
+
+    def __init__(self,
+                 retriever: Any,
+                 prompt: ChatPromptTemplate,
+                 llm: Any,
+                 format_docs: Callable[[List[Document]], str],
+                 compressor: Optional[Any] = None):
+        """
+        初始化RAG链
+
+        Args:
+            retriever: 检索器
+            prompt: 提示模板，包含 context 和 question 两个变量
+            llm: 大语言模型
+            format_docs: 把文档列表格式化为上下文的函数
+            compressor: 可选的文档压缩器，对检索结果做二次筛选
+        """
+        self.retriever = retriever
+        self.compressor = compressor
+        self.format_docs = format_docs
+        self.generation_chain = prompt | llm | StrOutputParser()
+
+    def retrieve(self, question: str,
+                 filter: Optional[MetadataFilter] = None) -> Tuple[List[Document], Timings]:
+        """检索（并压缩）相关文档，filter 为元数据过滤表达式"""
+        start = time.perf_counter()
+        docs = self.retriever.invoke(question, **_filter_kwargs(filter))
+        timings = {"retrieval": time.perf_counter() - start}
+
+        if self.compressor is not None:
+            start = time.perf_counter()
+            docs = list(self.compressor.compress_documents(docs, question))
+            timings["compression"] = time.perf_counter() - start
+        return docs, timings
+
+    async def aretrieve(self, question: str,
+                        filter: Optional[MetadataFilter] = None) -> Tuple[List[Document], Timings]:
+        """异步检索（并压缩）相关文档，filter 为元数据过滤表达式"""
+        start = time.perf_counter()
+        docs = await self.retriever.ainvoke(question, **_filter_kwargs(filter))
+        timings = {"retrieval": time.perf_counter() - start}
+
+        if self.compressor is not None:
+            start = time.perf_counter()
+            docs = list(await self.compressor.acompress_documents(docs, question))
+            timings["compression"] = time.perf_counter() - start
+        return docs, timings
+
+    def generate(self, question: str, docs: List[Document]) -> Tuple[str, float]:
+        """基于已检索的文档生成回答，返回 (回答, 耗时)"""
+        start = time.perf_counter()
+        answer = self.generation_chain.invoke(
+            {"context": self.format_docs(docs), "question": question})
+        return answer, time.perf_counter() - start
+
+    async def agenerate(self, question: str, docs: List[Document]) -> Tuple[str, float]:
+        """异步生成回答，返回 (回答, 耗时)"""
+        start = time.perf_counter()
+        answer = await self.generation_chain.ainvoke(
+            {"context": self.format_docs(docs), "question": question})
+        return answer, time.perf_counter() - start
+
+    @staticmethod
+    def build_result(question: str, answer: str, docs: List[Document],
+                     timings: Timings) -> Dict[str, Any]:
+        """组装查询结果"""
+        timings["total"] = sum(timings.values())
+        return {
+            "question": question,
+            "answer": answer,
+            "documents": docs,
+            "sources": format_sources(docs),
+            "num_sources": len(docs),
+            "timings": timings
+        }
+
+    def invoke(self, question: str,
+               filter: Optional[MetadataFilter] = None) -> Dict[str, Any]:
+        """检索并生成回答"""
+        docs, timings = self.retrieve(question, filter)
+        answer, timings["generation"] = self.generate(question, docs)
+        return self.build_result(question, answer, docs, timings)
+
+    async def ainvoke(self, question: str,
+                      filter: Optional[MetadataFilter] = None) -> Dict[str, Any]:
+        """异步检索并生成回答"""
+        docs, timings = await self.aretrieve(question, filter)
+        answer, timings["generation"] = await self.agenerate(question, docs)
+        return self.build_result(question, answer, docs, timings)
+
+    async def abatch(self, questions: Sequence[str],
+                     max_concurrency: int = 8,
+                     retrieve_batch: Optional[BatchRetriever] = None,
+                     filter: Optional[MetadataFilter] = None) -> List[Dict[str, Any]]:
+        """
+        批量检索并生成回答
+
+        Args:
+            questions: 问题列表
+            max_concurrency: 同时进行的检索/压缩/生成的最大数量
+            retrieve_batch: 对整批问题一次完成检索的函数；为None时每个问题单独检索
+            filter: 元数据过滤表达式，对整批问题生效
+
+        Returns:
+            与输入顺序一致的结果列表；出错的问题返回 {"question", "error"}，不影响其他问题
+        """
+        questions = list(questions)
+        batch_docs: Optional[List[List[Document]]] = None
+        batch_error: Optional[str] = None
+        retrieval_seconds = 0.0
+        if retrieve_batch is not None and questions:
+            start = time.perf_counter()
+            try:
+                batch_docs = await asyncio.to_thread(retrieve_batch, questions, filter)
+            except Exception as e:
+                batch_error = f"{type(e).__name__}: {e}"
+            retrieval_seconds = time.perf_counter() - start
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def run(i: int, question: str) -> Dict[str, Any]:
+            if batch_error is not None:
+                return {"question": question, "error": batch_error}
+            async with semaphore:
+                try:
+                    if batch_docs is None:
+                        docs, timings = await self.aretrieve(question, filter)
+                    else:
+                        docs, timings = batch_docs[i], {"retrieval": retrieval_seconds}
+                        if self.compressor is not None:
+                            start = time.perf_counter()
+                            docs = list(await self.compressor.acompress_documents(
+                                docs, question))
+                            timings["compression"] = time.perf_counter() - start
+                    answer, timings["generation"] = await self.agenerate(question, docs)
+                    return self.build_result(question, answer, docs, timings)
+                except Exception as e:
+                    return {"question": question, "error": f"{type(e).__name__}: {e}"}
+
+        return list(await asyncio.gather(*(run(i, q) for i, q in enumerate(questions))))
+
+    async def astream(self, question: str,
+                      filter: Optional[MetadataFilter] = None) -> AsyncIterator[StreamEvent]:
+        """
+        流式检索并生成回答，filter 为元数据过滤表达式
+
+        Yields:
+            RetrievalEvent（检索完成及来源）、若干 TokenEvent（token增量）、
+            CompletionEvent（完整回答和耗时）
+        """
+        request_start = time.perf_counter()
+        docs, timings = await self.aretrieve(question, filter)
+        yield RetrievalEvent(question=question, documents=docs,
+                             sources=format_sources(docs), timings=dict(timings))
+
+        start = time.perf_counter()
+        parts: List[str] = []
+        async for delta in self.generation_chain.astream(
+                {"context": self.format_docs(docs), "question": question}):
+            if not delta:
+                continue
+            if not parts:
+                # 从请求开始到第一个token的延迟
+                timings["first_token"] = time.perf_counter() - request_start
+            parts.append(delta)
+            yield TokenEvent(delta=delta)
+        timings["generation"] = time.perf_counter() - start
+
+        timings["total"] = time.perf_counter() - request_start
+        yield CompletionEvent(answer="".join(parts), timings=timings)
@@ -0,0 +1,335 @@
+"""
+RAG查询服务
+
+常驻进程的异步HTTP服务：启动时只构建或加载一次索引，所有请求共享同一个RAG系统，
+LLM和嵌入共用一组HTTP连接池，避免每个请求重新建立连接。
+
+接口：
+    GET  /health        存活探针，进程启动即返回200
+    GET  /ready         就绪探针，索引加载并预热（向量读入内存）后才返回200，否则返回503
+    POST /query         单个问题，返回回答、来源和各阶段耗时
+    POST /query/batch   一批问题，整批嵌入后并发检索和生成
+    POST /query/stream  流式回答，每行一个JSON事件（retrieval / token / done）
+
+配置（环境变量）：
+    RAG_SERVICE_SYSTEM      basic（RAGSystem）或 advanced（AdvancedRAGSystem）
+    RAG_DOCUMENTS_PATH      文档目录
+    RAG_VECTOR_BACKEND      basic 的向量存储后端，chroma 或 numpy
+    RAG_SERVICE_WATCH       为1时监视文档目录并增量更新索引
+    RAG_HTTP_MAX_CONNECTIONS  HTTP连接池的最大连接数
+
+启动：
+    python rag_service.py
+    uvicorn rag_service:app --host 0.0.0.0 --port 8001
+
+索引保存在进程内存中，使用单个worker进程，并发由事件循环处理。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+
+from index_watcher import IndexWatcher
+from rag_pipeline import StreamEvent
+from vector_index import NumpyVectorStore
+
+# 加载环境变量
+load_dotenv()
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="[%(asctime)s] %(levelname)s %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+SYSTEMS = ("basic", "advanced")
+
+
+def create_http_clients(
+        max_connections: Optional[int] = None) -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """
+    创建LLM和嵌入共用的HTTP连接池
+
+    Args:
+        max_connections: 最大连接数，默认为 RAG_HTTP_MAX_CONNECTIONS（100）
+
+    Returns:
+        (同步客户端, 异步客户端)
+    """
+    max_connections = max_connections or int(os.getenv("RAG_HTTP_MAX_CONNECTIONS", "100"))
+    limits = httpx.Limits(max_connections=max_connections,
+                          max_keepalive_connections=max_connections)
+    timeout = httpx.Timeout(60.0, connect=10.0)
+    return (httpx.Client(limits=limits, timeout=timeout),
+            httpx.AsyncClient(limits=limits, timeout=timeout))
+
+
+def warm_vectorstore(vectorstore: Any, block_rows: int = 65536) -> int:
+    """
+    把向量读入内存，避免第一批查询承担冷启动开销（不调用嵌入API）
+
+    本地NumPy索引逐块读取内存映射的向量文件；Chroma 用库中已有的一个向量做一次查询，
+    使HNSW索引载入内存。
+
+    Returns:
+        预热的向量数
+    """
+    if isinstance(vectorstore, NumpyVectorStore):
+        index = vectorstore.index
+        if index is None:
+            return 0
+        for start in range(0, index.count, block_rows):
+            np.asarray(index.vectors[start:start + block_rows], dtype=np.float32).sum()
+        return index.count
+
+    collection = getattr(vectorstore, "_collection", None)
+    if collection is None:
+        return 0
+    sample = collection.get(limit=1, include=["embeddings"])
+    if len(sample["embeddings"]) == 0:
+        return 0
+    collection.query(query_embeddings=[list(sample["embeddings"][0])], n_results=1)
+    return collection.count()
+
+
+class QueryRequest(BaseModel):
+    question: str
+    filter: Optional[Dict[str, Any]] = None
+    collection: Optional[str] = None
+
+
+class BatchQueryRequest(BaseModel):
+    questions: List[str] = Field(min_length=1)
+    filter: Optional[Dict[str, Any]] = None
+    collection: Optional[str] = None
+    max_concurrency: Optional[int] = None
+
+
+def _serialize(result: Dict[str, Any]) -> Dict[str, Any]:
+    """去掉不能序列化为JSON的文档对象（来源信息保留在 sources 中）"""
+    return {key: value for key, value in result.items() if key != "documents"}
+
+
+class RAGService:
+    """持有RAG系统和共享连接池，负责加载、预热和查询路由"""
+
+    def __init__(self,
+                 system: Optional[str] = None,
+                 documents_path: Optional[str] = None,
+                 vector_backend: Optional[str] = None,
+                 watch: Optional[bool] = None,
+                 batch_max_concurrency: int = 8):
+        """
+        初始化服务（不加载索引）
+
+        Args:
+            system: basic 或 advanced，默认为 RAG_SERVICE_SYSTEM
+            documents_path: 文档目录，默认为 RAG_DOCUMENTS_PATH
+            vector_backend: basic 的向量存储后端，默认为 RAG_VECTOR_BACKEND
+            watch: 是否监视文档目录，默认为 RAG_SERVICE_WATCH
+            batch_max_concurrency: 批量查询默认的生成并发数
+        """
+        self.system = system or os.getenv("RAG_SERVICE_SYSTEM", "basic")
+        if self.system not in SYSTEMS:
+            raise ValueError(f"不支持的系统: {self.system}，可选 {SYSTEMS}")
+        self.documents_path = documents_path or os.getenv("RAG_DOCUMENTS_PATH", "sample_docs")
+        self.vector_backend = vector_backend or os.getenv("RAG_VECTOR_BACKEND", "chroma")
+        self.watch = (watch if watch is not None
+                      else os.getenv("RAG_SERVICE_WATCH", "0") == "1")
+        self.batch_max_concurrency = batch_max_concurrency
+
+        self.rag: Any = None
+        self.watcher: Optional[IndexWatcher] = None
+        self.http_client: Optional[httpx.Client] = None
+        self.http_async_client: Optional[httpx.AsyncClient] = None
+        self.status = "starting"
+        self.error: Optional[str] = None
+        self.info: Dict[str, Any] = {}
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    def _create_system(self) -> Any:
+        if self.system == "basic":
+            from basic_rag import RAGSystem
+            return RAGSystem(
+                model_name=os.getenv("DEFAULT_MODEL", "gpt-4"),
+                api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview"),
+                vector_backend=self.vector_backend,
+                embedding_dimensions=int(os.getenv("EMBEDDING_DIMENSIONS", "0")) or None,
+                http_client=self.http_client,
+                http_async_client=self.http_async_client)
+        from advanced_rag import AdvancedRAGSystem
+        return AdvancedRAGSystem(
+            model_name=os.getenv("DEFAULT_MODEL", "gpt-4"),
+            streaming=True,
+            embedding_dimensions=int(os.getenv("EMBEDDING_DIMENSIONS", "0")) or None,
+            http_client=self.http_client,
+            http_async_client=self.http_async_client)
+
+    def load(self) -> None:
+        """构建或加载索引并预热（在工作线程中执行）"""
+        start = time.perf_counter()
+        rag = self._create_system()
+        if self.system == "basic":
+            # 增量同步：索引已是最新时只检查文件哈希，不重新嵌入
+            rag.setup(self.documents_path, incremental=True)
+        else:
+            rag.setup_advanced(self.documents_path, rebuild=False)
+        vectors = warm_vectorstore(rag.vectorstore)
+        self.rag = rag
+        if self.watch:
+            self.watcher = rag.watch(self.documents_path)
+        self.info = {"system": self.system, "documents_path": self.documents_path,
+                     "vectors": vectors, "load_seconds": time.perf_counter() - start}
+
+    async def start(self) -> None:
+        """创建连接池并在后台加载索引，加载期间存活探针正常响应"""
+        self.http_client, self.http_async_client = create_http_clients()
+        self.status = "loading"
+        try:
+            await asyncio.to_thread(self.load)
+            self.status = "ready"
+            logger.info("[启动] 索引已加载并预热: %s", self.info)
+        except Exception as e:
+            self.status = "failed"
+            self.error = f"{type(e).__name__}: {e}"
+            logger.error("[启动] 索引加载失败: %s", self.error)
+
+    async def stop(self) -> None:
+        """停止监视并关闭连接池"""
+        if self.watcher is not None:
+            self.watcher.stop()
+        if self.http_async_client is not None:
+            await self.http_async_client.aclose()
+        if self.http_client is not None:
+            self.http_client.close()
+
+    def _check_collection(self, collection: Optional[str]) -> None:
+        if collection is not None and self.system != "basic":
+            raise ValueError("集合只在 basic 系统中可用")
+
+    async def query(self, request: QueryRequest) -> Dict[str, Any]:
+        self._check_collection(request.collection)
+        if self.system == "basic":
+            result = await self.rag.aquery_with_sources(request.question, filter=request.filter,
+                                                        collection=request.collection)
+        else:
+            result = await self.rag.rag_chain.ainvoke(request.question, request.filter)
+        return _serialize(result)
+
+    async def query_batch(self, request: BatchQueryRequest) -> List[Dict[str, Any]]:
+        self._check_collection(request.collection)
+        kwargs: Dict[str, Any] = {"max_concurrency": (request.max_concurrency
+                                                      or self.batch_max_concurrency),
+                                  "filter": request.filter}
+        if self.system == "basic":
+            kwargs["collection"] = request.collection
+        results = await self.rag.aquery_batch(request.questions, **kwargs)
+        return [_serialize(result) for result in results]
+
+    def stream(self, request: QueryRequest) -> AsyncIterator[StreamEvent]:
+        self._check_collection(request.collection)
+        if self.system == "basic":
+            return self.rag.astream(request.question, filter=request.filter,
+                                    collection=request.collection)
+        return self.rag.astream(request.question, request.filter)
+
+
+service = RAGService()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    loading = asyncio.create_task(service.start())
+    yield
+    loading.cancel()
+    await service.stop()
+
+
+app = FastAPI(title="RAG Query Service", lifespan=lifespan)
+
+
+def _require_ready() -> None:
+    if not service.ready:
+        raise HTTPException(status_code=503, detail=f"索引尚未就绪（{service.status}）")
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready():
+    body = {"status": service.status, **service.info}
+    if service.error is not None:
+        body["error"] = service.error
+    if service.watcher is not None:
+        body["watch"] = {"polls": service.watcher.polls, "updates": service.watcher.updates,
+                         "last_error": service.watcher.last_error}
+    return JSONResponse(body, status_code=200 if service.ready else 503)
+
+
+@app.post("/query")
+async def query(request: QueryRequest):
+    _require_ready()
+    logger.info("[API] /query 收到请求")
+    try:
+        return await service.query(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"[异常] /query 处理失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/query/batch")
+async def query_batch(request: BatchQueryRequest):
+    _require_ready()
+    logger.info("[API] /query/batch 收到请求，问题数=%d", len(request.questions))
+    try:
+        return {"results": await service.query_batch(request)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"[异常] /query/batch 处理失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/query/stream")
+async def query_stream(request: QueryRequest):
+    _require_ready()
+    logger.info("[API] /query/stream 收到请求")
+    try:
+        events = service.stream(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def generate() -> AsyncIterator[str]:
+        try:
+            async for event in events:
+                yield json.dumps(event.to_dict(), ensure_ascii=False) + "\n"
+        except Exception as e:
+            logger.error(f"[异常] /query/stream 处理失败: {e}")
+            yield json.dumps({"type": "error", "error": str(e)}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=os.getenv("RAG_SERVICE_HOST", "0.0.0.0"),
+                port=int(os.getenv("RAG_SERVICE_PORT", "8001")))
@@ -0,0 +1,538 @@
+"""
+离线检索基准测试
+
+不调用Azure/OpenAI，用确定性的本地嵌入替身（字符n-gram哈希向量）和可配置规模的合成语料，
+对比 Chroma、FAISS、本地NumPy索引（全精度、int8/二值量化、IVF）、BM25 和混合检索：
+- 构建：索引构建耗时、进程常驻内存增量、磁盘占用
+- 查询：单个问题的延迟分位数（p50/p95/p99），以及不同批大小下的吞吐量（QPS）
+- 质量：相对精确检索（在同一嵌入上暴力计算余弦相似度）的 recall@k 和 MRR，
+  以及生成问题的源文档出现在前k个结果中的比例（命中率）
+
+嵌入替身缓存计算过的向量：文档和问题在精确检索时已经嵌入一次，
+因此构建耗时和查询延迟只反映索引本身，不包含嵌入计算。
+
+语料、问题和嵌入都由随机种子决定，同一台机器上多次运行的质量指标完全一致，
+可以在CI上比较不同后端和版本的性能。
+
+用法：
+    python retrieval_benchmark.py --num-docs 2000 --num-queries 200 --k 10
+    python retrieval_benchmark.py --backends numpy,bm25 --batch-sizes 1,16,64 --output bench.json
+"""
+
+import abc
+import argparse
+import asyncio
+import gc
+import math
+import os
+import random
+import shutil
+import tempfile
+import time
+import zlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_community.vectorstores import FAISS, Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from bm25_index import BM25Index
+from embedding_pipeline import run_sync
+from eval_runner import summarize, write_report
+from hybrid_retriever import HybridRetriever
+from rag_pipeline import batch_similarity_search
+from vector_index import NumpyVectorStore
+
+BACKENDS = ("chroma", "faiss", "numpy", "numpy-int8", "numpy-binary", "numpy-ivf",
+            "bm25", "hybrid")
+
+DEFAULT_BATCH_SIZES = (1, 8, 32)
+
+# 合成语料使用的汉字，两两组合成"词"
+_CHARACTERS = ("数据模型算法网络学习训练检索向量索引文档问题回答系统语言知识图谱分类聚类"
+               "特征参数优化梯度损失函数样本标签预测推理生成注意力编码解码嵌入相似度"
+               "查询排序召回精度延迟吞吐缓存存储计算并行分布式服务接口部署监控日志安全")
+
+
+class HashedNGramEmbeddings(Embeddings):
+    """
+    确定性的本地嵌入替身
+
+    把文本的字符n-gram用CRC32哈希到固定维度（另一位哈希决定正负号），
+    词频取对数后做L2归一化。共享n-gram越多的文本余弦相似度越高，
+    不需要网络，结果只取决于文本本身。
+    """
+
+    def __init__(self, dimensions: int = 256, ngram_range: Tuple[int, int] = (1, 3)):
+        """
+        初始化嵌入替身
+
+        Args:
+            dimensions: 向量维度
+            ngram_range: n-gram 长度范围（含两端）
+        """
+        self.model = f"hashed-ngram-{ngram_range[0]}-{ngram_range[1]}"
+        self.dimensions = dimensions
+        self.ngram_range = ngram_range
+        # 文本 -> 向量，基准测试中各后端构建索引时复用，构建耗时只计入索引本身
+        self._cache: Dict[str, List[float]] = {}
+
+    def _embed(self, text: str) -> List[float]:
+        vector = self._cache.get(text)
+        if vector is not None:
+            return vector
+        counts: Dict[int, float] = {}
+        chars = "".join(text.split())
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            for i in range(len(chars) - n + 1):
+                h = zlib.crc32(chars[i:i + n].encode("utf-8"))
+                bucket = h % self.dimensions
+                counts[bucket] = counts.get(bucket, 0.0) + (1.0 if h >> 31 else -1.0)
+        array = np.zeros(self.dimensions, dtype=np.float32)
+        for bucket, count in counts.items():
+            array[bucket] = math.copysign(math.log1p(abs(count)), count)
+        norm = float(np.linalg.norm(array)) or 1.0
+        vector = (array / norm).tolist()
+        self._cache[text] = vector
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def synthetic_corpus(num_docs: int = 2000,
+                     num_topics: int = 50,
+                     words_per_doc: Tuple[int, int] = (40, 120),
+                     seed: int = 0) -> List[Document]:
+    """
+    生成合成语料
+
+    每个主题有自己偏好的词（Zipf分布），文档从一个主题的词分布和全局词表中抽词，
+    按句组织成中文文本，因此同主题文档共享大量词项，检索难度接近真实语料。
+
+    Args:
+        num_docs: 文档数
+        num_topics: 主题数
+        words_per_doc: 每个文档的词数范围
+        seed: 随机种子
+
+    Returns:
+        文档列表，metadata 中带 doc_id、topic 和 source
+    """
+    rng = random.Random(seed)
+    vocabulary = [a + b for a in _CHARACTERS for b in _CHARACTERS if a != b]
+    rng.shuffle(vocabulary)
+    topic_words = [rng.sample(vocabulary, 200) for _ in range(num_topics)]
+    zipf = [1.0 / (rank + 1) for rank in range(200)]
+
+    documents = []
+    for i in range(num_docs):
+        topic = rng.randrange(num_topics)
+        length = rng.randint(*words_per_doc)
+        words = [rng.choices(topic_words[topic], weights=zipf)[0] if rng.random() < 0.7
+                 else rng.choice(vocabulary) for _ in range(length)]
+        sentences = []
+        while words:
+            size = rng.randint(6, 14)
+            sentence, words = words[:size], words[size:]
+            sentences.append("，".join("".join(sentence[j:j + 3])
+                                      for j in range(0, len(sentence), 3)) + "。")
+        documents.append(Document(page_content="".join(sentences),
+                                  metadata={"doc_id": f"doc-{i}", "topic": topic,
+                                            "source": f"synthetic/topic_{topic}.txt"}))
+    return documents
+
+
+def synthetic_queries(documents: Sequence[Document], num_queries: int = 200,
+                      seed: int = 1) -> List[Tuple[str, str]]:
+    """
+    从文档中抽取片段并混入干扰词生成问题
+
+    Returns:
+        (问题, 源文档doc_id) 列表
+    """
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(num_queries):
+        doc = rng.choice(documents)
+        words = [w for w in doc.page_content.replace("。", "，").split("，") if w]
+        picked = rng.sample(words, min(len(words), rng.randint(2, 4)))
+        noise = rng.choice(documents).page_content.split("，")[0][:4]
+        queries.append(("".join(picked) + noise + "是什么？", doc.metadata["doc_id"]))
+    return queries
+
+
+def _rss_bytes() -> Optional[int]:
+    """当前进程常驻内存（Linux下读取 /proc，其他平台返回None）"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            total += os.path.getsize(os.path.join(root, file))
+    return total
+
+
+def _doc_ids(docs: Sequence[Any]) -> List[str]:
+    """检索结果（文档或 (文档, 得分)）中的 doc_id 列表"""
+    return [(doc[0] if isinstance(doc, tuple) else doc).metadata["doc_id"] for doc in docs]
+
+
+class RetrievalBackend(abc.ABC):
+    """被测检索后端：构建索引、单个检索、批量检索"""
+
+    name = ""
+
+    def __init__(self, embeddings: Embeddings, k: int, work_directory: str):
+        self.embeddings = embeddings
+        self.k = k
+        self.path = os.path.join(work_directory, self.name)
+
+    @abc.abstractmethod
+    def build(self, documents: List[Document], ids: List[str]) -> None:
+        """用文档和ID构建索引"""
+
+    @abc.abstractmethod
+    def search(self, query: str) -> List[str]:
+        """返回前k个结果的 doc_id"""
+
+    def search_batch(self, queries: List[str]) -> List[List[str]]:
+        """批量检索，默认逐个检索"""
+        return [self.search(query) for query in queries]
+
+    def disk_bytes(self) -> int:
+        return _directory_size(self.path) if os.path.isdir(self.path) else 0
+
+
+class VectorStoreBackend(RetrievalBackend):
+    """LangChain 向量存储：批量检索先一次嵌入整批问题，再用 batch_similarity_search"""
+
+    vectorstore: Any = None
+
+    def search(self, query: str) -> List[str]:
+        return _doc_ids(self.vectorstore.similarity_search(query, k=self.k))
+
+    def search_batch(self, queries: List[str]) -> List[List[str]]:
+        vectors = self.embeddings.embed_documents(queries)
+        return [_doc_ids(docs) for docs in
+                batch_similarity_search(self.vectorstore, vectors, k=self.k)]
+
+
+class ChromaBackend(VectorStoreBackend):
+    name = "chroma"
+
+    def build(self, documents: List[Document], ids: List[str]) -> None:
+        self.vectorstore = Chroma.from_documents(documents=documents, embedding=self.embeddings,
+                                                 ids=ids, persist_directory=self.path,
+                                                 collection_name="benchmark")
+
+
+class FAISSBackend(VectorStoreBackend):
+    name = "faiss"
+
+    def build(self, documents: List[Document], ids: List[str]) -> None:
+        self.vectorstore = FAISS.from_documents(documents, self.embeddings, ids=ids)
+        self.vectorstore.save_local(self.path)
+
+
+class NumpyBackend(VectorStoreBackend):
+    """本地NumPy索引，子类覆盖 quantization / nprobe 测试量化和IVF近似检索"""
+
+    name = "numpy"
+    quantization: Optional[str] = None
+    nprobe: Optional[int] = None
+
+    def build(self, documents: List[Document], ids: List[str]) -> None:
+        self.vectorstore = NumpyVectorStore.from_documents(documents=documents,
+                                                           embedding=self.embeddings,
+                                                           ids=ids, index_path=self.path,
+                                                           quantization=self.quantization,
+                                                           nprobe=self.nprobe)
+        if self.nprobe:
+            self.vectorstore.index.build_ivf()
+
+
+class NumpyInt8Backend(NumpyBackend):
+    name = "numpy-int8"
+    quantization = "int8"
+
+
+class NumpyBinaryBackend(NumpyBackend):
+    name = "numpy-binary"
+    quantization = "binary"
+
+
+class NumpyIVFBackend(NumpyBackend):
+    name = "numpy-ivf"
+    nprobe = 16
+
+
+class BM25Backend(RetrievalBackend):
+    name = "bm25"
+
+    def build(self, documents: List[Document], ids: List[str]) -> None:
+        self.index = BM25Index()
+        self.index.add_documents(documents, ids=ids)
+        self.index.save(self.path)
+
+    def search(self, query: str) -> List[str]:
+        return _doc_ids(self.index.search(query, self.k))
+
+
+class HybridBackend(RetrievalBackend):
+    """Chroma + BM25 并发混合检索（与 AdvancedRAGSystem 相同的组合），批量检索时各问题并发执行"""
+
+    name = "hybrid"
+
+    def build(self, documents: List[Document], ids: List[str]) -> None:
+        vectorstore = Chroma.from_documents(documents=documents, embedding=self.embeddings,
+                                            ids=ids, persist_directory=self.path,
+                                            collection_name="benchmark")
+        bm25_index = BM25Index()
+        bm25_index.add_documents(documents, ids=ids)
+        bm25_index.save(os.path.join(self.path, "bm25"))
+        self.retriever = HybridRetriever(vectorstore=vectorstore, bm25_index=bm25_index,
+                                         k_dense=self.k, k_sparse=self.k, k=self.k,
+                                         timeout=None)
+
+    def search(self, query: str) -> List[str]:
+        return _doc_ids(self.retriever.invoke(query))
+
+    def search_batch(self, queries: List[str]) -> List[List[str]]:
+        async def run() -> List[List[Document]]:
+            return await asyncio.gather(*(self.retriever.ainvoke(q) for q in queries))
+        return [_doc_ids(docs) for docs in run_sync(run())]
+
+
+BACKEND_CLASSES = {cls.name: cls for cls in
+                   (ChromaBackend, FAISSBackend, NumpyBackend, NumpyInt8Backend,
+                    NumpyBinaryBackend, NumpyIVFBackend, BM25Backend, HybridBackend)}
+
+
+def exact_search(embeddings: Embeddings, documents: Sequence[Document],
+                 queries: Sequence[str], k: int) -> List[List[str]]:
+    """在同一嵌入上暴力计算余弦相似度，作为 recall@k 和 MRR 的基准"""
+    matrix = np.asarray(embeddings.embed_documents([d.page_content for d in documents]),
+                        dtype=np.float32)
+    query_matrix = np.asarray(embeddings.embed_documents(list(queries)), dtype=np.float32)
+    scores = query_matrix @ matrix.T
+    top = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+    return [[documents[row].metadata["doc_id"] for row in rows] for rows in top]
+
+
+def retrieval_quality(results: Sequence[Sequence[str]],
+                      exact: Sequence[Sequence[str]],
+                      targets: Sequence[str]) -> Dict[str, float]:
+    """
+    计算检索质量
+
+    Returns:
+        recall@k（与精确检索前k个结果的重合比例）、MRR（精确检索第一名在结果中的倒数排名），
+        hit_rate（生成问题的源文档出现在结果中的比例）
+    """
+    recalls, reciprocal_ranks, hits = [], [], []
+    for found, expected, target in zip(results, exact, targets):
+        recalls.append(len(set(found) & set(expected)) / max(1, len(expected)))
+        rank = found.index(expected[0]) + 1 if expected and expected[0] in found else None
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+        hits.append(1.0 if target in found else 0.0)
+    return {"recall_at_k": float(np.mean(recalls)),
+            "mrr": float(np.mean(reciprocal_ranks)),
+            "hit_rate": float(np.mean(hits))}
+
+
+def benchmark_backend(backend: RetrievalBackend,
+                      documents: List[Document],
+                      queries: List[Tuple[str, str]],
+                      exact: List[List[str]],
+                      batch_sizes: Sequence[int] = DEFAULT_BATCH_SIZES,
+                      warmup: int = 5) -> Dict[str, Any]:
+    """
+    测量一个后端的构建、延迟、吞吐量和检索质量
+
+    Args:
+        backend: 被测后端
+        documents: 语料
+        queries: (问题, 源文档doc_id) 列表
+        exact: 每个问题的精确检索结果
+        batch_sizes: 测量吞吐量的批大小
+        warmup: 计时前预热的查询数
+
+    Returns:
+        该后端的测量结果
+    """
+    ids = [doc.metadata["doc_id"] for doc in documents]
+    gc.collect()
+    rss_before = _rss_bytes()
+    start = time.perf_counter()
+    backend.build(documents, ids)
+    build_seconds = time.perf_counter() - start
+    gc.collect()
+    rss_after = _rss_bytes()
+
+    texts = [query for query, _ in queries]
+    for query in texts[:warmup]:
+        backend.search(query)
+
+    latencies, results = [], []
+    for query in texts:
+        start = time.perf_counter()
+        results.append(backend.search(query))
+        latencies.append(time.perf_counter() - start)
+
+    throughput = {}
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        for i in range(0, len(texts), batch_size):
+            backend.search_batch(texts[i:i + batch_size])
+        elapsed = time.perf_counter() - start
+        throughput[str(batch_size)] = len(texts) / elapsed if elapsed else 0.0
+
+    return {
+        "build_seconds": build_seconds,
+        "memory_bytes": (rss_after - rss_before
+                         if rss_before is not None and rss_after is not None else None),
+        "disk_bytes": backend.disk_bytes(),
+        "latency": summarize(latencies),
+        "qps": throughput,
+        "quality": retrieval_quality(results, exact, [target for _, target in queries]),
+    }
+
+
+def run_benchmark(backends: Sequence[str] = BACKENDS,
+                  num_docs: int = 2000,
+                  num_queries: int = 200,
+                  k: int = 10,
+                  dimensions: int = 256,
+                  batch_sizes: Sequence[int] = DEFAULT_BATCH_SIZES,
+                  seed: int = 0,
+                  work_directory: Optional[str] = None) -> Dict[str, Any]:
+    """
+    在合成语料上运行基准测试
+
+    Args:
+        backends: 要测试的后端，见 BACKENDS
+        num_docs: 语料文档数
+        num_queries: 问题数
+        k: 每个问题返回的结果数
+        dimensions: 嵌入替身的维度
+        batch_sizes: 测量吞吐量的批大小
+        seed: 随机种子
+        work_directory: 索引的临时目录，默认新建并在结束后删除
+
+    Returns:
+        报告：config、corpus（生成和嵌入耗时）和各后端的测量结果
+    """
+    unknown = set(backends) - set(BACKEND_CLASSES)
+    if unknown:
+        raise ValueError(f"不支持的后端: {sorted(unknown)}，可选 {BACKENDS}")
+
+    start = time.perf_counter()
+    documents = synthetic_corpus(num_docs, seed=seed)
+    queries = synthetic_queries(documents, num_queries, seed=seed + 1)
+    corpus_seconds = time.perf_counter() - start
+
+    embeddings = HashedNGramEmbeddings(dimensions)
+    start = time.perf_counter()
+    exact = exact_search(embeddings, documents, [q for q, _ in queries], k)
+    embed_seconds = time.perf_counter() - start
+    print(f"合成语料: {num_docs} 个文档，{num_queries} 个问题，"
+          f"嵌入与精确检索用时 {embed_seconds:.2f}秒")
+
+    own_directory = work_directory is None
+    work_directory = work_directory or tempfile.mkdtemp(prefix="retrieval_benchmark_")
+    report: Dict[str, Any] = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "config": {"num_docs": num_docs, "num_queries": num_queries, "k": k,
+                   "embedding": embeddings.model, "dimensions": dimensions,
+                   "batch_sizes": list(batch_sizes), "seed": seed},
+        "corpus": {"generate_seconds": corpus_seconds,
+                   "embed_and_exact_seconds": embed_seconds},
+        "backends": {},
+    }
+    try:
+        for name in backends:
+            print(f"测试 {name} ...")
+            backend = BACKEND_CLASSES[name](embeddings, k, work_directory)
+            try:
+                report["backends"][name] = benchmark_backend(backend, documents, queries,
+                                                             exact, batch_sizes)
+            except Exception as e:
+                print(f"❌ {name} 测试失败: {type(e).__name__}: {e}")
+                report["backends"][name] = {"error": f"{type(e).__name__}: {e}"}
+            del backend
+    finally:
+        if own_directory:
+            shutil.rmtree(work_directory, ignore_errors=True)
+    return report
+
+
+def print_benchmark(report: Dict[str, Any]) -> None:
+    """打印各后端的对比表"""
+    batch_sizes = report["config"]["batch_sizes"]
+    header = (f"{'后端':<12}{'构建(s)':>9}{'内存(MB)':>10}{'磁盘(MB)':>10}"
+              f"{'p50(ms)':>9}{'p95(ms)':>9}{'p99(ms)':>9}"
+              + "".join(f"{'QPS@' + str(b):>10}" for b in batch_sizes)
+              + f"{'recall@k':>10}{'MRR':>7}{'命中率':>8}")
+    print("\n" + "=" * len(header))
+    print(f"📊 检索基准（k={report['config']['k']}，{report['config']['num_docs']} 个文档）")
+    print("=" * len(header))
+    print(header)
+    for name, result in report["backends"].items():
+        if "error" in result:
+            print(f"{name:<14}❌ {result['error']}")
+            continue
+        memory = (f"{result['memory_bytes'] / 2**20:>10.1f}"
+                  if result["memory_bytes"] is not None else f"{'-':>10}")
+        latency, quality = result["latency"], result["quality"]
+        print(f"{name:<14}{result['build_seconds']:>9.2f}{memory}"
+              f"{result['disk_bytes'] / 2**20:>10.1f}"
+              f"{latency['p50'] * 1000:>9.2f}{latency['p95'] * 1000:>9.2f}"
+              f"{latency['p99'] * 1000:>9.2f}"
+              + "".join(f"{result['qps'][str(b)]:>10.0f}" for b in batch_sizes)
+              + f"{quality['recall_at_k']:>10.3f}{quality['mrr']:>7.3f}"
+              f"{quality['hit_rate']:>8.3f}")
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="离线检索基准测试")
+    parser.add_argument("--backends", default=",".join(BACKENDS),
+                        help=f"逗号分隔的后端，可选 {','.join(BACKENDS)}")
+    parser.add_argument("--num-docs", type=int, default=2000, help="语料文档数")
+    parser.add_argument("--num-queries", type=int, default=200, help="问题数")
+    parser.add_argument("--k", type=int, default=10, help="每个问题返回的结果数")
+    parser.add_argument("--dimensions", type=int, default=256, help="嵌入替身的维度")
+    parser.add_argument("--batch-sizes", default=",".join(map(str, DEFAULT_BATCH_SIZES)),
+                        help="逗号分隔的批大小")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--output", default=None, help="JSON报告路径")
+    args = parser.parse_args()
+
+    report = run_benchmark(backends=[b.strip() for b in args.backends.split(",") if b.strip()],
+                           num_docs=args.num_docs,
+                           num_queries=args.num_queries,
+                           k=args.k,
+                           dimensions=args.dimensions,
+                           batch_sizes=[int(b) for b in args.batch_sizes.split(",")],
+                           seed=args.seed)
+    print_benchmark(report)
+    if args.output:
+        write_report(report, args.output)
+        print(f"\n报告已写入: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+单遍流式文本分割器
+
+从左到右扫描一次文本，在每个窗口（chunk_size个字符）内按优先级选择切分点：
+段落 > 换行 > 句末标点（含中文。！？；）> 分句标点（，、：）> 空格 > 硬切。
+相邻片段的重叠从切分点向前不超过 chunk_overlap 个字符、并对齐到分隔符边界，
+与 RecursiveCharacterTextSplitter 的 chunk_size / chunk_overlap 语义一致。
+
+输入可以是文档生成器，也可以是按块读取的文本流；片段逐个产出，
+并在 start_index 中记录其在原文中的精确字符偏移，内存占用与文件大小无关。
+"""
+
+import io
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_text_splitters import TextSplitter
+
+# 按优先级排列的分隔符组：(分隔符, 切分点是否在分隔符之后)
+SEPARATOR_GROUPS: List[List[Tuple[str, bool]]] = [
+    [("\n\n", False)],
+    [("\n", False)],
+    [(sep, True) for sep in ("。", "！", "？", "；", "!", "?", ";", "…")] + [(". ", True)],
+    [(sep, True) for sep in ("，", "、", "：", ",", ":")],
+    [(" ", False)],
+]
+
+# 切分点之后需要看到的字符数：留给下一个片段的分隔符可以越过窗口末尾
+_LOOKAHEAD = max(len(sep) for group in SEPARATOR_GROUPS for sep, _ in group)
+
+# 重叠区域的起点只能落在这些分隔符之后
+_BOUNDARY = re.compile(r"\s+|[。！？；!?;…，、：,:]")
+
+
+class StreamingTextSplitter(TextSplitter):
+    """单遍扫描、惰性产出片段的文本分割器"""
+
+    def __init__(self, chunk_size: int = 500, chunk_overlap: int = 100,
+                 min_chunk_ratio: float = 0.5, **kwargs: Any):
+        """
+        初始化分割器
+
+        Args:
+            chunk_size: 片段的最大字符数
+            chunk_overlap: 相邻片段的最大重叠字符数
+            min_chunk_ratio: 优先使用高优先级分隔符，但片段不短于 chunk_size 的这个比例；
+                窗口内找不到满足长度的分隔符时退而使用任意分隔符
+            **kwargs: 传给 TextSplitter 的其他参数（如 add_start_index）
+        """
+        super().__init__(chunk_size=chunk_size, chunk_overlap=chunk_overlap, **kwargs)
+        self.min_chunk_ratio = min_chunk_ratio
+
+    def _find_break(self, buffer: str, start: int) -> Tuple[int, bool]:
+        """
+        在 [start, start + chunk_size] 窗口内选择切分点
+
+        Returns:
+            (切分点, 是否为硬切)
+        """
+        limit = start + self._chunk_size
+        preferred = start + int(self._chunk_size * self.min_chunk_ratio)
+        fallback = -1
+        for group in SEPARATOR_GROUPS:
+            best = -1
+            for sep, after in group:
+                if after:
+                    # 标点留在当前片段末尾，必须完整落在窗口内
+                    i = buffer.rfind(sep, start, limit)
+                    position = i + len(sep) if i != -1 else -1
+                else:
+                    # 空白分隔符留给下一个片段，切分点不超过窗口末尾即可
+                    i = buffer.rfind(sep, start + 1, limit + len(sep))
+                    position = i if i <= limit else -1
+                best = max(best, position)
+            if best >= preferred:
+                return best, False
+            if fallback == -1:
+                fallback = best
+        if fallback > start:
+            return fallback, False
+        return limit, True
+
+    def _next_start(self, buffer: str, start: int, end: int, hard_cut: bool) -> int:
+        """下一个片段的起点：重叠不超过 chunk_overlap 并对齐到分隔符边界"""
+        if self._chunk_overlap <= 0:
+            return end
+        lower = max(end - self._chunk_overlap, start + 1)
+        if hard_cut:
+            return lower
+        match = _BOUNDARY.search(buffer, lower, end)
+        return match.end() if match and match.end() < end else end
+
+    def split_stream(self, pieces: Iterable[str]) -> Iterator[Tuple[int, str]]:
+        """
+        单遍分割文本流
+
+        Args:
+            pieces: 依次到达的文本块（例如按块读取的大文件）
+
+        Yields:
+            (片段在原文中的字符偏移, 片段文本)
+        """
+        buffer = ""
+        base = 0  # buffer[0] 在原文中的偏移
+        start = 0
+        pieces = iter(pieces)
+        exhausted = False
+        while True:
+            # 保证跨越窗口末尾的分隔符完整可见，或者输入已经结束，
+            # 使切分结果与输入如何分块无关
+            while not exhausted and len(buffer) - start <= self._chunk_size + _LOOKAHEAD:
+                piece = next(pieces, None)
+                if piece is None:
+                    exhausted = True
+                else:
+                    # 丢弃已处理完的前缀，缓冲区只保留当前窗口附近的文本
+                    buffer = buffer[start:] + piece
+                    base += start
+                    start = 0
+
+            if start >= len(buffer):
+                return
+            if exhausted and len(buffer) - start <= self._chunk_size:
+                end, hard_cut = len(buffer), False
+            else:
+                end, hard_cut = self._find_break(buffer, start)
+
+            chunk = buffer[start:end]
+            stripped = chunk.strip() if self._strip_whitespace else chunk
+            if stripped:
+                offset = len(chunk) - len(chunk.lstrip()) if self._strip_whitespace else 0
+                yield base + start + offset, stripped
+            if end >= len(buffer) and exhausted:
+                return
+            start = self._next_start(buffer, start, end, hard_cut)
+
+    def split_text(self, text: str) -> List[str]:
+        return [chunk for _, chunk in self.split_stream([text])]
+
+    def iter_documents(self, documents: Iterable[Document]) -> Iterator[Document]:
+        """
+        惰性分割文档流
+
+        Args:
+            documents: 文档列表或生成器
+
+        Yields:
+            文档片段，add_start_index 为True时记录原文偏移
+        """
+        for document in documents:
+            yield from self._documents_from_stream([document.page_content],
+                                                   document.metadata)
+
+    def iter_file(self, file_path: str, encoding: str = "utf-8",
+                  block_size: int = 1 << 20) -> Iterator[Document]:
+        """
+        按块读取文本文件并分割，不把整个文件读入内存
+
+        Args:
+            file_path: 文本文件路径
+            encoding: 文件编码
+            block_size: 每次读取的字符数
+        """
+        with io.open(file_path, "r", encoding=encoding) as f:
+            blocks = iter(lambda: f.read(block_size), "")
+            yield from self._documents_from_stream(blocks, {"source": file_path})
+
+    def _documents_from_stream(self, pieces: Iterable[str],
+                               metadata: Dict[str, Any]) -> Iterator[Document]:
+        for offset, chunk in self.split_stream(pieces):
+            chunk_metadata = dict(metadata)
+            if self._add_start_index:
+                chunk_metadata["start_index"] = offset
+            yield Document(page_content=chunk, metadata=chunk_metadata)
+
+    def split_documents(self, documents: Iterable[Document]) -> List[Document]:
+        return list(self.iter_documents(documents))
+
+    def create_documents(self, texts: List[str],
+                         metadatas: Optional[List[dict]] = None) -> List[Document]:
+        metadatas = metadatas or [{}] * len(texts)
+        return list(self.iter_documents(
+            Document(page_content=text, metadata=metadata)
+            for text, metadata in zip(texts, metadatas)))
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+测试语义回答缓存：相似度阈值、TTL过期、索引版本失效、LRU淘汰，
+以及 RAGSystem 查询时缓存结果不被本次请求修改
+"""
+
+import asyncio
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+
+import answer_cache
+from answer_cache import SemanticAnswerCache
+from basic_rag import RAGSystem
+
+
+class FixedEmbeddings(Embeddings):
+    """问题 -> 指定的向量，用来精确控制问题间的余弦相似度"""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.vectors[text]
+
+
+def _at_angle(similarity):
+    """与 [1, 0] 的余弦相似度为 similarity 的单位向量"""
+    return [similarity, float(np.sqrt(1 - similarity ** 2))]
+
+
+EMBEDDINGS = FixedEmbeddings({
+    "什么是RAG？": [1.0, 0.0],
+    "RAG是什么？": _at_angle(0.97),
+    "RAG是什么意思？": _at_angle(0.951),
+    "RAG的含义？": _at_angle(0.949),
+    "今天天气如何？": _at_angle(0.2),
+})
+
+
+@pytest.fixture
+def cache():
+    cache = SemanticAnswerCache(EMBEDDINGS, threshold=0.95, ttl_seconds=60, max_entries=2)
+    cache.invalidate("v1")
+    cache.store("什么是RAG？", {"answer": "检索增强生成"}, index_version="v1")
+    return cache
+
+
+def test_hit_at_or_above_threshold(cache):
+    question, result, similarity = cache.lookup("RAG是什么？")
+
+    assert question == "什么是RAG？"
+    assert result == {"answer": "检索增强生成"}
+    assert similarity == pytest.approx(0.97, abs=1e-6)
+    # 刚好高于阈值也命中
+    assert cache.lookup("RAG是什么意思？") is not None
+    assert cache.stats()["hits"] == 2
+
+
+def test_miss_below_threshold(cache):
+    assert cache.lookup("RAG的含义？") is None
+    assert cache.lookup("今天天气如何？") is None
+    assert cache.stats() == pytest.approx({"hits": 0, "misses": 2, "hit_rate": 0.0,
+                                           "entries": 1, "evictions": 0, "expirations": 0})
+
+
+def test_expires_after_ttl(cache, monkeypatch):
+    now = answer_cache.time.time()
+    monkeypatch.setattr(answer_cache.time, "time", lambda: now + 59)
+    assert cache.lookup("什么是RAG？") is not None
+
+    monkeypatch.setattr(answer_cache.time, "time", lambda: now + 61)
+    assert cache.lookup("什么是RAG？") is None
+    assert len(cache) == 0
+    assert cache.stats()["expirations"] == 1
+
+
+def test_invalidated_when_index_version_changes(cache):
+    cache.invalidate("v1")
+    assert cache.lookup("什么是RAG？") is not None
+
+    cache.invalidate("v2")
+    assert cache.lookup("什么是RAG？") is None
+    # 按旧版本生成的回答（生成期间索引已更新）不写入
+    cache.store("什么是RAG？", {"answer": "旧回答"}, index_version="v1")
+    assert len(cache) == 0
+    cache.store("什么是RAG？", {"answer": "新回答"}, index_version="v2")
+    assert cache.lookup("什么是RAG？")[1] == {"answer": "新回答"}
+
+
+def test_lru_eviction(cache):
+    cache.store("今天天气如何？", {"answer": "晴"}, index_version="v1")
+    cache.lookup("什么是RAG？")
+    cache.store("RAG是什么？", {"answer": "检索增强生成"}, index_version="v1")
+
+    assert list(cache._entries) == ["什么是RAG？", "RAG是什么？"]
+    assert cache.stats()["evictions"] == 1
+
+
+class StubChain:
+    """返回带耗时字典的结果，记录调用次数"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def _result(self, question):
+        self.calls += 1
+        return {"question": question, "answer": "检索增强生成", "sources": [],
+                "timings": {"retrieval": 0.1, "generation": 0.2, "total": 0.3}}
+
+    def invoke(self, question, filter=None):
+        return self._result(question)
+
+    async def ainvoke(self, question, filter=None):
+        return self._result(question)
+
+
+@pytest.fixture
+def rag(azure_env, tmp_path):
+    system = RAGSystem(model_name="gpt-4", api_version="2024-02-15-preview",
+                       persist_directory=str(tmp_path / "index"),
+                       answer_cache_threshold=0.95)
+    system.answer_cache.embeddings = EMBEDDINGS
+    system.rag_chain = StubChain()
+    return system
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_query_with_sources_uses_cache(rag, use_async):
+    def query(question):
+        if use_async:
+            return asyncio.run(rag.aquery_with_sources(question))
+        return rag.query_with_sources(question)
+
+    first = query("什么是RAG？")
+    second = query("RAG是什么？")
+
+    assert rag.rag_chain.calls == 1
+    assert first["cached"] is False
+    assert second["cached"] is True
+    assert second["cached_question"] == "什么是RAG？"
+    assert second["question"] == "RAG是什么？"
+    # 缓存的是副本：第一次请求补充的缓存查找耗时不会出现在缓存结果中
+    assert "cache_lookup" in first["timings"]
+    _, cached_result, _ = rag.answer_cache.lookup("什么是RAG？")
+    assert "cache_lookup" not in cached_result["timings"]
+    assert cached_result["timings"]["total"] == pytest.approx(0.3)
+    # 带过滤条件的查询不使用缓存
+    rag.query_with_sources("RAG是什么？", filter={"source": "a.txt"})
+    assert rag.rag_chain.calls == 2
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+测试持久化BM25索引：保存/加载往返、增删后的得分、带元数据过滤的检索
+"""
+
+import json
+import math
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+from bm25_index import BM25Index, BM25IndexRetriever, cjk_bigram_tokenizer
+
+DOCS = [
+    Document(id="a", page_content="向量数据库用于语义检索", metadata={"source": "a.txt", "year": 2023}),
+    Document(id="b", page_content="BM25是经典的关键词检索算法", metadata={"source": "b.txt", "year": 2024}),
+    Document(id="c", page_content="混合检索融合向量检索和关键词检索", metadata={"source": "c.txt", "year": 2024}),
+    Document(id="d", page_content="今天天气很好，适合出门散步", metadata={"source": "d.txt", "year": 2022}),
+]
+
+
+@pytest.fixture
+def index():
+    index = BM25Index()
+    index.add_documents(DOCS)
+    return index
+
+
+def _ids(results):
+    return [doc.id for doc, _ in results]
+
+
+def _reference_score(index, query, doc):
+    """按BM25公式逐项计算的得分"""
+    tokens = [cjk_bigram_tokenizer(d.page_content) for d in index.documents]
+    avg_len = sum(map(len, tokens)) / len(tokens)
+    doc_tokens = cjk_bigram_tokenizer(doc.page_content)
+    score = 0.0
+    for term in cjk_bigram_tokenizer(query):
+        df = sum(term in t for t in tokens)
+        if df == 0:
+            continue
+        tf = doc_tokens.count(term)
+        idf = math.log((len(tokens) - df + 0.5) / (df + 0.5) + 1)
+        score += idf * tf * (index.k1 + 1) / (
+            tf + index.k1 * (1 - index.b + index.b * len(doc_tokens) / avg_len))
+    return score
+
+
+def test_scores_match_formula(index):
+    scores = index.get_scores("关键词检索")
+
+    for row, doc in enumerate(index.documents):
+        assert scores[row] == pytest.approx(_reference_score(index, "关键词检索", doc), rel=1e-5)
+    assert _ids(index.search("关键词检索", k=2)) == ["b", "c"]
+    # 零分文档不返回
+    assert "d" not in _ids(index.search("关键词检索", k=4))
+
+
+def test_save_load_round_trip(index, tmp_path):
+    path = str(tmp_path / "bm25")
+    index.save(path)
+
+    loaded = BM25Index.load(path)
+
+    assert BM25Index.exists(path)
+    assert len(loaded) == len(index)
+    assert [(d.id, d.page_content, d.metadata) for d in loaded.documents] == \
+        [(d.id, d.page_content, d.metadata) for d in index.documents]
+    for query in ("向量检索", "BM25算法", "天气"):
+        np.testing.assert_array_equal(loaded.get_scores(query), index.get_scores(query))
+    # 加载后可以继续增量写入
+    loaded.add_documents([Document(id="e", page_content="关键词检索的倒排索引")])
+    assert "e" in _ids(loaded.search("倒排索引"))
+
+
+def test_delete_and_replace_survive_round_trip(index, tmp_path):
+    index.delete(["b"])
+    index.add_documents([Document(id="c", page_content="关于天气的新内容", metadata={})])
+    path = str(tmp_path / "bm25")
+    index.save(path)
+
+    loaded = BM25Index.load(path)
+
+    assert [d.id for d in loaded.documents] == ["a", "d", "c"]
+    assert _ids(loaded.search("关键词")) == []
+    np.testing.assert_array_equal(loaded.get_scores("天气"), index.get_scores("天气"))
+    # 删除后重建的得分与直接用剩余文档建索引一致
+    rebuilt = BM25Index()
+    rebuilt.add_documents(loaded.documents)
+    np.testing.assert_allclose(loaded.get_scores("天气内容"), rebuilt.get_scores("天气内容"))
+
+
+def test_load_rejects_mismatched_tokenizer_and_truncated_records(index, tmp_path):
+    path = tmp_path / "bm25"
+    index.save(str(path))
+
+    with pytest.raises(ValueError, match="分词器"):
+        BM25Index.load(str(path), tokenizer="cjk_unigram")
+
+    header = json.loads((path / "bm25.json").read_text(encoding="utf-8"))
+    header["count"] += 1
+    (path / "bm25.json").write_text(json.dumps(header), encoding="utf-8")
+    with pytest.raises(ValueError, match="不完整"):
+        BM25Index.load(str(path))
+
+
+def test_filtered_search(index):
+    assert _ids(index.search("检索", k=4, filter={"year": 2024})) == ["c", "b"]
+    assert _ids(index.search("关键词检索", k=1,
+                             filter={"source": {"$in": ["a.txt", "b.txt"]}})) == ["b"]
+    assert _ids(index.search("检索", k=4, filter={"year": {"$lt": 2023}})) == []
+    # 删除后行号压缩，过滤仍指向正确的文档
+    index.delete(["a"])
+    assert _ids(index.search("检索", k=4, filter={"source": "c.txt"})) == ["c"]
+
+
+def test_copy_is_isolated(index):
+    snapshot = index.copy()
+    snapshot.delete(["b"])
+    snapshot.add_documents([Document(id="f", page_content="关键词")])
+
+    assert _ids(index.search("关键词", k=4)) == ["b", "c"]
+    assert "b" not in _ids(snapshot.search("关键词", k=4))
+
+
+def test_retriever_from_documents_and_load(tmp_path):
+    path = str(tmp_path / "bm25")
+    retriever = BM25IndexRetriever.from_documents(DOCS, path=path, k=2)
+    loaded = BM25IndexRetriever.load(path, k=2)
+
+    assert [d.id for d in loaded.invoke("关键词检索")] == \
+        [d.id for d in retriever.invoke("关键词检索")]
+    assert [d.id for d in loaded.invoke("检索", filter={"year": 2023})] == ["a"]
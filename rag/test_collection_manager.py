@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+测试多集合管理：淘汰的 Chroma 集合从chromadb的System缓存中移除
+"""
+
+from chromadb.api.shared_system_client import SharedSystemClient
+from langchain_core.documents import Document
+
+from collection_manager import CollectionManager
+from retrieval_benchmark import HashedNGramEmbeddings
+
+
+def _manager(tmp_path):
+    manager = CollectionManager(HashedNGramEmbeddings(), str(tmp_path), backend="chroma")
+    manager.build("tenant", [Document(page_content="hello world", metadata={"source": "a"})])
+    return manager
+
+
+def test_evict_releases_chroma_system(tmp_path):
+    """淘汰后该目录的System不再被缓存，再次打开时可以正常检索"""
+    manager = _manager(tmp_path)
+    identifier = manager.vectorstore("tenant")._client._identifier
+    assert identifier in SharedSystemClient._identifier_to_system
+
+    assert manager.evict("tenant")
+    assert identifier not in SharedSystemClient._identifier_to_system
+    assert manager.vectorstore("tenant").similarity_search("hello", k=1)
+
+
+def test_evict_without_system_cache(tmp_path, monkeypatch, capsys):
+    """chromadb没有内部缓存属性时只提示，不抛出异常"""
+    manager = _manager(tmp_path)
+    monkeypatch.delattr(SharedSystemClient, "_identifier_to_system")
+
+    assert manager.evict("tenant")
+    assert "不支持按目录释放缓存" in capsys.readouterr().out
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+测试批量嵌入流水线：从检查点续传、按 retry-after 重试限流请求，
+以及与嵌入缓存共用一个SQLite文件
+"""
+
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from embedding_cache import CachedEmbeddings, EmbeddingStore
+from embedding_pipeline import CHECKPOINT_TABLE, BatchedEmbeddings
+
+
+class RateLimitedEmbeddings:
+    """前几次请求返回429（带 retry-after），之后正常返回"""
+
+    def __init__(self, embeddings, failures: int):
+        self.embeddings = embeddings
+        self.failures = failures
+        self.calls = 0
+
+    def __getattr__(self, name):
+        return getattr(self.embeddings, name)
+
+    async def aembed_documents(self, texts):
+        self.calls += 1
+        if self.calls <= self.failures:
+            request = httpx.Request("POST", "https://test.openai.azure.com/embeddings")
+            response = httpx.Response(429, headers={"retry-after": "0"}, request=request)
+            raise openai.RateLimitError("rate limited", response=response, body=None)
+        return self.embeddings.embed_documents(texts)
+
+
+def _texts(n):
+    return [f"片段{i}：检查点续传测试文本" for i in range(n)]
+
+
+def test_resume_skips_checkpointed_batches(tmp_path, embeddings):
+    path = str(tmp_path / "checkpoint.sqlite")
+    texts = _texts(10)
+    pipeline = BatchedEmbeddings(embeddings, batch_size=2, checkpoint_path=path)
+
+    # 模拟上次构建在完成前6个片段（3个批次）后中断
+    completed = texts[:6]
+    pipeline.checkpoint.put_many(
+        pipeline.model, pipeline.dimensions,
+        [(pipeline._hash(t), v) for t, v in zip(completed, embeddings.embed_documents(completed))])
+    embeddings.embedded.clear()
+
+    vectors = pipeline.embed_documents(texts)
+
+    assert sorted(embeddings.embedded) == sorted(texts[6:])
+    assert pipeline.last_run["resumed"] == 6
+    assert pipeline.last_run["batches"] == 2
+    assert vectors == embeddings.embed_documents(texts)
+    # 全部完成后清除检查点
+    assert len(pipeline.checkpoint) == 0
+
+
+def test_rate_limit_retried_after_header(embeddings, capsys):
+    flaky = RateLimitedEmbeddings(embeddings, failures=2)
+    pipeline = BatchedEmbeddings(flaky, batch_size=4, max_retries=3)
+
+    vectors = asyncio.run(pipeline.aembed_documents(_texts(3)))
+
+    assert flaky.calls == 3
+    assert vectors == embeddings.embed_documents(_texts(3))
+    assert "0.0秒后重试 (2/3)" in capsys.readouterr().out
+
+
+def test_rate_limit_gives_up_after_max_retries(embeddings):
+    flaky = RateLimitedEmbeddings(embeddings, failures=5)
+    pipeline = BatchedEmbeddings(flaky, max_retries=1)
+
+    with pytest.raises(openai.RateLimitError):
+        asyncio.run(pipeline.aembed_documents(_texts(2)))
+    assert flaky.calls == 2
+
+
+def test_cache_and_checkpoint_share_file_in_separate_tables(tmp_path, embeddings):
+    path = str(tmp_path / "embedding_cache.sqlite")
+    cached = CachedEmbeddings(BatchedEmbeddings(embeddings, checkpoint_path=path),
+                              cache_path=path)
+
+    asyncio.run(cached.aembed_documents(_texts(5)))
+
+    assert len(EmbeddingStore(path)) == 5
+    assert len(EmbeddingStore(path, table=CHECKPOINT_TABLE)) == 0
+    assert cached.embed_documents(_texts(5)) == embeddings.embed_documents(_texts(5))
+    assert cached.stats()["hits"] == 5
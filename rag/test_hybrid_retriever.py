@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+测试并发混合检索：RRF和得分融合的排序、按内容去重、单路超时或出错时回退到另一路
+"""
+
+import asyncio
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from bm25_index import BM25Index
+from hybrid_retriever import (HybridRetriever, normalized_score_fusion,
+                              reciprocal_rank_fusion)
+
+
+def _doc(text, **metadata):
+    return Document(page_content=text, metadata={"source": "test.txt", **metadata})
+
+
+class StubVectorStore(VectorStore):
+    """返回固定结果的向量存储，可以模拟慢查询和错误"""
+
+    def __init__(self, results, delay=0.0, error=None):
+        self.results = results
+        self.delay = delay
+        self.error = error
+        self.filters = []
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        raise NotImplementedError
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.results[:k]]
+
+    async def _asimilarity_search_with_relevance_scores(self, query, k=4, **kwargs):
+        self.filters.append(kwargs.get("filter"))
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.results[:k]
+
+
+@pytest.fixture
+def bm25():
+    index = BM25Index()
+    index.add_documents([
+        Document(id="s1", page_content="关键词检索算法", metadata={"source": "test.txt", "year": 2024}),
+        Document(id="s2", page_content="向量检索与关键词", metadata={"source": "test.txt", "year": 2023}),
+    ])
+    return index
+
+
+def _texts(docs):
+    return [doc.page_content for doc in docs]
+
+
+def test_rrf_orders_by_weighted_reciprocal_rank():
+    a, b, c = _doc("A"), _doc("B"), _doc("C")
+    fused = reciprocal_rank_fusion([[(a, 0.9), (b, 0.8)], [(c, 9.0), (a, 1.0)]],
+                                   weights=(0.7, 0.3), rrf_k=60)
+
+    ranked = sorted(fused.values(), key=lambda item: item[1], reverse=True)
+    assert [doc.page_content for doc, _ in ranked] == ["A", "B", "C"]
+    assert ranked[0][1] == pytest.approx(0.7 / 61 + 0.3 / 62)
+    # 只看排名：原始得分的大小不影响结果
+    assert ranked[1][1] == pytest.approx(0.7 / 62)
+    assert ranked[2][1] == pytest.approx(0.3 / 61)
+
+
+def test_score_fusion_normalizes_each_leg():
+    a, b, c = _doc("A"), _doc("B"), _doc("C")
+    fused = normalized_score_fusion([[(a, 0.9), (b, 0.5)], [(c, 12.0), (b, 4.0), (a, 2.0)]],
+                                    weights=(0.5, 0.5))
+    scores = {doc.page_content: score for doc, score in fused.values()}
+
+    assert scores == pytest.approx({"A": 0.5 * 1.0 + 0.5 * 0.0,
+                                    "B": 0.5 * 0.0 + 0.5 * 0.2,
+                                    "C": 0.5 * 1.0})
+    # 单一结果的一路归一化为1
+    single = normalized_score_fusion([[(a, 0.3)], []], weights=(1.0, 1.0))
+    assert list(single.values())[0][1] == 1.0
+
+
+@pytest.mark.parametrize("fusion, expected", [
+    ("rrf", ["向量检索与关键词", "稠密独有", "关键词检索算法"]),
+    ("score", ["向量检索与关键词", "稠密独有", "关键词检索算法"]),
+])
+def test_retriever_deduplicates_and_fuses(bm25, fusion, expected):
+    # 稠密结果中的片段与BM25中的同内容片段按内容ID合并
+    dense = [(_doc("向量检索与关键词"), 0.9), (_doc("稠密独有"), 0.6)]
+    retriever = HybridRetriever(vectorstore=StubVectorStore(dense), bm25_index=bm25,
+                                weights=(0.7, 0.3), fusion=fusion)
+
+    docs = retriever.invoke("向量检索")
+
+    assert _texts(docs) == expected
+    scores = [doc.metadata["relevance_score"] for doc in docs]
+    assert scores == sorted(scores, reverse=True)
+    assert retriever.last_legs["dense"]["status"] == "ok"
+    assert retriever.last_legs["sparse"]["results"] == 2
+
+
+def test_dense_timeout_falls_back_to_sparse(bm25, capsys):
+    slow = StubVectorStore([(_doc("很慢的结果"), 0.9)], delay=1.0)
+    retriever = HybridRetriever(vectorstore=slow, bm25_index=bm25, timeout=0.05)
+
+    docs, legs = asyncio.run(retriever.retrieve_with_stats("关键词检索"))
+
+    assert _texts(docs) == ["关键词检索算法", "向量检索与关键词"]
+    assert legs["dense"]["status"] == "timeout"
+    assert legs["dense"]["results"] == 0
+    assert legs["dense"]["seconds"] < 0.5
+    assert legs["sparse"]["status"] == "ok"
+    assert "dense 检索超时" in capsys.readouterr().out
+
+
+def test_sparse_error_falls_back_to_dense(bm25):
+    class BrokenBM25(BM25Index):
+        def search(self, query, k=4, filter=None):
+            raise RuntimeError("索引损坏")
+
+    dense = [(_doc("稠密结果"), 0.8)]
+    retriever = HybridRetriever(vectorstore=StubVectorStore(dense), bm25_index=BrokenBM25())
+
+    docs = retriever.invoke("检索")
+
+    assert _texts(docs) == ["稠密结果"]
+    assert retriever.last_legs["sparse"]["status"] == "RuntimeError: 索引损坏"
+
+
+def test_filter_pushed_to_both_legs(bm25):
+    store = StubVectorStore([])
+    retriever = HybridRetriever(vectorstore=store, bm25_index=bm25)
+
+    docs = retriever.invoke("关键词", filter={"year": 2023})
+
+    assert store.filters == [{"year": 2023}]
+    assert _texts(docs) == ["向量检索与关键词"]
+
+
+def test_out_of_range_relevance_scores_are_fused(bm25):
+    # Chroma 的L2距离换算出的相关度可能为负，融合只看排名或归一化得分
+    store = StubVectorStore([(_doc("负相关度"), -0.4), (_doc("更低"), -0.9)])
+    retriever = HybridRetriever(vectorstore=store, bm25_index=bm25, fusion="score")
+
+    docs = retriever.invoke("检索")
+
+    assert _texts(docs)[:2] == ["负相关度", "关键词检索算法"]
+    assert all(0.0 <= doc.metadata["relevance_score"] <= 1.0 for doc in docs)
+
+
+def test_leg_stats_are_per_task(bm25):
+    fast = HybridRetriever(vectorstore=StubVectorStore([]), bm25_index=bm25)
+
+    async def run(query):
+        await fast.ainvoke(query)
+        return fast.last_legs["sparse"]["results"]
+
+    async def main():
+        return await asyncio.gather(run("关键词检索"), run("不存在的词"))
+
+    assert asyncio.run(main()) == [2, 0]
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+测试增量摄取：只嵌入变化的片段，删除过期片段，全量重建后丢弃摄取清单
+"""
+
+import os
+
+import pytest
+
+from basic_rag import RAGSystem
+from ingest_manifest import MANIFEST_FILENAME, IngestManifest
+
+
+def _write(directory, name, topic, paragraphs=4):
+    text = "\n\n".join(f"{topic} 第{i}段：" + f"{topic}的内容说明{i}。" * 30
+                       for i in range(paragraphs))
+    path = directory / name
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+@pytest.fixture(params=["numpy", "chroma"])
+def rag(request, azure_env, tmp_path, embeddings):
+    system = RAGSystem(model_name="gpt-4", api_version="2024-02-15-preview",
+                       persist_directory=str(tmp_path / "index"),
+                       vector_backend=request.param)
+    system.embeddings = embeddings
+    return system
+
+
+@pytest.fixture
+def docs(tmp_path):
+    directory = tmp_path / "docs"
+    directory.mkdir()
+    _write(directory, "a.txt", "苹果")
+    _write(directory, "b.txt", "香蕉")
+    return directory
+
+
+def _manifest(rag):
+    return IngestManifest(os.path.join(rag.persist_directory, MANIFEST_FILENAME))
+
+
+def _chunk_ids(rag, name):
+    manifest = _manifest(rag)
+    return {source: set(manifest.chunk_ids(source)) for source in manifest.sources()
+            if source.endswith(name)}.popitem()[1]
+
+
+def test_unchanged_files_are_not_reembedded(rag, docs):
+    rag.setup(str(docs), incremental=True)
+    assert rag.embeddings.embedded
+    rag.embeddings.embedded.clear()
+
+    rag.setup(str(docs), incremental=True)
+    assert rag.embeddings.embedded == []
+
+
+def test_modified_file_replaces_only_its_chunks(rag, docs):
+    rag.setup(str(docs), incremental=True)
+    old_a, old_b = _chunk_ids(rag, "a.txt"), _chunk_ids(rag, "b.txt")
+    rag.embeddings.embedded.clear()
+
+    _write(docs, "a.txt", "樱桃")
+    rag.setup(str(docs), incremental=True)
+
+    new_a, new_b = _chunk_ids(rag, "a.txt"), _chunk_ids(rag, "b.txt")
+    assert new_b == old_b
+    assert new_a and not new_a & old_a
+    assert all("樱桃" in text for text in rag.embeddings.embedded)
+    assert set(rag._stored_vector_ids()) == new_a | new_b
+
+
+def test_deleted_file_removes_its_chunks(rag, docs):
+    rag.setup(str(docs), incremental=True)
+    kept = _chunk_ids(rag, "a.txt")
+
+    os.remove(docs / "b.txt")
+    rag.setup(str(docs), incremental=True)
+
+    assert [os.path.basename(s) for s in _manifest(rag).sources()] == ["a.txt"]
+    assert set(rag._stored_vector_ids()) == kept
+
+
+def test_full_rebuild_discards_manifest(rag, docs):
+    rag.setup(str(docs), incremental=True)
+    assert _manifest(rag).exists
+
+    rag.setup(str(docs), incremental=False)
+    assert not _manifest(rag).exists
+
+    # 下一次增量同步清除全量构建的向量并重新记录，删除的文件不会残留
+    os.remove(docs / "b.txt")
+    rag.setup(str(docs), incremental=True)
+    assert set(rag._stored_vector_ids()) == _chunk_ids(rag, "a.txt")
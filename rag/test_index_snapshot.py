@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+测试预构建索引快照：内容和嵌入配置不变时直接加载，嵌入指纹或文档哈希变化时重建
+"""
+
+import json
+import os
+
+import pytest
+from langchain_core.documents import Document
+
+from index_snapshot import SNAPSHOT_FILENAME, documents_hash, load_or_build_faiss
+
+DOCS = [
+    Document(page_content="向量数据库用于语义检索", metadata={"source": "a.txt"}),
+    Document(page_content="BM25是经典的关键词检索算法", metadata={"source": "b.txt"}),
+]
+
+
+@pytest.fixture
+def snapshot_directory(tmp_path):
+    return str(tmp_path / "snapshots")
+
+
+def _build(documents, embeddings, snapshot_directory):
+    return load_or_build_faiss(documents, embeddings, "docs",
+                               snapshot_directory=snapshot_directory)
+
+
+def test_unchanged_snapshot_is_loaded_without_embedding(embeddings, snapshot_directory):
+    _, rebuilt = _build(DOCS, embeddings, snapshot_directory)
+    assert rebuilt
+
+    embeddings.embedded.clear()
+    vectorstore, rebuilt = _build(DOCS, embeddings, snapshot_directory)
+
+    assert not rebuilt
+    assert embeddings.embedded == []
+    assert vectorstore.similarity_search("关键词检索", k=1)[0].page_content == DOCS[1].page_content
+    assert not os.path.exists(os.path.join(snapshot_directory, "docs.tmp"))
+
+
+def test_rebuilds_when_documents_change(embeddings, snapshot_directory, capsys):
+    _build(DOCS, embeddings, snapshot_directory)
+    changed = DOCS[:1] + [Document(page_content="今天天气很好", metadata={"source": "b.txt"})]
+
+    embeddings.embedded.clear()
+    vectorstore, rebuilt = _build(changed, embeddings, snapshot_directory)
+
+    assert rebuilt
+    assert len(embeddings.embedded) == 2
+    assert "documents_hash" in capsys.readouterr().out
+    with open(os.path.join(snapshot_directory, "docs", SNAPSHOT_FILENAME), encoding="utf-8") as f:
+        assert json.load(f)["documents_hash"] == documents_hash(changed)
+    assert vectorstore.similarity_search("天气", k=1)[0].page_content == "今天天气很好"
+    # 只改元数据也算变化
+    assert documents_hash(changed) != documents_hash(
+        [changed[0], Document(page_content="今天天气很好", metadata={"source": "c.txt"})])
+
+
+def test_rebuilds_when_embedding_fingerprint_changes(embeddings, snapshot_directory, capsys):
+    _build(DOCS, embeddings, snapshot_directory)
+
+    # 维度不同：旧快照的向量不能用于新的查询向量
+    wider = type(embeddings)(dimensions=128)
+    vectorstore, rebuilt = _build(DOCS, wider, snapshot_directory)
+
+    assert rebuilt
+    assert len(wider.embedded) == 2
+    assert "embedding" in capsys.readouterr().out
+    assert vectorstore.index.d == 128
+    assert not _build(DOCS, wider, snapshot_directory)[1]
+
+
+def test_rebuilds_when_snapshot_is_unreadable(embeddings, snapshot_directory, capsys):
+    _build(DOCS, embeddings, snapshot_directory)
+    os.remove(os.path.join(snapshot_directory, "docs", "index.faiss"))
+
+    _, rebuilt = _build(DOCS, embeddings, snapshot_directory)
+
+    assert rebuilt
+    assert "加载索引快照" in capsys.readouterr().out
+    assert os.path.isfile(os.path.join(snapshot_directory, "docs", "index.faiss"))
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+测试文档目录监视：刚写入的文件等待稳定后再处理，加载或更新失败时下一轮重试
+"""
+
+import os
+import time
+
+import pytest
+from langchain_core.documents import Document
+
+from index_watcher import IndexWatcher, diff_files, scan_files
+
+
+def _write(path, text, age=10.0):
+    """写入文件并把修改时间设为 age 秒之前"""
+    path.write_text(text, encoding="utf-8")
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return os.path.normpath(str(path))
+
+
+class Recorder:
+    """记录加载和更新调用，可以让前几次调用失败"""
+
+    def __init__(self, load_failures=0, apply_failures=0):
+        self.load_failures = load_failures
+        self.apply_failures = apply_failures
+        self.loaded = []
+        self.applied = []
+
+    def load(self, path):
+        self.loaded.append(path)
+        if self.load_failures:
+            self.load_failures -= 1
+            raise OSError("文件被占用")
+        with open(path, encoding="utf-8") as f:
+            return [Document(page_content=f.read(), metadata={"source": path})]
+
+    def apply(self, updated, deleted):
+        self.applied.append((sorted(updated), list(deleted)))
+        if self.apply_failures:
+            self.apply_failures -= 1
+            raise RuntimeError("向量库不可用")
+        return {"added": len(updated), "deleted": len(deleted)}
+
+
+@pytest.fixture
+def docs(tmp_path):
+    directory = tmp_path / "docs"
+    directory.mkdir()
+    return directory
+
+
+def _watcher(docs, recorder, settle_seconds=1.0):
+    return IndexWatcher(str(docs), recorder.load, recorder.apply,
+                        interval=60, settle_seconds=settle_seconds)
+
+
+def test_scan_and_diff(docs):
+    a = _write(docs / "a.txt", "甲")
+    _write(docs / "ignored.md", "乙")
+    old = scan_files(str(docs), (".txt",))
+    assert list(old) == [a]
+
+    b = _write(docs / "b.txt", "丙")
+    _write(docs / "a.txt", "甲甲")
+    changes = diff_files(old, scan_files(str(docs), (".txt",)))
+
+    assert (changes.added, changes.modified, changes.deleted) == ([b], [a], [])
+    assert changes.changed == [b, a]
+
+
+def test_waits_for_settle_time(docs):
+    recorder = Recorder()
+    watcher = _watcher(docs, recorder, settle_seconds=5.0)
+    fresh = _write(docs / "fresh.txt", "正在写入", age=0.0)
+    settled = _write(docs / "settled.txt", "已写完")
+
+    stats = watcher.poll()
+
+    # 只处理已稳定的文件，刚写入的文件不加载
+    assert stats == {"added": 1, "deleted": 0}
+    assert recorder.loaded == [settled]
+
+    # 仍未稳定：没有可处理的变化
+    assert watcher.poll() is None
+    assert recorder.loaded == [settled]
+
+    # 稳定后在下一轮处理
+    _write(docs / "fresh.txt", "写完了")
+    assert watcher.poll() == {"added": 1, "deleted": 0}
+    assert recorder.loaded == [settled, fresh]
+    assert watcher.poll() is None
+    assert watcher.updates == 2
+
+
+def test_load_failure_is_retried(docs):
+    recorder = Recorder(load_failures=1)
+    watcher = _watcher(docs, recorder)
+    path = _write(docs / "a.txt", "内容")
+
+    assert watcher.poll() is None
+    assert "文件被占用" in watcher.last_error
+    assert recorder.applied == []
+
+    # 文件状态未更新，下一轮重新发现并加载
+    assert watcher.poll() == {"added": 1, "deleted": 0}
+    assert recorder.loaded == [path, path]
+    assert watcher.poll() is None
+
+
+def test_apply_failure_is_retried(docs):
+    keep = _write(docs / "keep.txt", "保留")
+    gone = _write(docs / "gone.txt", "删除")
+    recorder = Recorder(apply_failures=1)
+    watcher = _watcher(docs, recorder)
+    os.remove(gone)
+    _write(docs / "keep.txt", "修改后")
+
+    assert watcher.poll() is None
+    assert "向量库不可用" in watcher.last_error
+    assert watcher.updates == 0
+
+    # 修改和删除都在下一轮重新提交
+    assert watcher.poll() == {"added": 1, "deleted": 1}
+    assert recorder.applied == [([keep], [gone]), ([keep], [gone])]
+    assert watcher.last_update == {"added": 1, "deleted": 1}
+    assert watcher.poll() is None
+
+
+def test_background_thread_polls(docs):
+    recorder = Recorder()
+    watcher = IndexWatcher(str(docs), recorder.load, recorder.apply,
+                           interval=0.01, settle_seconds=0.0).start()
+    try:
+        path = _write(docs / "a.txt", "内容")
+        deadline = time.time() + 5
+        while not recorder.loaded and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        watcher.stop(timeout=5)
+
+    assert recorder.loaded[0] == path
+    assert not watcher.running
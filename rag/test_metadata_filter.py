@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+测试元数据过滤：$and、$in 等表达式在本地NumPy索引、BM25索引和Chroma上的结果一致
+"""
+
+import numpy as np
+import pytest
+from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+
+from bm25_index import BM25Index
+from metadata_filter import MetadataIndex, build_filter, matches, to_timestamp
+from retrieval_benchmark import HashedNGramEmbeddings
+from vector_index import NumpyVectorStore
+
+SOURCES = ["a.txt", "b.md", "c.pdf", "d.txt"]
+DOCS = [
+    Document(id=f"doc-{i}", page_content=f"检索测试片段{i}",
+             metadata={"source": SOURCES[i % 4],
+                       "file_type": SOURCES[i % 4].rsplit(".", 1)[1],
+                       "ingested_at": 1700000000 + 1000 * i,
+                       "page": i % 3})
+    for i in range(12)
+]
+
+FILTERS = [
+    {"file_type": "txt"},
+    {"source": {"$in": ["a.txt", "c.pdf"]}},
+    {"source": {"$nin": ["a.txt", "c.pdf"]}},
+    {"$and": [{"file_type": {"$in": ["txt", "md"]}}, {"ingested_at": {"$gte": 1700004000}}]},
+    {"$and": [{"source": {"$in": ["a.txt", "b.md", "c.pdf"]}},
+              {"page": {"$ne": 0}}, {"ingested_at": {"$lt": 1700009000}}]},
+    {"$or": [{"file_type": "pdf"}, {"page": {"$gt": 1}}]},
+    {"$and": [{"$or": [{"file_type": "md"}, {"file_type": "pdf"}]}, {"page": {"$lte": 1}}]},
+    {"source": {"$in": ["missing.txt"]}},
+]
+
+
+def _expected(where):
+    return sorted(doc.id for doc in DOCS if matches(doc.metadata, where))
+
+
+@pytest.mark.parametrize("where", FILTERS)
+def test_metadata_index_matches_reference(where):
+    index = MetadataIndex.from_metadatas(doc.metadata for doc in DOCS)
+
+    assert sorted(DOCS[row].id for row in index.rows(where)) == _expected(where)
+
+
+EMBEDDINGS = HashedNGramEmbeddings(dimensions=64)
+
+
+@pytest.fixture(scope="module", params=[None, "int8", "binary"])
+def numpy_store(request, tmp_path_factory):
+    # 带过滤条件时在过滤后的行上精确打分，量化模式下结果集也不变
+    return NumpyVectorStore.from_documents(
+        DOCS, embedding=EMBEDDINGS, ids=[doc.id for doc in DOCS],
+        index_path=str(tmp_path_factory.mktemp("numpy") / "index"),
+        quantization=request.param)
+
+
+@pytest.fixture(scope="module")
+def chroma_store(tmp_path_factory):
+    return Chroma.from_documents(
+        DOCS, embedding=EMBEDDINGS, ids=[doc.id for doc in DOCS],
+        collection_name="filters",
+        persist_directory=str(tmp_path_factory.mktemp("chroma")))
+
+
+@pytest.fixture(scope="module")
+def bm25_index():
+    index = BM25Index()
+    index.add_documents(DOCS)
+    return index
+
+
+@pytest.mark.parametrize("where", FILTERS)
+def test_numpy_backend(numpy_store, where):
+    docs = numpy_store.similarity_search("检索测试片段", k=len(DOCS), filter=where)
+
+    assert sorted(doc.id for doc in docs) == _expected(where)
+
+
+@pytest.mark.parametrize("where", FILTERS)
+def test_bm25_backend(bm25_index, where):
+    results = bm25_index.search("检索测试片段", k=len(DOCS), filter=where)
+
+    assert sorted(doc.id for doc, _ in results) == _expected(where)
+
+
+@pytest.mark.parametrize("where", FILTERS)
+def test_chroma_backend(chroma_store, where):
+    # 同一表达式直接下推给 Chroma 的 where；返回的文档不带ID，按内容对应
+    docs = chroma_store.similarity_search("检索测试片段", k=len(DOCS), filter=where)
+    id_by_text = {doc.page_content: doc.id for doc in DOCS}
+
+    assert sorted(id_by_text[doc.page_content] for doc in docs) == _expected(where)
+
+
+def test_numpy_filter_respects_k_and_deletes(tmp_path, embeddings):
+    store = NumpyVectorStore.from_documents(DOCS, embedding=embeddings,
+                                            ids=[doc.id for doc in DOCS],
+                                            index_path=str(tmp_path / "index"))
+    where = {"source": {"$in": ["a.txt", "b.md"]}}
+    store.delete(["doc-0"])
+
+    docs = store.similarity_search("检索测试片段4", k=2, filter=where)
+
+    assert len(docs) == 2
+    assert docs[0].id == "doc-4"
+    assert all(matches(doc.metadata, where) for doc in docs)
+    assert "doc-0" not in {doc.id for doc in
+                           store.similarity_search("检索", k=len(DOCS), filter=where)}
+
+
+def test_build_filter():
+    assert build_filter() is None
+    assert build_filter(file_type="pdf") == {"file_type": {"$eq": "pdf"}}
+    where = build_filter(source=["a.txt", "d.txt"], ingested_after="2023-11-14T22:13:20",
+                         ingested_before=1700010000)
+    assert where == {"$and": [{"source": {"$in": ["a.txt", "d.txt"]}},
+                              {"ingested_at": {"$gte": to_timestamp("2023-11-14T22:13:20")}},
+                              {"ingested_at": {"$lt": 1700010000}}]}
+
+
+def test_invalid_operators_rejected():
+    index = MetadataIndex.from_metadatas(doc.metadata for doc in DOCS)
+    with pytest.raises(ValueError, match="运算符"):
+        index.mask({"page": {"$regex": "1"}})
+    with pytest.raises(ValueError, match="逻辑运算符"):
+        index.mask({"$not": [{"page": 1}]})
+    with pytest.raises(ValueError, match="非空列表"):
+        matches(DOCS[0].metadata, {"$and": []})
+    assert np.array_equal(index.mask(None), np.ones(len(DOCS), dtype=bool))
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+测试流式文本分割器：切分结果与输入如何分块无关
+"""
+
+import random
+
+from streaming_splitter import StreamingTextSplitter
+
+
+def _pieces(text, sizes):
+    """按给定长度依次切分文本"""
+    pieces, position = [], 0
+    for size in sizes:
+        if position >= len(text):
+            break
+        pieces.append(text[position:position + size])
+        position += size
+    if position < len(text):
+        pieces.append(text[position:])
+    return pieces
+
+
+def test_separator_across_window_edge():
+    """跨越窗口末尾的多字符分隔符在逐字符输入时也能找到"""
+    splitter = StreamingTextSplitter(chunk_size=8, chunk_overlap=0)
+    text = "\n \na\n\nba\n\nb \nb\nab\n "
+    whole = list(splitter.split_stream([text]))
+    assert list(splitter.split_stream(list(text))) == whole
+    assert (3, "a\n\nba") in whole
+
+
+def test_any_piece_split_matches_whole_text():
+    """任意分块方式的输出与整段输入相同"""
+    rng = random.Random(0)
+    alphabet = ["a", "b", " ", "\n", "\n\n", "。", "，", ". ", "!"]
+    for _ in range(300):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 80)))
+        splitter = StreamingTextSplitter(chunk_size=rng.randint(4, 20),
+                                         chunk_overlap=rng.randint(0, 3))
+        whole = list(splitter.split_stream([text]))
+        sizes = [rng.randint(1, 7) for _ in range(len(text))]
+        assert list(splitter.split_stream(_pieces(text, sizes))) == whole, text
+        assert list(splitter.split_stream(list(text))) == whole, text
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+测试本地NumPy向量索引：增删（标记删除）、从磁盘重新打开、IVF和量化近似检索
+"""
+
+import numpy as np
+import pytest
+
+from vector_index import VectorIndex, _word_dtype
+
+DIM = 32
+
+
+def _vectors(n, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, DIM)).astype(np.float32)
+
+
+def _add(index, vectors, prefix="doc"):
+    ids = [f"{prefix}-{i}" for i in range(len(vectors))]
+    index.add(ids, vectors, [f"文本{i}" for i in ids], [{"n": i} for i in range(len(vectors))])
+    return ids
+
+
+@pytest.fixture
+def index(tmp_path):
+    return VectorIndex.create(str(tmp_path / "index"), DIM)
+
+
+def _top_ids(index, query, k=1, **kwargs):
+    _, rows = index.search(query, k=k, **kwargs)
+    return [index.record(row)["id"] for row in rows[0] if row >= 0]
+
+
+def test_add_and_search_exact(index):
+    vectors = _vectors(50)
+    ids = _add(index, vectors)
+
+    assert len(index) == 50
+    for i in (0, 17, 49):
+        assert _top_ids(index, vectors[i]) == [ids[i]]
+    assert index.record(17) == {"id": "doc-17", "text": "文本doc-17", "metadata": {"n": 17}}
+
+
+def test_delete_leaves_tombstone(index):
+    vectors = _vectors(20)
+    ids = _add(index, vectors)
+
+    assert index.delete(["doc-3", "doc-5", "missing"]) == 2
+    assert len(index) == 18
+    assert index.count == 20
+    assert "doc-3" not in index.ids()
+    assert "doc-3" not in _top_ids(index, vectors[3], k=20)
+    # 只剩下两条时结果不足k个，补齐为-1
+    index.delete(ids[2:])
+    scores, rows = index.search(vectors[0], k=4)
+    assert list(rows[0][2:]) == [-1, -1]
+    assert np.all(np.isinf(scores[0][2:]))
+
+
+def test_readd_same_id_replaces_record(index):
+    vectors = _vectors(10)
+    _add(index, vectors)
+    replacement = _vectors(1, seed=1)
+    index.add(["doc-4"], replacement, ["新文本"], [{"n": 99}])
+
+    assert len(index) == 10
+    assert index.deleted[4]
+    assert _top_ids(index, replacement[0]) == ["doc-4"]
+    assert index.records(index.rows_for_ids(["doc-4"]))[0]["text"] == "新文本"
+
+
+def test_reopen_from_disk(index):
+    vectors = _vectors(30)
+    _add(index, vectors)
+    index.delete(["doc-7"])
+
+    reopened = VectorIndex(index.path)
+
+    assert VectorIndex.exists(index.path)
+    assert len(reopened) == 29
+    assert reopened.deleted[7]
+    assert sorted(reopened.ids()) == sorted(index.ids())
+    np.testing.assert_allclose(reopened.search(vectors[:5], k=3)[0],
+                               index.search(vectors[:5], k=3)[0], rtol=1e-6)
+    # 重新打开后继续追加
+    _add(reopened, _vectors(5, seed=2), prefix="more")
+    assert len(VectorIndex(index.path)) == 34
+
+
+def test_reopen_discards_unrecorded_tail(index):
+    _add(index, _vectors(10))
+    # 模拟写入中断：向量文件末尾多出头信息未记录的数据
+    with open(index._file("vectors.bin"), "ab") as f:
+        f.write(b"\0" * DIM * 4)
+
+    reopened = VectorIndex(index.path)
+    _add(reopened, _vectors(2, seed=3), prefix="after")
+
+    assert reopened.count == 12
+    assert reopened.vectors.shape == (12, DIM)
+
+
+def test_ivf_search_matches_exact_with_all_probes(index):
+    vectors = _vectors(400)
+    _add(index, vectors)
+    index.build_ivf(n_lists=8, seed=0)
+    queries = vectors[:20]
+
+    exact_scores, exact_rows = index.search(queries, k=5, exact=True)
+    ivf_scores, ivf_rows = index.search(queries, k=5, nprobe=8)
+
+    np.testing.assert_array_equal(ivf_rows, exact_rows)
+    np.testing.assert_allclose(ivf_scores, exact_scores, rtol=1e-6)
+    assert index.measure_recall(queries, k=5, nprobe=2) > 0.3
+
+
+def test_ivf_covers_rows_added_after_build_and_survives_reopen(index):
+    _add(index, _vectors(200))
+    index.build_ivf(n_lists=4)
+    late = _vectors(3, seed=4)
+    late_ids = _add(index, late, prefix="late")
+    index.delete(["doc-0"])
+
+    reopened = VectorIndex(index.path)
+
+    assert reopened.ivf_centroids is not None
+    assert reopened.ivf_indexed_count == 200
+    for vector, late_id in zip(late, late_ids):
+        assert _top_ids(reopened, vector, nprobe=1) == [late_id]
+    assert "doc-0" not in _top_ids(reopened, _vectors(1)[0], k=10, nprobe=4)
+
+
+@pytest.mark.parametrize("dim", [DIM, 20])
+def test_hamming_scores_equal_sign_inner_products(tmp_path, dim):
+    vectors = np.random.default_rng(5).normal(size=(300, dim)).astype(np.float32)
+    index = VectorIndex.create(str(tmp_path / "index"), dim, quantization="binary")
+    index.add([str(i) for i in range(300)], vectors, [""] * 300, [{}] * 300)
+    queries = vectors[:4]
+
+    words = np.packbits(queries > 0, axis=1).view(_word_dtype(index._code_dim()))
+    scores = index._hamming_scores(words, 0, 300, sub_rows=7)
+
+    signs, query_signs = np.where(vectors > 0, 1.0, -1.0), np.where(queries > 0, 1.0, -1.0)
+    np.testing.assert_array_equal(scores, query_signs @ signs.T)
+
+
+@pytest.mark.parametrize("mode", ["int8", "binary"])
+def test_quantized_search_rescores_with_full_precision(index, mode):
+    vectors = _vectors(500)
+    _add(index, vectors)
+    index.quantize(mode)
+    index.delete(["doc-1"])
+    queries = vectors[:10]
+
+    exact_scores, _ = index.search(queries, k=5, exact=True)
+    scores, rows = index.search(queries, k=5)
+
+    assert index.resident_nbytes < index.nbytes
+    assert 1 not in rows
+    # 返回的分数是全精度分数，不是量化估算值
+    np.testing.assert_allclose(scores[:, 0], exact_scores[:, 0], rtol=1e-5)
+    assert index.measure_recall(queries, k=5) >= 0.9
+    assert VectorIndex(index.path).quantization == mode